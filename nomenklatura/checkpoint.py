@@ -0,0 +1,205 @@
+import os
+import json
+import shutil
+import logging
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterable, List, Optional, Set, TextIO
+from typing import Tuple
+
+from nomenklatura.resolver import Identifier, Pair
+
+log = logging.getLogger(__name__)
+
+
+class XrefCheckpoint(object):
+    """The progress of an xref run, kept in a directory so that the run can be
+    resumed after it was interrupted. The blocked pairs are written to a file as
+    they are generated, and the state records how many of them have been
+    decided, i.e. the scoring cursor. The state is only saved after the resolver
+    has been saved, so the decisions before the cursor are never lost.
+
+    A checkpoint can only be resumed by a run with the same `params`, e.g. the
+    same limit and scoring algorithm, and on the same data: the `fingerprint`
+    of the view when the state was saved."""
+
+    VERSION = 1
+    PAIRS = "pairs.tsv"
+    STATE = "state.json"
+
+    def __init__(self, path: Path, params: Dict[str, Any]) -> None:
+        self.path = path
+        self.params = params
+        self.blocked = False
+        self.written = 0
+        self.cursor = 0
+        self.suggested = 0
+        # The latest change in the store when the pairs were blocked:
+        self.latest: Optional[str] = None
+        # The entities matched by an incremental run, and the number of blocked
+        # pairs to decide before the first and after the last pair of each:
+        self.changed: List[str] = []
+        self.reached: Dict[str, Tuple[int, int]] = {}
+        self._fh: Optional[TextIO] = None
+
+    @property
+    def pairs_path(self) -> Path:
+        return self.path / self.PAIRS
+
+    @property
+    def state_path(self) -> Path:
+        return self.path / self.STATE
+
+    def load(self, fingerprint: Optional[str] = None) -> bool:
+        """Load the state of an earlier run, if there is one which can be resumed
+        with the current parameters. If a `fingerprint` is given and does not
+        match the one of the saved state, the data has changed since and the
+        checkpoint is not resumed."""
+        if not self.state_path.exists():
+            log.info("No xref checkpoint to resume: %s", self.path)
+            return False
+        with open(self.state_path, "r") as fh:
+            state = json.load(fh)
+        if state.get("version") != self.VERSION or state["params"] != self.params:
+            log.warning("Xref checkpoint has different parameters, not resuming.")
+            return False
+        if fingerprint is not None and state.get("fingerprint") != fingerprint:
+            log.warning("Xref checkpoint is for different data, not resuming.")
+            return False
+        self.blocked = state["blocked"]
+        self.written = state["pairs"]
+        self.cursor = state["cursor"]
+        self.suggested = state["suggested"]
+        self.latest = state.get("latest")
+        self.changed = state.get("changed", [])
+        reached = state.get("reached", {}).items()
+        self.reached = {e: (first, last) for e, (first, last) in reached}
+        log.info(
+            "Resuming xref at pair %d of %d (blocking complete: %s)",
+            self.cursor,
+            self.written,
+            self.blocked,
+        )
+        return True
+
+    def saved_pairs(self) -> Generator[Tuple[Pair, float], None, None]:
+        """Generate the pairs which were blocked before the checkpoint was saved.
+        Pairs written after it are ignored, as the file may end mid-line."""
+        with open(self.pairs_path, "r") as fh:
+            for _ in range(self.written):
+                left_id, right_id, score = fh.readline().rstrip("\n").split("\t")
+                pair = (Identifier.get(left_id), Identifier.get(right_id))
+                yield pair, float(score)
+
+    def record(
+        self, pairs: Iterable[Tuple[Pair, float]]
+    ) -> Generator[Tuple[Pair, float], None, None]:
+        """Write the pairs to the checkpoint while they are generated by blocking.
+        When blocking is repeated for a resumed run, the pairs before the cursor
+        are kept at the head of the file and left out of the generated pairs."""
+        kept = list(self.saved_pairs())[: self.cursor] if self.cursor > 0 else []
+        skip: Set[Pair] = set(p for p, _ in kept)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.blocked = False
+        self.written = 0
+        self._fh = open(self.pairs_path, "w")
+        for pair, score in kept:
+            self._write(pair, score)
+        for pair, score in pairs:
+            if pair in skip:
+                continue
+            self._write(pair, score)
+            yield pair, score
+        self.blocked = True
+
+    def _write(self, pair: Pair, score: float) -> None:
+        assert self._fh is not None
+        self._fh.write(f"{pair[0].id}\t{pair[1].id}\t{score!r}\n")
+        self.written += 1
+
+    def save(
+        self, cursor: int, suggested: int, fingerprint: Optional[str] = None
+    ) -> None:
+        """Record that the pairs before `cursor` have been decided, in the data
+        with the given `fingerprint`. The state file is replaced atomically, so
+        a crash leaves the previous one."""
+        if self._fh is not None:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        self.cursor = cursor
+        self.suggested = suggested
+        state = {
+            "version": self.VERSION,
+            "params": self.params,
+            "blocked": self.blocked,
+            "pairs": self.written,
+            "cursor": cursor,
+            "suggested": suggested,
+            "latest": self.latest,
+            "changed": self.changed,
+            "reached": self.reached,
+            "fingerprint": fingerprint,
+        }
+        tmp_path = self.state_path.with_name(f"{self.STATE}.tmp")
+        with open(tmp_path, "w") as fh:
+            json.dump(state, fh)
+        os.replace(tmp_path, self.state_path)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def clear(self) -> None:
+        """Remove the checkpoint after the run has completed."""
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __repr__(self) -> str:
+        return "<XrefCheckpoint(%r, %d/%d)>" % (
+            self.path.as_posix(),
+            self.cursor,
+            self.written,
+        )
+
+
+class XrefWatermark(object):
+    """The changes in the store which incremental xref runs have covered: the
+    latest change seen by the last completed run, and the IDs of the changed
+    entities whose pairs it did not reach, e.g. because it stopped at its limit.
+    The file holds the time of the change on its first line, followed by one
+    pending entity ID per line."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.since: Optional[str] = None
+        self.pending: List[str] = []
+
+    def load(self) -> bool:
+        """Read the watermark of the last completed run, if there was one."""
+        if not self.path.exists():
+            return False
+        lines = self.path.read_text().splitlines()
+        if not len(lines) or not len(lines[0].strip()):
+            return False
+        self.since = lines[0].strip()
+        self.pending = [line for line in lines[1:] if len(line)]
+        return True
+
+    def save(self, latest: str, pending: Iterable[str]) -> None:
+        """Advance the watermark to `latest`, keeping the `pending` entities to
+        be matched by the next run. The file is replaced atomically."""
+        self.since = latest
+        self.pending = list(pending)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "w") as fh:
+            fh.write(latest)
+            for entity_id in self.pending:
+                fh.write(f"\n{entity_id}")
+        os.replace(tmp_path, self.path)
+
+    def __repr__(self) -> str:
+        return "<XrefWatermark(%r, %r, %d)>" % (
+            self.path.as_posix(),
+            self.since,
+            len(self.pending),
+        )
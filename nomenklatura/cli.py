@@ -26,6 +26,8 @@ from nomenklatura.tui import dedupe_ui
 from nomenklatura.matching.bench import bench_matcher
 
 INDEX_SEGMENT = "xref-index"
+CHECKPOINT_SUFFIX = ".xref-checkpoint"
+WATERMARK_SUFFIX = ".xref-watermark"
 
 log = logging.getLogger(__name__)
 
@@ -72,6 +74,31 @@ def cli() -> None:
     default=False,
     help="Clear the index directory, if it exists.",
 )
+@click.option(
+    "-w",
+    "--workers",
+    type=click.INT,
+    default=1,
+    help="Number of processes to use for blocking and scoring.",
+)
+@click.option(
+    "--report",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    default=None,
+    help="Write the timings of the xref phases to a JSON file.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue an interrupted run from its checkpoint.",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Only match entities which changed since the last incremental run.",
+)
 def xref_file(
     path: Path,
     resolver: Optional[Path] = None,
@@ -81,6 +108,10 @@ def xref_file(
     scored: bool = True,
     index: str = Index.name,
     clear: bool = False,
+    workers: int = 1,
+    report: Optional[Path] = None,
+    resume: bool = False,
+    incremental: bool = False,
 ) -> None:
     resolver_ = _get_resolver(path, resolver)
     store = load_entity_file_store(path, resolver=resolver_)
@@ -104,6 +135,11 @@ def xref_file(
         scored=scored,
         limit=limit,
         index_type=index,
+        workers=workers,
+        report=report,
+        checkpoint=_path_sibling(path, CHECKPOINT_SUFFIX),
+        resume=resume,
+        watermark=_path_sibling(path, WATERMARK_SUFFIX) if incremental else None,
     )
     resolver_.save()
     log.info("Xref complete in: %s", resolver_.path)
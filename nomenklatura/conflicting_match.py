@@ -14,6 +14,9 @@ from nomenklatura.statement.statement import Statement
 
 
 class ConflictingMatchReporter(Generic[CE]):
+    # Number of entities loaded from the view at a time:
+    BATCH_SIZE = 1_000
+
     def __init__(self, view: View[DS, CE], resolver: Resolver[CE], threshold: float):
         self.console = Console()
         self.view = view
@@ -69,10 +72,15 @@ class ConflictingMatchReporter(Generic[CE]):
             return
 
         self.console.print("[bold]Potential conflicting matches found:\n[/bold]")
-        for candidate_id, left_id, right_id in self.get_conflicting_matches():
-            left = self.view.get_entity(left_id)
-            right = self.view.get_entity(right_id)
-            candidate = self.view.get_entity(candidate_id)
+        ids = sorted(set(id for conflict in conflicts for id in conflict))
+        entities: Dict[str, CE] = {}
+        for start in range(0, len(ids), self.BATCH_SIZE):
+            batch = ids[start : start + self.BATCH_SIZE]
+            entities.update(self.view.get_entities(batch))
+        for candidate_id, left_id, right_id in conflicts:
+            left = entities.get(left_id)
+            right = entities.get(right_id)
+            candidate = entities.get(candidate_id)
 
             if candidate:
                 self.report_conflicting_match("Candidate", candidate)
@@ -94,10 +94,7 @@ class CompositeEntity(EntityProxy):
             if stmt.first_seen is not None:
                 first_seen.add(stmt.first_seen)
         if self.id is not None:
-            digest = sha1(self.schema.name.encode("utf-8"))
-            for id in sorted(ids):
-                digest.update(id.encode("utf-8"))
-            checksum = digest.hexdigest()
+            checksum = self._checksum(ids)
             # This is to make the last_change value stable across
             # serialisation:
             first = self.last_change or min(first_seen, default=None)
@@ -112,6 +109,19 @@ class CompositeEntity(EntityProxy):
                 last_seen=max(last_seen, default=None),
             )
 
+    def _checksum(self, ids: List[str]) -> str:
+        digest = sha1(self.schema.name.encode("utf-8"))
+        for id in sorted(ids):
+            digest.update(id.encode("utf-8"))
+        return digest.hexdigest()
+
+    @property
+    def checksum(self) -> str:
+        """A checksum of the schema and statement IDs of the entity, which
+        changes whenever a statement is added or removed. This is the value of
+        the ID statement generated by `statements`."""
+        return self._checksum([s.id for s in self._iter_stmt() if s.id is not None])
+
     @property
     def first_seen(self) -> Optional[str]:
         seen = (s.first_seen for s in self._iter_stmt() if s.first_seen is not None)
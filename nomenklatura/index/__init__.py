@@ -1,22 +1,44 @@
 import logging
 from pathlib import Path
-from typing import Type, Optional
+from typing import Any, Dict, Type, Optional
 
 from nomenklatura.index.index import Index
+from nomenklatura.index.csr_index import CSRIndex
+from nomenklatura.index.lsh_index import LSHIndex
+from nomenklatura.index.ngram_index import NGramIndex
+from nomenklatura.index.sorted_index import SortedIndex
 from nomenklatura.index.common import BaseIndex
 from nomenklatura.store import View
 from nomenklatura.dataset import DS
 from nomenklatura.entity import CE
 
 log = logging.getLogger(__name__)
-INDEX_TYPES = ["tantivy", Index.name]
+INDEX_TYPES = [
+    "tantivy",
+    Index.name,
+    CSRIndex.name,
+    LSHIndex.name,
+    NGramIndex.name,
+    SortedIndex.name,
+]
 
 
 def get_index(
-    view: View[DS, CE], path: Path, type_: Optional[str]
+    view: View[DS, CE],
+    path: Path,
+    type_: Optional[str],
+    options: Dict[str, Any] = {},
 ) -> BaseIndex[DS, CE]:
     """Get the best available index class to use."""
     clazz: Type[BaseIndex[DS, CE]] = Index[DS, CE]
+    if type_ == CSRIndex.name:
+        clazz = CSRIndex[DS, CE]
+    if type_ == LSHIndex.name:
+        clazz = LSHIndex[DS, CE]
+    if type_ == NGramIndex.name:
+        clazz = NGramIndex[DS, CE]
+    if type_ == SortedIndex.name:
+        clazz = SortedIndex[DS, CE]
     if type_ == "tantivy":
         try:
             from nomenklatura.index.tantivy_index import TantivyIndex
@@ -25,9 +47,18 @@ def get_index(
         except ImportError:
             log.warning("`tantivy` is not available, falling back to in-memory index.")
 
-    index = clazz(view, path)
-    index.build()
+    index = clazz(view, path, options=options)
+    index.prepare()
     return index
 
 
-__all__ = ["BaseIndex", "Index", "TantivyIndex", "get_index"]
+__all__ = [
+    "BaseIndex",
+    "Index",
+    "CSRIndex",
+    "LSHIndex",
+    "NGramIndex",
+    "SortedIndex",
+    "TantivyIndex",
+    "get_index",
+]
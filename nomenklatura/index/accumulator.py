@@ -0,0 +1,98 @@
+import heapq
+from operator import itemgetter
+from typing import Dict, Generator, Iterable, List, Tuple
+
+from nomenklatura.resolver import Pair
+
+
+class PairAccumulator(object):
+    """A bounded collection of the best-scoring candidate pairs produced during
+    blocking. Each pair is `put` with a complete score, or with one of several
+    complete scores of which the best is kept, e.g. when it is found from both
+    sides. Once more than `max_pairs * factor` pairs are held, the collection
+    is cut down to the best `max_pairs`, and the score of the weakest remaining
+    pair becomes the admission threshold for new pairs. A dropped pair can only
+    return with a score above the threshold, which it needs to be among the
+    best pairs anyway, so the result is the same as without the bound.
+
+    Scores which are summed up from partial scores, e.g. across tokens, must be
+    completed before they are put, as a low partial score can still add up to
+    one of the best pairs."""
+
+    FACTOR = 5
+
+    __slots__ = ("max_pairs", "capacity", "threshold", "pairs")
+
+    def __init__(
+        self, max_pairs: int, factor: int = FACTOR, threshold: float = 0.0
+    ) -> None:
+        self.max_pairs = max_pairs
+        self.capacity = max(1, max_pairs * factor)
+        self.threshold = threshold
+        self.pairs: Dict[Pair, float] = {}
+
+    def accepts(self, score: float) -> bool:
+        """Check if a new pair with the given score would be admitted."""
+        return score >= self.threshold
+
+    def put(self, pair: Pair, score: float) -> None:
+        """Keep the higher of the pair's current and the given score."""
+        current = self.pairs.get(pair)
+        if current is not None:
+            if score > current:
+                self.pairs[pair] = score
+            return
+        if score < self.threshold:
+            return
+        self.pairs[pair] = score
+        if len(self.pairs) > self.capacity:
+            self.prune()
+
+    def admit(self, batch: Iterable[Tuple[Pair, float]]) -> List[Tuple[Pair, float]]:
+        """Put a batch of pairs, and return those of them which are among the
+        best `max_pairs` pairs so far, in descending order of score. This lets
+        pairs be used as they are found: every pair of the final `result()` is
+        returned for a batch in which it is put, but so are pairs which are
+        pushed out by better ones in later batches."""
+        pairs: Dict[Pair, None] = {}
+        for pair, score in batch:
+            self.put(pair, score)
+            pairs[pair] = None
+        top = heapq.nlargest(self.max_pairs, self.pairs.values())
+        cutoff = top[-1] if len(top) >= self.max_pairs else self.threshold
+        admitted = [(p, self.pairs[p]) for p in pairs if p in self.pairs]
+        admitted = [(p, s) for p, s in admitted if s >= cutoff]
+        admitted.sort(key=itemgetter(1), reverse=True)
+        return admitted
+
+    def prune(self) -> None:
+        """Cut the collection down to the best `max_pairs` pairs and raise the
+        admission threshold to the weakest of them."""
+        top = heapq.nlargest(self.max_pairs, self.pairs.items(), key=lambda p: p[1])
+        self.pairs = dict(top)
+        if top and len(top) >= self.max_pairs:
+            self.threshold = max(self.threshold, top[-1][1])
+
+    def result(self) -> List[Tuple[Pair, float]]:
+        """Return the best `max_pairs` pairs, in descending order of score."""
+        return list(self.iter_result())
+
+    def iter_result(self) -> Generator[Tuple[Pair, float], None, None]:
+        """Generate the best `max_pairs` pairs in descending order of score,
+        like `result()`. The pairs are kept in a heap, so the first pairs are
+        available in linear time, rather than after a full sort."""
+        heap = [(-score, pair) for pair, score in self.pairs.items()]
+        heapq.heapify(heap)
+        for _ in range(min(self.max_pairs, len(heap))):
+            score, pair = heapq.heappop(heap)
+            yield pair, -score
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def __repr__(self) -> str:
+        return "<PairAccumulator(%d, %d, %.3f)>" % (
+            self.max_pairs,
+            len(self.pairs),
+            self.threshold,
+        )
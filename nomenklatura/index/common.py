@@ -1,5 +1,6 @@
 from pathlib import Path
-from typing import Generic, List, Tuple
+from typing import Any, Dict, Generator, Generic, List, Optional, Sequence, Tuple
+from followthemoney.schema import Schema
 from nomenklatura.resolver import Identifier
 from nomenklatura.dataset import DS
 from nomenklatura.entity import CE
@@ -10,16 +11,47 @@ class BaseIndex(Generic[DS, CE]):
     MAX_PAIRS = 10_000
     name: str
 
-    def __init__(self, view: View[DS, CE], data_dir: Path) -> None:
+    def __init__(
+        self, view: View[DS, CE], data_dir: Path, options: Dict[str, Any] = {}
+    ) -> None:
         raise NotImplementedError
 
     def build(self) -> None:
         raise NotImplementedError
 
+    def prepare(self) -> None:
+        """Make the index ready for use. Indexes which persist their data should
+        re-use it if it was built from the current data in the view, i.e. if
+        the view's `fingerprint()` has not changed, and re-build it otherwise."""
+        self.build()
+
     def pairs(
-        self, max_pairs: int = MAX_PAIRS
+        self, max_pairs: int = MAX_PAIRS, range: Optional[Schema] = None
     ) -> List[Tuple[Tuple[Identifier, Identifier], float]]:
+        """Generate the best `max_pairs` candidate pairs of entities in the index
+        which can be matched with each other. If a `range` is given, at least
+        one entity of each pair must be of that schema."""
         raise NotImplementedError
 
+    def iter_pairs(
+        self, max_pairs: int = MAX_PAIRS, range: Optional[Schema] = None
+    ) -> Generator[Tuple[Tuple[Identifier, Identifier], float], None, None]:
+        """Generate candidate pairs in ranked batches, as each batch is scored.
+        Every pair of `pairs()` is generated, and the pairs of each batch come
+        in descending order of score. Pairs which are later pushed out of the
+        best `max_pairs` by better ones can be generated as well, so there may
+        be more than `max_pairs` of them. Consumers can start work on the first
+        pairs before blocking is complete, and stop early. Indexes which
+        produce candidates incrementally should override this, the default
+        yields from the result of `pairs()`, so it does not stream."""
+        yield from self.pairs(max_pairs=max_pairs, range=range)
+
     def match(self, entity: CE) -> List[Tuple[Identifier, float]]:
         raise NotImplementedError
+
+    def match_many(
+        self, entities: Sequence[CE], limit: Optional[int] = None
+    ) -> List[List[Tuple[Identifier, float]]]:
+        """Match a batch of entities against the index. Returns the best `limit`
+        (entity_id, score) pairs for each of the given entities, in order."""
+        return [self.match(entity)[:limit] for entity in entities]
@@ -1,17 +1,24 @@
 import math
-from typing import Any, Dict, Generator, Tuple
+from typing import Any, Dict, Generator, List, MutableMapping, Optional, Set, Tuple
 
 from nomenklatura.resolver import Identifier
 
+SCORING_TF = "tf"
+SCORING_BM25 = "bm25"
+SCORINGS = [SCORING_TF, SCORING_BM25]
+BM25_K1 = 1.2
+BM25_B = 0.75
+
 
 class Entry(object):
     """A set of entities and a weight associated with a given term in the index."""
 
-    __slots__ = "idf", "entities"
+    __slots__ = ("entities", "weights")
 
     def __init__(self) -> None:
-        self.idf: float = 0.0
         self.entities: Dict[Identifier, int] = dict()
+        # The BM25 weights for the entities, in order, stored by `compute()`:
+        self.weights: Optional[List[float]] = None
 
     def add(self, entity_id: Identifier) -> None:
         """Mark the given entity as relevant to the entry's token."""
@@ -20,10 +27,16 @@ class Entry(object):
             self.entities[entity_id] += 1
         except KeyError:
             self.entities[entity_id] = 1
+        self.weights = None
 
     def compute(self, field: "Field") -> None:
-        """Compute weighted term frequency for scoring."""
-        self.idf = math.log(field.len / len(self.entities))
+        """Compute the BM25 weights of the token from the current statistics
+        of the field, and store them for `bm25()`."""
+        self.weights = [w for _, w in self._bm25(field, BM25_K1, BM25_B)]
+
+    def idf(self, field: "Field") -> float:
+        """The inverse document frequency of the token in the field."""
+        return math.log(field.len / max(1, len(self)))
 
     def frequencies(
         self, field: "Field"
@@ -32,8 +45,32 @@ class Entry(object):
             field_len = max(1, field.entities[entity_id])
             yield entity_id, (mentions / field_len)
 
+    def bm25(
+        self, field: "Field", k1: float = BM25_K1, b: float = BM25_B
+    ) -> Generator[Tuple[Identifier, float], None, None]:
+        """Okapi BM25 weights of the token for each entity, as stored by
+        `compute()`, or else from the field length statistics computed by
+        `Field.compute()`. Tokens which are mentioned by most entities in the
+        field get a weight close to 0."""
+        if self.weights is not None:
+            yield from zip(self.entities, self.weights)
+            return
+        yield from self._bm25(field, k1, b)
+
+    def _bm25(
+        self, field: "Field", k1: float, b: float
+    ) -> Generator[Tuple[Identifier, float], None, None]:
+        idf = self.idf(field)
+        avg_len = field.avg_len or 1.0
+        for entity_id, mentions in self.entities.items():
+            norm = k1 * (1 - b + b * field.entities[entity_id] / avg_len)
+            yield entity_id, idf * mentions * (k1 + 1) / (mentions + norm)
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
     def __repr__(self) -> str:
-        return "<Entry(%r)>" % len(self.entities)
+        return "<Entry(%r)>" % len(self)
 
     def to_dict(self) -> Dict[str, Any]:
         return {"entities": self.entities}
@@ -48,29 +85,68 @@ class Entry(object):
 class Field(object):
     """Index of all tokens of the same type."""
 
-    __slots__ = "len", "avg_len", "tokens", "entities"
+    __slots__ = "len", "avg_len", "total", "tokens", "entities", "dirty"
 
     def __init__(self) -> None:
         self.len = 0
         self.avg_len = 0.0
-        self.tokens: Dict[str, Entry] = {}
-        self.entities: Dict[Identifier, int] = {}
+        self.total = 0
+        self.tokens: MutableMapping[str, Entry] = {}
+        self.entities: MutableMapping[Identifier, int] = {}
+        # Tokens changed since the last `compute()`, `None` if all of them are:
+        self.dirty: Optional[Set[str]] = None
 
     def add(self, entity_id: Identifier, token: str) -> None:
-        if token not in self.tokens:
-            self.tokens[token] = Entry()
-        self.tokens[token].add(entity_id)
+        entry = self.tokens.get(token)
+        if entry is None:
+            entry = Entry()
+        entry.add(entity_id)
+        # Store the entry back, in case the tokens are not a plain dict:
+        self.tokens[token] = entry
         try:
             self.entities[entity_id] += 1
         except KeyError:
             self.entities[entity_id] = 1
-
-    def compute(self) -> None:
+        self.total += 1
+        if self.dirty is not None:
+            self.dirty.add(token)
+
+    def remove(self, entity_id: Identifier, token: str) -> None:
+        """Remove all mentions of the token by the given entity."""
+        entry = self.tokens.get(token)
+        if entry is None:
+            return
+        mentions = entry.entities.pop(entity_id, 0)
+        entry.weights = None
+        if not len(entry):
+            self.tokens.pop(token)
+        else:
+            self.tokens[token] = entry
+            if self.dirty is not None:
+                self.dirty.add(token)
+        count = self.entities.get(entity_id, 0) - mentions
+        if count > 0:
+            self.entities[entity_id] = count
+        else:
+            self.entities.pop(entity_id, None)
+        self.total -= mentions
+
+    def compute(self, weights: bool = False) -> None:
+        """Update the field length statistics. With `weights`, the BM25 weights
+        of the tokens which changed since the last call are computed and
+        stored, or those of all tokens on the first call. Other tokens keep the
+        weights they have, which were computed with earlier statistics: a
+        small change to the number and average length of the entities in the
+        field hardly moves them, and a rebuild computes them all again."""
         self.len = max(1, len(self.entities))
-        self.avg_len = sum(self.entities.values()) / self.len
-
-        for entry in self.tokens.values():
-            entry.compute(self)
+        self.avg_len = self.total / self.len
+        if weights:
+            tokens = self.tokens.keys() if self.dirty is None else self.dirty
+            for token in tokens:
+                entry = self.tokens.get(token)
+                if entry is not None:
+                    entry.compute(self)
+        self.dirty = set()
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -86,6 +162,7 @@ class Field(object):
         # obj.entities = cast(Dict[str, int], data.get("entities"))
         entities: Dict[str, int] = data.get("entities", {})
         obj.entities = {Identifier.get(e): c for e, c in entities.items()}
+        obj.total = sum(obj.entities.values())
         return obj
 
     def __repr__(self) -> str:
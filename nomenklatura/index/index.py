@@ -1,21 +1,85 @@
 from pathlib import Path
-import pickle
+import heapq
 import logging
-from itertools import combinations
-from typing import Any, Dict, List, Set, Tuple
+from bisect import bisect_left
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Generator, List, Mapping, MutableMapping, MutableSet
+from typing import Optional, Sequence, Set, Tuple
 from followthemoney.types import registry
+from followthemoney.schema import Schema
+import numpy as np
 
 from nomenklatura.util import PathLike
-from nomenklatura.resolver import Pair, Identifier
+from nomenklatura.resolver import Pair, Identifier, StrIdent
 from nomenklatura.dataset import DS
 from nomenklatura.entity import CE
 from nomenklatura.store import View
-from nomenklatura.index.entry import Field
-from nomenklatura.index.tokenizer import NAME_PART_FIELD, WORD_FIELD, Tokenizer
+from nomenklatura.index.entry import Entry, Field, SCORING_BM25, SCORING_TF
+from nomenklatura.index.mapped import IndexFile, MappedField, MappedEntitySet
+from nomenklatura.index.mapped import MappedSchemata
+from nomenklatura.index.mapped import read_meta, write_index
+from nomenklatura.index.tokenizer import NAME_PART_FIELD, WORD_FIELD
+from nomenklatura.index.tokenizer import Tokenizer, TokenCache
 from nomenklatura.index.common import BaseIndex
+from nomenklatura.index.accumulator import PairAccumulator
+from nomenklatura.index.schemata import SchemaFilter
+from nomenklatura.index.sparse import ENGINE_SPARSE, ENGINE_PYTHON
+from nomenklatura.index.sparse import make_matrix, sparse_pairs
 
 log = logging.getLogger(__name__)
 
+# A token posting: the field boost, the dense IDs of the entities which mention
+# the token in ascending order, and the weight of the token for each of them.
+Posting = Tuple[float, List[int], List[float]]
+# A shard of blocking work: the number of pairs to keep, the range of dense IDs
+# of the left entities of its pairs, the schema of each entity, the filter for
+# the schemata of pairs and the postings of the tokens.
+Shard = Tuple[int, int, int, List[Optional[str]], SchemaFilter, List[Posting]]
+
+
+def _entity_pairs(
+    start: int,
+    stop: int,
+    schemata: Sequence[Optional[str]],
+    schema_filter: SchemaFilter,
+    postings: Sequence[Posting],
+) -> Generator[Tuple[int, int, float], None, None]:
+    """Generate the (left, right, score) of the pairs of dense entity IDs with
+    `start <= left < stop` and `left < right`. The scores of one left entity
+    are summed up over all its tokens, and complete, before moving on to the
+    next one, so only the partial scores of a single entity are held at a
+    time."""
+    # The (posting, position) of each token of the left entities:
+    tokens: List[List[Tuple[int, int]]] = [[] for _ in range(start, stop)]
+    for num, (_, entities, _) in enumerate(postings):
+        for pos, dense_id in enumerate(entities[:-1]):
+            if start <= dense_id < stop:
+                tokens[dense_id - start].append((num, pos))
+    for left in range(start, stop):
+        scores: Dict[int, float] = {}
+        for num, pos in tokens[left - start]:
+            boost, entities, weights = postings[num]
+            lw = weights[pos]
+            if lw == 0.0:
+                continue
+            for right, rw in zip(entities[pos + 1 :], weights[pos + 1 :]):
+                if rw == 0.0:
+                    continue
+                scores[right] = scores.get(right, 0.0) + (lw + rw) * boost
+        left_schema = schemata[left]
+        for right, score in scores.items():
+            if schema_filter.check(left_schema, schemata[right]):
+                yield left, right, score
+
+
+def _shard_pairs(shard: Shard) -> List[Tuple[int, int, float]]:
+    """Compute the best pairs of a shard of left entities."""
+    max_pairs, start, stop, schemata, schema_filter, postings = shard
+    pairs = _entity_pairs(start, stop, schemata, schema_filter, postings)
+    return heapq.nlargest(max_pairs, pairs, key=itemgetter(2))
+
 
 class Index(BaseIndex[DS, CE]):
     """An in-memory search index to match entities against a given dataset."""
@@ -38,67 +102,325 @@ class Index(BaseIndex[DS, CE]):
         registry.identifier.name: 3.0,
     }
 
-    __slots__ = "view", "fields", "tokenizer", "entities"
+    MAX_TOKEN_ENTITIES = 100
+    SHARDS_PER_WORKER = 4
+    PAIR_BATCH = 10_000
+    # Number of changed entities loaded from the view at a time by `sync()`:
+    UPDATE_BATCH = 1_000
+    # Share of changed entities above which `sync()` re-builds the index:
+    MAX_CHANGED = 0.25
+    FILE_NAME = "index.bin"
+
+    __slots__ = (
+        "view",
+        "data_dir",
+        "fields",
+        "tokenizer",
+        "entities",
+        "schemata",
+        "terms",
+        "engine",
+        "scoring",
+        "workers",
+        "updates",
+    )
 
-    def __init__(self, view: View[DS, CE], data_dir: Path):
+    def __init__(
+        self, view: View[DS, CE], data_dir: Path, options: Dict[str, Any] = {}
+    ):
         self.view = view
-        self.tokenizer = Tokenizer[DS, CE]()
+        self.data_dir = data_dir
+        self.engine = str(options.get("engine", ENGINE_PYTHON))
+        self.scoring = str(options.get("scoring", SCORING_TF))
+        self.workers = int(options.get("workers", 1))
+        # Record the terms of all entities in a build, so that they can be
+        # removed or updated without re-computing them:
+        self.updates = bool(options.get("updates", False))
+        cache_size = int(options.get("token_cache_size", TokenCache.SIZE))
+        self.tokenizer = Tokenizer[DS, CE](TokenCache(cache_size))
         self.fields: Dict[str, Field] = {}
-        self.entities: Set[Identifier] = set()
+        self.entities: MutableSet[Identifier] = set()
+        # The schema of each entity, so that blocking only pairs up entities
+        # which can be matched:
+        self.schemata: MutableMapping[Identifier, str] = {}
+        # The (field, token) pairs of the entities indexed after a build, or
+        # in a build with `updates`, so that they can be removed again:
+        self.terms: Dict[Identifier, Set[Tuple[str, str]]] = {}
 
     def index(self, entity: CE) -> None:
         """Index one entity. This is not idempotent, you need to remove the
         entity before re-indexing it."""
+        self._index(entity, track=True)
+
+    def _index(self, entity: CE, track: bool) -> None:
         if not entity.schema.matchable or entity.id is None:
             return
         ident = Identifier.get(entity.id)
+        terms: Set[Tuple[str, str]] = set()
         for field, token in self.tokenizer.entity(entity):
             if field not in self.fields:
                 self.fields[field] = Field()
             self.fields[field].add(ident, token)
+            if track:
+                terms.add((field, token))
+        if track:
+            self.terms.setdefault(ident, set()).update(terms)
         self.entities.add(ident)
+        self.schemata[ident] = entity.schema.name
+
+    def _stored_terms(
+        self, ident: Identifier, entity: Optional[CE]
+    ) -> Set[Tuple[str, str]]:
+        """The (field, token) pairs of an entity whose terms were not recorded
+        when it was indexed. For fields read from an index file, they are
+        looked up in its postings. Other fields were built without the
+        `updates` option, so the tokens are re-computed from `entity` or the
+        entity in the view."""
+        terms: Set[Tuple[str, str]] = set()
+        built = False
+        for name, field in self.fields.items():
+            if isinstance(field, MappedField):
+                terms.update((name, t) for t in field.entity_tokens(ident))
+            elif ident in field.entities:
+                built = True
+        if built:
+            if entity is None:
+                entity = self.view.get_entity(ident.id)
+            if entity is not None:
+                terms.update(self.tokenizer.entity(entity))
+        return terms
+
+    def remove(self, entity_id: StrIdent, entity: Optional[CE] = None) -> None:
+        """Remove an entity from the index. The tokens of entities indexed since
+        the last build, or in a build with the `updates` option, are recorded,
+        and those of an opened index file are looked up in it. Otherwise, they
+        are re-computed from `entity`, which should be the version that was
+        indexed, or else from the entity stored in the view. If that has
+        changed since, the fields which still count the entity have to be
+        scanned for its postings. Call `commit()` to update the scoring
+        statistics afterwards."""
+        ident = Identifier.get(entity_id)
+        if ident not in self.entities:
+            return
+        terms = self.terms.pop(ident, None)
+        if terms is None:
+            terms = self._stored_terms(ident, entity)
+        for field_name, token in terms:
+            field = self.fields.get(field_name)
+            if field is not None:
+                field.remove(ident, token)
+        for field_name, field in self.fields.items():
+            if ident not in field.entities:
+                continue
+            log.warning(
+                "Scanning field %r to remove %r, enable the `updates` option.",
+                field_name,
+                ident.id,
+            )
+            tokens = [t for t, e in field.tokens.items() if ident in e.entities]
+            for token in tokens:
+                field.remove(ident, token)
+        self.entities.discard(ident)
+        self.schemata.pop(ident, None)
+
+    def update(self, entity: CE, previous: Optional[CE] = None) -> None:
+        """Re-index an entity which may already be in the index. `previous` is
+        the version of the entity which was indexed, if it is known, see
+        `remove()`. Call `commit()` to update the scoring statistics
+        afterwards."""
+        if entity.id is None:
+            return
+        self.remove(entity.id, entity=previous)
+        self.index(entity)
 
     def build(self) -> None:
         """Index all entities in the dataset."""
         log.info("Building index from: %r...", self.view)
         self.fields = {}
         self.entities = set()
+        self.schemata = {}
+        self.terms = {}
         for entity in self.view.entities():
-            self.index(entity)
+            self._index(entity, track=self.updates)
         self.commit()
-        log.info("Built index: %r", self)
+        log.info("Built index: %r, %r", self, self.tokenizer.cache)
 
     def commit(self) -> None:
-        for field in self.fields.values():
-            field.compute()
+        """Update the length statistics of the fields. With `bm25` scoring, the
+        weights of the tokens which changed since the last commit are computed
+        and stored, see `Field.compute()`, so that blocking and matching only
+        read them. Other token weights are derived when they are read."""
+        weights = self.scoring == SCORING_BM25
+        for name, field in list(self.fields.items()):
+            if not len(field.tokens):
+                self.fields.pop(name)
+                continue
+            field.compute(weights=weights)
 
-    def pairs(self, max_pairs: int = BaseIndex.MAX_PAIRS) -> List[Tuple[Pair, float]]:
+    def weights(
+        self, entry: Entry, field: Field
+    ) -> Generator[Tuple[Identifier, float], None, None]:
+        """The weight of a token for each entity which mentions it, depending
+        on the `scoring` option: either the term frequency normalised by the
+        field length (`tf`), or Okapi BM25 (`bm25`), which also weighs rare
+        tokens over common ones."""
+        if self.scoring == SCORING_BM25:
+            return entry.bm25(field)
+        return entry.frequencies(field)
+
+    def pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> List[Tuple[Pair, float]]:
         """A second method of doing xref: summing up the pairwise match value
-        for all entities lineraly. This uses a lot of memory but is really
-        fast."""
-        pairs: Dict[Pair, float] = {}
+        for all entities lineraly. The scores of the pairs of one entity are
+        completed before moving on to the next, so besides the postings, only
+        the best `max_pairs` pairs are kept in memory. Only entities whose
+        schemata can be matched are paired up, and if a `range` is given, one
+        of them must be of that schema."""
+        if self.engine == ENGINE_SPARSE:
+            return self.sparse_pairs(max_pairs=max_pairs, range=range)
+        pairs = PairAccumulator(max_pairs)
+        for batch in self._batches(pairs, range):
+            for pair, score in batch:
+                pairs.put(pair, score)
+        return pairs.result()
+
+    def iter_pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> Generator[Tuple[Pair, float], None, None]:
+        """Generate the pairs in ranked batches, see `BaseIndex.iter_pairs()`.
+        A batch is made of `PAIR_BATCH` pairs, or with several workers, of the
+        best pairs of a shard of entities. The `sparse` engine scores all pairs
+        at once, so with it, the pairs are only generated at the end."""
+        if self.engine == ENGINE_SPARSE:
+            yield from self.sparse_pairs(max_pairs=max_pairs, range=range)
+            return
+        pairs = PairAccumulator(max_pairs)
+        for batch in self._batches(pairs, range):
+            yield from pairs.admit(batch)
+
+    def _batches(
+        self, pairs: PairAccumulator, range: Optional[Schema]
+    ) -> Generator[List[Tuple[Pair, float]], None, None]:
+        """Generate batches of scored pairs which would be admitted to `pairs`
+        at the time they are scored."""
+        entities = list(self.entities)
+        dense = {e: i for i, e in enumerate(entities)}
+        schemata = [self.schemata.get(e) for e in entities]
+        postings = self._postings(dense)
+        schema_filter = SchemaFilter(range)
+        if self.workers > 1:
+            num_shards = self.workers * self.SHARDS_PER_WORKER
+            shards = self._shards(
+                postings, schemata, pairs.max_pairs, num_shards, schema_filter
+            )
+            log.info("Building index blocking pairs (%d workers)...", self.workers)
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for result in executor.map(_shard_pairs, shards):
+                    yield [
+                        (Identifier.pair(entities[left], entities[right]), score)
+                        for left, right, score in result
+                        if pairs.accepts(score)
+                    ]
+            return
         log.info("Building index blocking pairs...")
+        scored = _entity_pairs(0, len(entities), schemata, schema_filter, postings)
+        for chunk in iter(lambda: list(islice(scored, self.PAIR_BATCH)), []):
+            yield [
+                (Identifier.pair(entities[left], entities[right]), score)
+                for left, right, score in chunk
+                if pairs.accepts(score)
+            ]
+
+    def _postings(self, dense: Dict[Identifier, int]) -> List[Posting]:
+        """The postings of the tokens used for blocking, i.e. those mentioned by
+        more than one and at most `MAX_TOKEN_ENTITIES` entities."""
+        postings: List[Posting] = []
         for field_name, field in self.fields.items():
+            log.info("Blocking postings [%s]: %d tokens", field_name, len(field.tokens))
             boost = self.BOOSTS.get(field_name, 1.0)
-            for idx, entry in enumerate(field.tokens.values()):
-                if idx % 10000 == 0:
-                    log.info("Pairwise xref [%s]: %d" % (field_name, idx))
+            for entry in field.tokens.values():
+                size = len(entry)
+                if size == 1 or size > self.MAX_TOKEN_ENTITIES:
+                    continue
+                weights = sorted((dense[i], w) for i, w in self.weights(entry, field))
+                entities = [e for e, _ in weights]
+                postings.append((boost, entities, [w for _, w in weights]))
+        return postings
+
+    def _shards(
+        self,
+        postings: List[Posting],
+        schemata: List[Optional[str]],
+        max_pairs: int,
+        num_shards: int,
+        schema_filter: SchemaFilter,
+    ) -> Generator[Shard, None, None]:
+        """Split the left entities of the pairs into contiguous ranges of
+        roughly equal cost, which is the number of later entities they share a
+        token with. Each shard gets the postings of its range, without the
+        entities before it, which it never pairs up."""
+        costs = [0] * len(schemata)
+        for _, entities, _ in postings:
+            for pos, dense_id in enumerate(entities):
+                costs[dense_id] += len(entities) - pos - 1
+        shard_cost = max(1, sum(costs) // max(1, num_shards))
+        start = 0
+        cost = 0
+        for dense_id, entity_cost in enumerate(costs):
+            cost += entity_cost
+            if cost < shard_cost and dense_id < len(costs) - 1:
+                continue
+            stop = dense_id + 1
+            shard: List[Posting] = []
+            for boost, entities, weights in postings:
+                pos = bisect_left(entities, start)
+                if pos < len(entities) - 1 and entities[pos] < stop:
+                    shard.append((boost, entities[pos:], weights[pos:]))
+            yield max_pairs, start, stop, schemata, schema_filter, shard
+            start = stop
+            cost = 0
 
-                if len(entry.entities) == 1 or len(entry.entities) > 100:
+    def sparse_pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> List[Tuple[Pair, float]]:
+        """Compute the same blocking pairs as `pairs()`, but using a sparse
+        entity x token matrix of the boosted term frequencies instead of
+        enumerating the entity combinations for each token."""
+        entities = list(self.entities)
+        dense = {e: i for i, e in enumerate(entities)}
+        schemata = [self.schemata.get(e) for e in entities]
+        names = list(set(schemata))
+        codes = {n: i for i, n in enumerate(names)}
+        schema_codes = np.array([codes[s] for s in schemata], dtype=np.int32)
+        compatible = SchemaFilter(range).matrix(names)
+        rows: List[int] = []
+        cols: List[int] = []
+        weights: List[float] = []
+        col = 0
+        log.info("Building sparse blocking matrix...")
+        for field_name, field in self.fields.items():
+            boost = self.BOOSTS.get(field_name, 1.0)
+            for entry in field.tokens.values():
+                if len(entry) == 1:
+                    continue
+                if len(entry) > self.MAX_TOKEN_ENTITIES:
                     continue
-                entities = sorted(
-                    entry.frequencies(field), key=lambda f: f[1], reverse=True
-                )
-                for (left, lw), (right, rw) in combinations(entities, 2):
-                    if lw == 0.0 or rw == 0.0:
-                        continue
-                    pair = (max(left, right), min(left, right))
-                    if pair not in pairs:
-                        pairs[pair] = 0
-                    score = (lw + rw) * boost
-                    pairs[pair] += score
-
-        return sorted(pairs.items(), key=lambda p: p[1], reverse=True)[:max_pairs]
+                for ident, weight in self.weights(entry, field):
+                    rows.append(dense[ident])
+                    cols.append(col)
+                    weights.append(weight * boost)
+                col += 1
+        matrix = make_matrix(
+            np.array(rows, dtype=np.int64),
+            np.array(cols, dtype=np.int64),
+            np.array(weights, dtype=np.float64),
+            (len(entities), col),
+        )
+        ids = [e.id for e in entities]
+        return sparse_pairs(
+            matrix, ids, max_pairs, codes=schema_codes, compatible=compatible
+        )
 
     def match(self, entity: CE) -> List[Tuple[Identifier, float]]:
         """Match an entity against the index, returning a list of
@@ -111,29 +433,131 @@ class Index(BaseIndex[DS, CE]):
             entry = field.tokens.get(token)
             if entry is None:
                 continue
-            for ident, weight in entry.frequencies(field):
+            for ident, weight in self.weights(entry, field):
                 if ident not in scores:
                     scores[ident] = 0.0
                 scores[ident] += weight * self.BOOSTS.get(field_name, 1.0)
         return sorted(scores.items(), key=lambda s: s[1], reverse=True)
 
-    def save(self, path: PathLike) -> None:
-        with open(path, "wb") as fh:
-            pickle.dump(self.to_dict(), fh)
+    def match_many(
+        self, entities: Sequence[CE], limit: Optional[int] = None
+    ) -> List[List[Tuple[Identifier, float]]]:
+        """Match a batch of entities against the index. The tokens of all
+        entities are grouped first, so that each posting list is looked up and
+        weighted only once for the whole batch."""
+        queries: Dict[Tuple[str, str], List[int]] = {}
+        for idx, entity in enumerate(entities):
+            for term in self.tokenizer.entity(entity):
+                queries.setdefault(term, []).append(idx)
+        scores: List[Dict[Identifier, float]] = [{} for _ in entities]
+        for (field_name, token), idxs in queries.items():
+            field = self.fields.get(field_name)
+            if field is None:
+                continue
+            entry = field.tokens.get(token)
+            if entry is None:
+                continue
+            boost = self.BOOSTS.get(field_name, 1.0)
+            weights = [(i, w * boost) for i, w in self.weights(entry, field)]
+            for idx in idxs:
+                entity_scores = scores[idx]
+                for ident, weight in weights:
+                    entity_scores[ident] = entity_scores.get(ident, 0.0) + weight
+        results: List[List[Tuple[Identifier, float]]] = []
+        for entity_scores in scores:
+            if limit is None:
+                ranked = sorted(entity_scores.items(), key=itemgetter(1), reverse=True)
+            else:
+                ranked = heapq.nlargest(limit, entity_scores.items(), key=itemgetter(1))
+            results.append(ranked)
+        return results
+
+    def prepare(self) -> None:
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.sync(self.data_dir / self.FILE_NAME)
+
+    def sync(self, path: Path) -> None:
+        """Open the index file at `path` if it was built from the current data
+        in the view. If the data has changed since, the entities which were
+        added, changed, merged or removed are found by comparing the
+        `entity_digests()` of the view with those stored in the file. They are
+        updated in the opened index, which is written back to `path`. If there
+        is no usable index file, or more than `MAX_CHANGED` of the entities
+        changed, the index is built and written to `path` instead."""
+        fingerprint = self.view.fingerprint()
+        meta = read_meta(path) if path.exists() else {}
+        usable = meta.get("scoring") == self.scoring
+        if usable and meta.get("fingerprint") == fingerprint:
+            log.info("Using existing index: %s", path)
+            self.open(path)
+            return
+        digests = self.view.entity_digests()
+        if usable:
+            stored = IndexFile(path).digests()
+            changed = [e for e, d in digests.items() if stored.get(e) != d]
+            changed.extend(e for e in stored.keys() if e not in digests)
+            if len(stored) and len(changed) <= len(digests) * self.MAX_CHANGED:
+                self.open(path)
+                self._update_changed(changed)
+                self.save(path, fingerprint=fingerprint, digests=digests)
+                log.info("Updated index: %s (%d changed)", path, len(changed))
+                return
+        self.build()
+        self.save(path, fingerprint=fingerprint, digests=digests)
+
+    def _update_changed(self, entity_ids: List[str]) -> None:
+        """Re-index the entities with the given IDs from the view, and remove
+        those which are no longer in it."""
+        for start in range(0, len(entity_ids), self.UPDATE_BATCH):
+            batch = entity_ids[start : start + self.UPDATE_BATCH]
+            entities = self.view.get_entities(batch)
+            for entity_id in batch:
+                entity = entities.get(entity_id)
+                if entity is None:
+                    self.remove(entity_id)
+                else:
+                    self.update(entity)
+        self.commit()
+
+    def save(
+        self,
+        path: PathLike,
+        fingerprint: Optional[str] = None,
+        digests: Mapping[str, int] = {},
+    ) -> None:
+        """Write the index to a memory-mappable file, see `open()`. The
+        `fingerprint` of the view it was built from, and the `digests` of its
+        entities, are stored alongside. With `bm25` scoring, the token weights
+        are stored in the file."""
+        meta = {"fingerprint": fingerprint, "scoring": self.scoring}
+        write_index(
+            Path(path),
+            self.fields,
+            self.entities,
+            schemata=self.schemata,
+            meta=meta,
+            weights=self.scoring == SCORING_BM25,
+            digests=digests,
+        )
+
+    def open(self, path: Path) -> None:
+        """Read the index from a file written by `save()`. The file is mapped
+        into memory and tokens are only decoded when they are looked up, so
+        this is near-instant, and processes which open the same file share its
+        pages. Changes to the index are kept in memory until it is saved."""
+        file = IndexFile(path)
+        fields = file.header["fields"].items()
+        self.fields = {n: MappedField(file, m) for n, m in fields}
+        self.entities = MappedEntitySet(file)
+        self.schemata = MappedSchemata(file)
+        self.terms = {}
 
     @classmethod
     def load(cls, view: View[DS, CE], path: Path, data_dir: Path) -> "Index[DS, CE]":
+        """Load the index from the given file, or build it if the file does not
+        exist or was built from different data."""
         index = Index(view, data_dir)
-        if not path.exists():
-            log.debug("Cannot load: %r", index)
-            index.build()
-            index.save(path)
-            return index
-
-        with open(path, "rb") as fh:
-            state = pickle.load(fh)
-            index.from_dict(state)
-            index.commit()
+        index.sync(path)
         log.debug("Loaded: %r", index)
         return index
 
@@ -142,6 +566,7 @@ class Index(BaseIndex[DS, CE]):
         return {
             "fields": {n: f.to_dict() for n, f in self.fields.items()},
             "entities": [e.id for e in self.entities],
+            "schemata": {e.id: s for e, s in self.schemata.items()},
         }
 
     def from_dict(self, state: Dict[str, Any]) -> None:
@@ -150,6 +575,9 @@ class Index(BaseIndex[DS, CE]):
         self.fields = {t: Field.from_dict(i) for t, i in fields}
         entities: List[str] = state.get("entities", [])
         self.entities = set((Identifier.get(e) for e in entities))
+        schemata: Dict[str, str] = state.get("schemata", {})
+        self.schemata = {Identifier.get(e): s for e, s in schemata.items()}
+        self.terms = {}
 
     def __len__(self) -> int:
         return len(self.entities)
@@ -0,0 +1,257 @@
+import zlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from followthemoney.types import registry
+from followthemoney.schema import Schema
+
+from nomenklatura.resolver import Pair, Identifier
+from nomenklatura.dataset import DS
+from nomenklatura.entity import CE
+from nomenklatura.store import View
+from nomenklatura.index.common import BaseIndex
+from nomenklatura.index.schemata import SchemaFilter
+from nomenklatura.index.sparse import top_pairs
+from nomenklatura.index.tokenizer import NAME_PART_FIELD, WORD_FIELD
+from nomenklatura.index.tokenizer import Tokenizer, TokenCache
+
+log = logging.getLogger(__name__)
+
+# Token fields which make up the set of an entity that is MinHashed:
+LSH_FIELDS = (NAME_PART_FIELD, WORD_FIELD, registry.identifier.name)
+
+
+class LSHIndex(BaseIndex[DS, CE]):
+    """A blocking index which approximates the Jaccard similarity of the token
+    sets of entities using MinHash signatures. Signatures are cut into `bands`
+    of equal length, and entities which have an identical band are candidate
+    pairs. This takes time linear in the number of entities, instead of being
+    quadratic in the number of entities which share a common token.
+
+    More `bands` of fewer rows raise the recall of similar pairs, at the cost of
+    more candidates. With `r` rows per band, pairs with a similarity above about
+    `(1 / bands) ** (1 / r)` are likely to be found."""
+
+    name = "lsh"
+
+    NUM_PERM = 128
+    BANDS = 32
+    SEED = 42
+    MAX_BUCKET_ENTITIES = 100
+    FILE_NAME = "lsh-index.npz"
+
+    __slots__ = (
+        "view",
+        "data_dir",
+        "tokenizer",
+        "num_perm",
+        "bands",
+        "seed",
+        "coeffs",
+        "ids",
+        "id_map",
+        "schemata",
+        "signatures",
+        "buckets",
+        "_staged",
+    )
+
+    def __init__(
+        self, view: View[DS, CE], data_dir: Path, options: Dict[str, Any] = {}
+    ):
+        self.view = view
+        self.data_dir = data_dir
+        self.num_perm = int(options.get("num_perm", self.NUM_PERM))
+        self.bands = int(options.get("bands", self.BANDS))
+        if self.bands < 1 or self.num_perm % self.bands != 0:
+            msg = "Number of permutations (%d) must be a multiple of bands (%d)"
+            raise ValueError(msg % (self.num_perm, self.bands))
+        self.seed = int(options.get("seed", self.SEED))
+        cache_size = int(options.get("token_cache_size", TokenCache.SIZE))
+        self.tokenizer = Tokenizer[DS, CE](TokenCache(cache_size))
+        # Multiply-shift hash functions, one (a, b) pair per permutation:
+        rand = np.random.RandomState(self.seed)
+        max_int = np.iinfo(np.uint64).max
+        self.coeffs = rand.randint(0, max_int, size=(2, self.num_perm), dtype=np.uint64)
+        self.coeffs[0] |= np.uint64(1)
+        self.ids: List[str] = []
+        self.id_map: Dict[str, int] = {}
+        self.schemata: List[str] = []
+        self.signatures: NDArray[np.uint32] = np.zeros(
+            (0, self.num_perm), dtype=np.uint32
+        )
+        self.buckets: List[Dict[bytes, List[int]]] = []
+        self._staged: List[NDArray[np.uint32]] = []
+
+    def signature(self, entity: CE) -> Optional[NDArray[np.uint32]]:
+        """Compute the MinHash signature of the blocking tokens of an entity.
+        Returns `None` if the entity has no such tokens."""
+        hashes: Set[int] = set()
+        for field, token in self.tokenizer.entity(entity):
+            if field in LSH_FIELDS:
+                hashes.add(zlib.crc32(f"{field}:{token}".encode("utf-8")))
+        if not len(hashes):
+            return None
+        values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        products = values[:, None] * self.coeffs[0] + self.coeffs[1]
+        minimum: NDArray[np.uint64] = (products >> np.uint64(32)).min(axis=0)
+        return minimum.astype(np.uint32)
+
+    def index(self, entity: CE) -> None:
+        """Index one entity. This is not idempotent, you need to rebuild the
+        index to update an entity."""
+        if not entity.schema.matchable or entity.id is None:
+            return
+        if entity.id in self.id_map:
+            return
+        signature = self.signature(entity)
+        if signature is None:
+            return
+        self.id_map[entity.id] = len(self.ids)
+        self.ids.append(entity.id)
+        self.schemata.append(entity.schema.name)
+        self._staged.append(signature)
+
+    def build(self) -> None:
+        """Index all entities in the dataset."""
+        log.info("Building index from: %r...", self.view)
+        self.ids = []
+        self.id_map = {}
+        self.schemata = []
+        self.signatures = np.zeros((0, self.num_perm), dtype=np.uint32)
+        self._staged = []
+        for entity in self.view.entities():
+            self.index(entity)
+        self.commit()
+        log.info("Built index: %r, %r", self, self.tokenizer.cache)
+
+    def _band_keys(self, signature: NDArray[np.uint32]) -> List[bytes]:
+        rows = self.num_perm // self.bands
+        return [
+            signature[band * rows : (band + 1) * rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def commit(self) -> None:
+        """Add the staged signatures to the index and re-compute the buckets
+        of entities with identical bands."""
+        if len(self._staged):
+            staged = np.vstack(self._staged)
+            self.signatures = np.vstack((self.signatures, staged))
+            self._staged = []
+        self.buckets = [{} for _ in range(self.bands)]
+        for idx, signature in enumerate(self.signatures):
+            for band, key in enumerate(self._band_keys(signature)):
+                self.buckets[band].setdefault(key, []).append(idx)
+
+    def prepare(self) -> None:
+        path = self.data_dir / self.FILE_NAME
+        fingerprint = self.view.fingerprint()
+        if path.exists() and self.open(path, fingerprint=fingerprint):
+            log.info("Using existing index: %s", path)
+            return
+        self.build()
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.save(path, fingerprint=fingerprint)
+
+    def _params(self) -> NDArray[np.int64]:
+        return np.array([self.num_perm, self.bands, self.seed], dtype=np.int64)
+
+    def save(self, path: Path, fingerprint: Optional[str] = None) -> None:
+        """Write the signatures to an uncompressed `.npz` file."""
+        arrays: Dict[str, Any] = {
+            "fingerprint": np.array(fingerprint or ""),
+            "params": self._params(),
+            "ids": np.array(self.ids, dtype=np.str_),
+            "schemata": np.array(self.schemata, dtype=np.str_),
+            "signatures": self.signatures,
+        }
+        with open(path, "wb") as fh:
+            np.savez(fh, **arrays)
+
+    def open(self, path: Path, fingerprint: Optional[str] = None) -> bool:
+        """Read the signatures from a file written by `save()`. If a `fingerprint`
+        is given and does not match the stored one, or the file was built with
+        other hashing parameters, nothing is read and `False` is returned."""
+        with np.load(path, allow_pickle=False) as data:
+            if fingerprint is not None and str(data["fingerprint"]) != fingerprint:
+                return False
+            if not np.array_equal(data["params"], self._params()):
+                return False
+            self.ids = data["ids"].tolist()
+            self.id_map = {e: i for i, e in enumerate(self.ids)}
+            self.schemata = data["schemata"].tolist()
+            self.signatures = data["signatures"]
+            self._staged = []
+        self.commit()
+        return True
+
+    def _similarity(
+        self, left: NDArray[np.int64], right: NDArray[np.int64]
+    ) -> NDArray[np.float64]:
+        """Estimate the Jaccard similarity of pairs of entities from the share
+        of equal values in their signatures."""
+        equal = self.signatures[left] == self.signatures[right]
+        similarity: NDArray[np.float64] = equal.mean(axis=1)
+        return similarity
+
+    def pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> List[Tuple[Pair, float]]:
+        """Generate the entity pairs which share at least one band bucket, and
+        score them by their estimated Jaccard similarity. Buckets with more than
+        `MAX_BUCKET_ENTITIES` entities are skipped, like common tokens are in
+        the other indexes."""
+        num_entities = max(1, len(self.ids))
+        names, codes = np.unique(np.array(self.schemata), return_inverse=True)
+        compatible = SchemaFilter(range).matrix(names.tolist())
+        all_keys: List[NDArray[np.int64]] = []
+        log.info("Building LSH blocking pairs (%d bands)...", self.bands)
+        for buckets in self.buckets:
+            for bucket in buckets.values():
+                if len(bucket) == 1 or len(bucket) > self.MAX_BUCKET_ENTITIES:
+                    continue
+                entities = np.array(bucket, dtype=np.int64)
+                left, right = np.triu_indices(len(entities), 1)
+                lo, hi = entities[left], entities[right]
+                keep = compatible[codes[lo], codes[hi]]
+                all_keys.append(lo[keep] * num_entities + hi[keep])
+        if not len(all_keys):
+            return []
+        keys = np.unique(np.concatenate(all_keys))
+        scores = self._similarity(keys // num_entities, keys % num_entities)
+        log.info("LSH blocking: %d candidate pairs", len(keys))
+        return top_pairs(keys, scores, self.ids, max_pairs)
+
+    def match(self, entity: CE) -> List[Tuple[Identifier, float]]:
+        """Match an entity against the index, returning a list of
+        (entity_id, score) pairs of the entities which share a band bucket."""
+        signature = self.signature(entity)
+        if signature is None:
+            return []
+        candidates: Set[int] = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            candidates.update(self.buckets[band].get(key, []))
+        if not len(candidates):
+            return []
+        entities = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        scores = (self.signatures[entities] == signature).mean(axis=1)
+        order = np.argsort(-scores, kind="stable")
+        return [
+            (Identifier.get(self.ids[e]), s)
+            for e, s in zip(entities[order].tolist(), scores[order].tolist())
+        ]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __repr__(self) -> str:
+        return "<LSHIndex(%r, %d, %d/%d)>" % (
+            self.view.scope.name,
+            len(self.ids),
+            self.bands,
+            self.num_perm,
+        )
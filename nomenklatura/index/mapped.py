@@ -0,0 +1,581 @@
+import os
+import mmap
+import json
+import struct
+import logging
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Generator, Iterable, Iterator, List, Mapping, Optional
+from typing import Set, Tuple
+from typing import MutableMapping, MutableSet
+
+import numpy as np
+from numpy.typing import NDArray
+
+from nomenklatura.resolver import Identifier
+from nomenklatura.index.entry import BM25_B, BM25_K1, Entry, Field
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"NKINDEX2"
+ALIGN = 8
+Section = Dict[str, Any]
+
+
+def read_meta(path: Path) -> Dict[str, Any]:
+    """Read the metadata stored in the header of an index file, without mapping
+    the rest of the file. Returns an empty dict for files in other formats."""
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            return {}
+        (header_len,) = struct.unpack("<Q", fh.read(8))
+        header: Dict[str, Any] = json.loads(fh.read(header_len))
+        meta: Dict[str, Any] = header.get("meta", {})
+        return meta
+
+
+class StringTable(object):
+    """A sorted list of strings, stored as one UTF-8 blob and an array of offsets
+    into it. Strings are only decoded when accessed."""
+
+    __slots__ = ("offsets", "blob")
+
+    def __init__(self, offsets: NDArray[np.int64], blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __getitem__(self, idx: int) -> str:
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return str(self.blob[start:end], "utf-8")
+
+    def find(self, value: str) -> Optional[int]:
+        """Binary search for a string, returning its position in the table."""
+        idx = bisect_left(self, value)
+        if idx < len(self) and self[idx] == value:
+            return idx
+        return None
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+class IndexFile(object):
+    """A read-only, memory-mapped index file. The file begins with a magic
+    marker and a JSON header which describes the location of each array in the
+    data section that follows it. All arrays are views on the mapped pages, so
+    several processes opening the same file share its memory."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with open(path, "rb") as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[: len(MAGIC)] != MAGIC:
+            raise ValueError("Not an index file: %s" % path)
+        (header_len,) = struct.unpack_from("<Q", self.mm, len(MAGIC))
+        start = len(MAGIC) + 8
+        end = start + header_len
+        self.header: Dict[str, Any] = json.loads(self.mm[start:end])
+        self.data_offset = _align(end)
+        self.entities = self.strings(self.header["entities"])
+        # Identifiers made for the entity table, and their positions in it:
+        self._idents: List[Optional[Identifier]] = [None] * len(self.entities)
+        self._positions: Dict[Identifier, int] = {}
+
+    def identifier(self, idx: int) -> Identifier:
+        """The identifier of the entity at the given position of the entity
+        table. Identifiers are only made for the entities which are read."""
+        ident = self._idents[idx]
+        if ident is None:
+            ident = Identifier.get(self.entities[idx])
+            self._idents[idx] = ident
+            self._positions[ident] = idx
+        return ident
+
+    def position(self, ident: Identifier) -> Optional[int]:
+        """The position of an entity in the entity table, if it is in it."""
+        idx = self._positions.get(ident)
+        if idx is None:
+            idx = self.entities.find(ident.id)
+        return idx
+
+    def array(self, section: Section) -> NDArray[Any]:
+        offset = self.data_offset + int(section["offset"])
+        dtype = np.dtype(section["dtype"])
+        return np.frombuffer(self.mm, dtype, int(section["count"]), offset)
+
+    def strings(self, section: Section) -> StringTable:
+        offsets = self.array(section["offsets"])
+        blob = section["blob"]
+        start = self.data_offset + int(blob["offset"])
+        end = start + int(blob["count"])
+        return StringTable(offsets, memoryview(self.mm)[start:end])
+
+    def digests(self) -> Dict[str, int]:
+        """The checksums of the statements of each entity in the view which the
+        index was built from, see `View.entity_digests()`."""
+        section = self.header.get("digests")
+        if section is None:
+            return {}
+        ids = self.strings(section["entities"])
+        values = self.array(section["values"]).tolist()
+        return {ids[idx]: value for idx, value in enumerate(values)}
+
+    def __repr__(self) -> str:
+        return "<IndexFile(%r)>" % self.path.as_posix()
+
+
+class MappedEntry(Entry):
+    """The postings of a token in an index file, as views on the arrays of the
+    positions of the entities in the entity table, of their mention counts and
+    of their BM25 weights, if the file has them. Other weights are computed
+    from the field lengths in the file, and identifiers are only made for the
+    entities in the results. The postings are turned into a dict if the entry
+    is changed."""
+
+    __slots__ = ("file", "ids", "counts", "stored", "_entities")
+
+    def __init__(
+        self,
+        file: IndexFile,
+        ids: NDArray[np.int32],
+        counts: NDArray[np.int32],
+        stored: Optional[NDArray[np.float64]] = None,
+    ) -> None:
+        self.file = file
+        self.ids = ids
+        self.counts = counts
+        self.stored = stored
+        self.weights = None
+        self._entities: Optional[Dict[Identifier, int]] = None
+
+    @property
+    def entities(self) -> Dict[Identifier, int]:
+        if self._entities is None:
+            ids = self.ids.tolist()
+            counts = self.counts.tolist()
+            self._entities = {self.file.identifier(i): c for i, c in zip(ids, counts)}
+        return self._entities
+
+    @entities.setter
+    def entities(self, entities: Dict[Identifier, int]) -> None:
+        self._entities = entities
+
+    def _lengths(self, field: Field) -> Optional[NDArray[np.float64]]:
+        """The lengths of the field for each posting, unless the postings or the
+        lengths of the field have been changed since they were written."""
+        lengths = field.entities
+        if self._entities is not None or not isinstance(lengths, MappedEntities):
+            return None
+        if len(lengths.overlay) or len(lengths.deleted):
+            return None
+        return lengths.lengths[self.ids].astype(np.float64)
+
+    def frequencies(
+        self, field: Field
+    ) -> Generator[Tuple[Identifier, float], None, None]:
+        lengths = self._lengths(field)
+        if lengths is None:
+            yield from super().frequencies(field)
+            return
+        weights = self.counts / np.maximum(1.0, lengths)
+        for idx, weight in zip(self.ids.tolist(), weights.tolist()):
+            yield self.file.identifier(idx), weight
+
+    def bm25(
+        self, field: Field, k1: float = BM25_K1, b: float = BM25_B
+    ) -> Generator[Tuple[Identifier, float], None, None]:
+        if self._entities is None and self.stored is not None:
+            for idx, weight in zip(self.ids.tolist(), self.stored.tolist()):
+                yield self.file.identifier(idx), weight
+            return
+        lengths = None if self.weights is not None else self._lengths(field)
+        if lengths is None:
+            yield from super().bm25(field, k1=k1, b=b)
+            return
+        avg_len = field.avg_len or 1.0
+        counts = self.counts.astype(np.float64)
+        norm = k1 * (1 - b + b * lengths / avg_len)
+        weights = self.idf(field) * counts * (k1 + 1) / (counts + norm)
+        for idx, weight in zip(self.ids.tolist(), weights.tolist()):
+            yield self.file.identifier(idx), weight
+
+    def __len__(self) -> int:
+        if self._entities is None:
+            return len(self.ids)
+        return len(self._entities)
+
+
+class MappedTokens(MutableMapping[str, Entry]):
+    """The token postings of a field, read from an index file. Entries are
+    materialised when they are accessed; changes are kept in an overlay."""
+
+    def __init__(self, file: IndexFile, meta: Dict[str, Any]) -> None:
+        self.file = file
+        self.table = file.strings(meta["tokens"])
+        self.offsets = file.array(meta["offsets"])
+        self.entities = file.array(meta["entities"])
+        self.counts = file.array(meta["counts"])
+        self.weights: Optional[NDArray[np.float64]] = None
+        if "weights" in meta:
+            self.weights = file.array(meta["weights"])
+        self.overlay: Dict[str, Entry] = {}
+        self.deleted: Set[str] = set()
+        self.size = len(self.table)
+        # The postings sorted by entity, made on the first `entity_tokens()`:
+        self._by_entity: Optional[Tuple[NDArray[np.int64], NDArray[np.int32]]] = None
+        # Row of the token most recently returned by `__iter__`, so that the
+        # lookup for `items()` and `values()` can skip the binary search:
+        self._last: Tuple[Optional[str], int] = (None, 0)
+
+    def _row(self, token: str) -> Optional[int]:
+        if self._last[0] == token:
+            return self._last[1]
+        return self.table.find(token)
+
+    def _visible(self, token: str) -> bool:
+        if token in self.overlay:
+            return True
+        return token not in self.deleted and self._row(token) is not None
+
+    def entity_tokens(self, idx: int) -> List[str]:
+        """The tokens of the entity at the given position of the entity table,
+        as written to the file. This uses a reverse map of the postings, which
+        is made once and then shared by all look-ups."""
+        if self._by_entity is None:
+            order = np.argsort(self.entities, kind="stable")
+            self._by_entity = (order, self.entities[order])
+        order, entities = self._by_entity
+        start = int(np.searchsorted(entities, idx, side="left"))
+        end = int(np.searchsorted(entities, idx, side="right"))
+        rows = np.searchsorted(self.offsets, order[start:end], side="right") - 1
+        return [self.table[row] for row in rows.tolist()]
+
+    def __getitem__(self, token: str) -> Entry:
+        entry = self.overlay.get(token)
+        if entry is not None:
+            return entry
+        row = None if token in self.deleted else self._row(token)
+        if row is None:
+            raise KeyError(token)
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        weights = None if self.weights is None else self.weights[start:end]
+        ids, counts = self.entities[start:end], self.counts[start:end]
+        return MappedEntry(self.file, ids, counts, weights)
+
+    def __setitem__(self, token: str, entry: Entry) -> None:
+        if not self._visible(token):
+            self.size += 1
+        self.deleted.discard(token)
+        self.overlay[token] = entry
+
+    def __delitem__(self, token: str) -> None:
+        if not self._visible(token):
+            raise KeyError(token)
+        self.overlay.pop(token, None)
+        if self._row(token) is not None:
+            self.deleted.add(token)
+        self.size -= 1
+
+    def __contains__(self, token: object) -> bool:
+        return isinstance(token, str) and self._visible(token)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from list(self.overlay.keys())
+        for row in range(len(self.table)):
+            token = self.table[row]
+            if token in self.overlay or token in self.deleted:
+                continue
+            self._last = (token, row)
+            yield token
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class MappedEntities(MutableMapping[Identifier, int]):
+    """The number of tokens per entity in a field, read from an index file."""
+
+    def __init__(self, file: IndexFile, meta: Dict[str, Any]) -> None:
+        self.file = file
+        self.lengths = file.array(meta["lengths"])
+        self.overlay: Dict[Identifier, int] = {}
+        self.deleted: Set[Identifier] = set()
+        self.size = int(meta["size"])
+
+    def _base(self, ident: Identifier) -> Optional[int]:
+        idx = self.file.position(ident)
+        if idx is None or self.lengths[idx] == 0:
+            return None
+        return int(self.lengths[idx])
+
+    def _visible(self, ident: Identifier) -> bool:
+        if ident in self.overlay:
+            return True
+        return ident not in self.deleted and self._base(ident) is not None
+
+    def __getitem__(self, ident: Identifier) -> int:
+        value = self.overlay.get(ident)
+        if value is not None:
+            return value
+        value = None if ident in self.deleted else self._base(ident)
+        if value is None:
+            raise KeyError(ident)
+        return value
+
+    def __setitem__(self, ident: Identifier, value: int) -> None:
+        if not self._visible(ident):
+            self.size += 1
+        self.deleted.discard(ident)
+        self.overlay[ident] = value
+
+    def __delitem__(self, ident: Identifier) -> None:
+        if not self._visible(ident):
+            raise KeyError(ident)
+        self.overlay.pop(ident, None)
+        if self._base(ident) is not None:
+            self.deleted.add(ident)
+        self.size -= 1
+
+    def __contains__(self, ident: object) -> bool:
+        return self._visible(Identifier.get(str(ident)))
+
+    def __iter__(self) -> Iterator[Identifier]:
+        yield from list(self.overlay.keys())
+        for idx in np.flatnonzero(self.lengths).tolist():
+            ident = self.file.identifier(idx)
+            if ident in self.overlay or ident in self.deleted:
+                continue
+            yield ident
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class MappedEntitySet(MutableSet[Identifier]):
+    """The set of all entities in an index file, with an overlay of changes."""
+
+    def __init__(self, file: IndexFile) -> None:
+        self.file = file
+        self.added: Set[Identifier] = set()
+        self.deleted: Set[Identifier] = set()
+
+    def _base(self, ident: Identifier) -> bool:
+        return ident not in self.deleted and self.file.position(ident) is not None
+
+    def __contains__(self, ident: object) -> bool:
+        ident = Identifier.get(str(ident))
+        return ident in self.added or self._base(ident)
+
+    def add(self, ident: Identifier) -> None:
+        if not self._base(ident):
+            self.added.add(ident)
+
+    def discard(self, ident: Identifier) -> None:
+        self.added.discard(ident)
+        if self.file.position(ident) is not None:
+            self.deleted.add(ident)
+
+    def __iter__(self) -> Iterator[Identifier]:
+        yield from list(self.added)
+        for idx in range(len(self.file.entities)):
+            ident = self.file.identifier(idx)
+            if ident not in self.deleted:
+                yield ident
+
+    def __len__(self) -> int:
+        return len(self.file.entities) - len(self.deleted) + len(self.added)
+
+
+class MappedSchemata(MutableMapping[Identifier, str]):
+    """The schema name of each entity in an index file, stored as a code into
+    a list of names for each entry of the entity table."""
+
+    def __init__(self, file: IndexFile) -> None:
+        meta = file.header["schemata"]
+        self.file = file
+        self.schemata: List[str] = meta["names"]
+        self.codes = file.array(meta["codes"])
+        self.overlay: Dict[Identifier, str] = {}
+        self.deleted: Set[Identifier] = set()
+        self.size = int(np.count_nonzero(self.codes >= 0))
+
+    def _base(self, ident: Identifier) -> Optional[str]:
+        idx = self.file.position(ident)
+        if idx is None or self.codes[idx] < 0:
+            return None
+        return self.schemata[int(self.codes[idx])]
+
+    def _visible(self, ident: Identifier) -> bool:
+        if ident in self.overlay:
+            return True
+        return ident not in self.deleted and self._base(ident) is not None
+
+    def __getitem__(self, ident: Identifier) -> str:
+        value = self.overlay.get(ident)
+        if value is not None:
+            return value
+        value = None if ident in self.deleted else self._base(ident)
+        if value is None:
+            raise KeyError(ident)
+        return value
+
+    def __setitem__(self, ident: Identifier, value: str) -> None:
+        if not self._visible(ident):
+            self.size += 1
+        self.deleted.discard(ident)
+        self.overlay[ident] = value
+
+    def __delitem__(self, ident: Identifier) -> None:
+        if not self._visible(ident):
+            raise KeyError(ident)
+        self.overlay.pop(ident, None)
+        if self._base(ident) is not None:
+            self.deleted.add(ident)
+        self.size -= 1
+
+    def __contains__(self, ident: object) -> bool:
+        return self._visible(Identifier.get(str(ident)))
+
+    def __iter__(self) -> Iterator[Identifier]:
+        yield from list(self.overlay.keys())
+        for idx in np.flatnonzero(self.codes >= 0).tolist():
+            ident = self.file.identifier(idx)
+            if ident in self.overlay or ident in self.deleted:
+                continue
+            yield ident
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class MappedField(Field):
+    """A field which reads its postings from an index file."""
+
+    __slots__ = ("mapped",)
+
+    def __init__(self, file: IndexFile, meta: Dict[str, Any]) -> None:
+        self.len = int(meta["len"])
+        self.avg_len = float(meta["avg_len"])
+        self.total = int(meta["total"])
+        self.mapped = MappedTokens(file, meta)
+        self.tokens = self.mapped
+        self.entities = MappedEntities(file, meta)
+        self.dirty = set()
+
+    def entity_tokens(self, ident: Identifier) -> List[str]:
+        """The tokens of an entity in the index file, see
+        `MappedTokens.entity_tokens()`."""
+        idx = self.mapped.file.position(ident)
+        if idx is None:
+            return []
+        return self.mapped.entity_tokens(idx)
+
+
+def _align(pos: int) -> int:
+    return pos + (-pos % ALIGN)
+
+
+class _SectionWriter(object):
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.pos = 0
+
+    def add(self, array: NDArray[Any]) -> Section:
+        data = array.tobytes()
+        section = {"offset": self.pos, "dtype": array.dtype.str, "count": len(array)}
+        padding = -len(data) % ALIGN
+        self.chunks.append(data + b"\0" * padding)
+        self.pos += len(data) + padding
+        return section
+
+    def strings(self, values: List[str]) -> Section:
+        encoded = [v.encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return {"offsets": self.add(offsets), "blob": self.add(blob)}
+
+
+def write_index(
+    path: Path,
+    fields: Mapping[str, Field],
+    entities: Iterable[Identifier],
+    schemata: Mapping[Identifier, str] = {},
+    meta: Dict[str, Any] = {},
+    weights: bool = False,
+    digests: Mapping[str, int] = {},
+) -> None:
+    """Write the fields and entities of an index to a memory-mappable file. The
+    `schemata` of the entities are stored as a code per entity. With `weights`,
+    the BM25 weight of each posting is stored as well, so that it does not need
+    to be computed when the file is read. The `digests` of the entities in the
+    view are stored to find the ones which changed later, see `Index.sync()`."""
+    ids = sorted(e.id for e in entities)
+    dense = {e: i for i, e in enumerate(ids)}
+    writer = _SectionWriter()
+    names = sorted(set(schemata.values()))
+    name_codes = {n: i for i, n in enumerate(names)}
+    codes = np.full(len(ids), -1, dtype=np.int32)
+    for ident, schema in schemata.items():
+        idx = dense.get(ident.id)
+        if idx is not None:
+            codes[idx] = name_codes[schema]
+    header: Dict[str, Any] = {
+        "meta": meta,
+        "entities": writer.strings(ids),
+        "schemata": {"names": names, "codes": writer.add(codes)},
+        "fields": {},
+    }
+    if len(digests):
+        digest_ids = sorted(digests.keys())
+        values = np.array([digests[e] for e in digest_ids], dtype=np.uint64)
+        header["digests"] = {
+            "entities": writer.strings(digest_ids),
+            "values": writer.add(values),
+        }
+    for name, field in fields.items():
+        tokens = sorted(field.tokens.keys())
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        postings: List[int] = []
+        counts: List[int] = []
+        scores: List[float] = []
+        for row, token in enumerate(tokens):
+            entry = field.tokens[token]
+            # Read the weights first, which mapped entries have stored:
+            if weights:
+                bm25 = {dense[i.id]: w for i, w in entry.bm25(field)}
+            mentions = sorted((dense[i.id], c) for i, c in entry.entities.items())
+            postings.extend(e for e, _ in mentions)
+            counts.extend(c for _, c in mentions)
+            if weights:
+                scores.extend(bm25[e] for e, _ in mentions)
+            offsets[row + 1] = len(postings)
+        lengths = np.zeros(len(ids), dtype=np.int32)
+        for ident, count in field.entities.items():
+            lengths[dense[ident.id]] = count
+        header["fields"][name] = {
+            "len": field.len,
+            "avg_len": field.avg_len,
+            "total": field.total,
+            "size": len(field.entities),
+            "tokens": writer.strings(tokens),
+            "offsets": writer.add(offsets),
+            "entities": writer.add(np.array(postings, dtype=np.int32)),
+            "counts": writer.add(np.array(counts, dtype=np.int32)),
+            "lengths": writer.add(lengths),
+        }
+        if weights:
+            array = np.array(scores, dtype=np.float64)
+            header["fields"][name]["weights"] = writer.add(array)
+
+    header_data = json.dumps(header).encode("utf-8")
+    prefix = MAGIC + struct.pack("<Q", len(header_data)) + header_data
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as fh:
+        fh.write(prefix)
+        fh.write(b"\0" * (_align(len(prefix)) - len(prefix)))
+        for chunk in writer.chunks:
+            fh.write(chunk)
+    # Replace the file atomically, so that existing mappings remain valid:
+    os.replace(tmp_path, path)
+    log.info("Wrote index file: %s (%d entities)", path, len(ids))
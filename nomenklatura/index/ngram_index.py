@@ -0,0 +1,301 @@
+import logging
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.sparse import csr_matrix  # type: ignore
+from followthemoney.types import registry
+from followthemoney.schema import Schema
+
+from nomenklatura.resolver import Pair, Identifier
+from nomenklatura.dataset import DS
+from nomenklatura.entity import CE
+from nomenklatura.store import View
+from nomenklatura.util import fingerprint_name
+from nomenklatura.index.common import BaseIndex
+from nomenklatura.index.schemata import SchemaFilter
+from nomenklatura.index.sparse import CHUNK_SIZE, top_pairs
+
+log = logging.getLogger(__name__)
+
+
+class NGramIndex(BaseIndex[DS, CE]):
+    """A fuzzy search index over the character n-grams of the fingerprinted
+    names of entities. Each entity is a TF-IDF weighted, L2-normalised vector of
+    n-grams, so that the cosine similarity of two entities is the dot product of
+    their vectors. This tolerates typos and transliteration variants, like
+    `Mohammed` and `Muhamad`, which never share an exact token."""
+
+    name = "ngram"
+
+    NGRAM_SIZE = 3
+    TOP_K = 20
+    MIN_SIMILARITY = 0.3
+    MAX_DF = 0.01
+    MIN_COMMON = 20
+    FILE_NAME = "ngram-index.npz"
+
+    __slots__ = (
+        "view",
+        "data_dir",
+        "ngram_size",
+        "top_k",
+        "min_similarity",
+        "max_df",
+        "ids",
+        "id_map",
+        "schemata",
+        "vocabulary",
+        "counts",
+        "idf",
+        "matrix",
+        "_rows",
+        "_cols",
+    )
+
+    def __init__(
+        self, view: View[DS, CE], data_dir: Path, options: Dict[str, Any] = {}
+    ):
+        self.view = view
+        self.data_dir = data_dir
+        self.ngram_size = int(options.get("ngram_size", self.NGRAM_SIZE))
+        self.top_k = int(options.get("top_k", self.TOP_K))
+        self.min_similarity = float(options.get("min_similarity", self.MIN_SIMILARITY))
+        self.max_df = float(options.get("max_df", self.MAX_DF))
+        self.ids: List[str] = []
+        self.id_map: Dict[str, int] = {}
+        self.schemata: List[str] = []
+        self.vocabulary: Dict[str, int] = {}
+        # Raw n-gram counts per entity, and their TF-IDF weighted form:
+        self.counts = csr_matrix((0, 0), dtype=np.float64)
+        self.idf: NDArray[np.float64] = np.zeros(0, dtype=np.float64)
+        self.matrix = csr_matrix((0, 0), dtype=np.float64)
+        self._rows = array("q")
+        self._cols = array("q")
+
+    def ngrams(self, entity: CE) -> List[str]:
+        """The character n-grams of all names of the entity. Names are padded
+        with a space, so that n-grams at the start and end of a word are
+        distinct from those within it."""
+        ngrams: List[str] = []
+        for name in entity.get_type_values(registry.name, matchable=True):
+            norm = fingerprint_name(name)
+            if norm is None:
+                continue
+            norm = f" {norm} "
+            for idx in range(max(1, len(norm) - self.ngram_size + 1)):
+                ngrams.append(norm[idx : idx + self.ngram_size])
+        return ngrams
+
+    def index(self, entity: CE) -> None:
+        """Index one entity. This is not idempotent, you need to rebuild the
+        index to update an entity."""
+        if not entity.schema.matchable or entity.id is None:
+            return
+        if entity.id in self.id_map:
+            return
+        ngrams = self.ngrams(entity)
+        if not len(ngrams):
+            return
+        row = len(self.ids)
+        self.id_map[entity.id] = row
+        self.ids.append(entity.id)
+        self.schemata.append(entity.schema.name)
+        for ngram in ngrams:
+            col = self.vocabulary.get(ngram)
+            if col is None:
+                col = len(self.vocabulary)
+                self.vocabulary[ngram] = col
+            self._rows.append(row)
+            self._cols.append(col)
+
+    def build(self) -> None:
+        """Index all entities in the dataset."""
+        log.info("Building index from: %r...", self.view)
+        self.ids = []
+        self.id_map = {}
+        self.schemata = []
+        self.vocabulary = {}
+        self.counts = csr_matrix((0, 0), dtype=np.float64)
+        for entity in self.view.entities():
+            self.index(entity)
+        self.commit()
+        log.info("Built index: %r", self)
+
+    def commit(self) -> None:
+        """Merge the staged n-grams into the count matrix, and re-compute the
+        IDF and the normalised TF-IDF vector of each entity."""
+        shape = (len(self.ids), len(self.vocabulary))
+        counts = self.counts.copy()
+        counts.resize(shape)
+        if len(self._rows):
+            rows = np.frombuffer(self._rows, np.int64)
+            cols = np.frombuffer(self._cols, np.int64)
+            ones = np.ones(len(rows), dtype=np.float64)
+            counts = counts + csr_matrix((ones, (rows, cols)), shape=shape)
+            self._rows = array("q")
+            self._cols = array("q")
+        self.counts = csr_matrix(counts)
+        freqs = np.bincount(self.counts.indices, minlength=shape[1])
+        self.idf = np.log((1 + shape[0]) / (1 + freqs)) + 1.0
+        matrix = self.counts.copy()
+        matrix.data = matrix.data * self.idf[matrix.indices]
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        matrix.data = matrix.data / np.repeat(
+            np.maximum(norms, 1e-12), np.diff(matrix.indptr)
+        )
+        self.matrix = matrix
+
+    def prepare(self) -> None:
+        path = self.data_dir / self.FILE_NAME
+        fingerprint = self.view.fingerprint()
+        if path.exists() and self.open(path, fingerprint=fingerprint):
+            log.info("Using existing index: %s", path)
+            return
+        self.build()
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.save(path, fingerprint=fingerprint)
+
+    def save(self, path: Path, fingerprint: Optional[str] = None) -> None:
+        """Write the n-gram counts to an uncompressed `.npz` file."""
+        arrays: Dict[str, Any] = {
+            "fingerprint": np.array(fingerprint or ""),
+            "ngram_size": np.array(self.ngram_size),
+            "ids": np.array(self.ids, dtype=np.str_),
+            "schemata": np.array(self.schemata, dtype=np.str_),
+            "vocabulary": np.array(list(self.vocabulary), dtype=np.str_),
+            "data": self.counts.data,
+            "indices": self.counts.indices,
+            "indptr": self.counts.indptr,
+        }
+        with open(path, "wb") as fh:
+            np.savez(fh, **arrays)
+
+    def open(self, path: Path, fingerprint: Optional[str] = None) -> bool:
+        """Read the index from a file written by `save()`. If a `fingerprint` is
+        given and does not match the stored one, or the file uses a different
+        n-gram size, nothing is read and `False` is returned."""
+        with np.load(path, allow_pickle=False) as data:
+            if fingerprint is not None and str(data["fingerprint"]) != fingerprint:
+                return False
+            if int(data["ngram_size"]) != self.ngram_size:
+                return False
+            self.ids = data["ids"].tolist()
+            self.id_map = {e: i for i, e in enumerate(self.ids)}
+            self.schemata = data["schemata"].tolist()
+            vocabulary = data["vocabulary"].tolist()
+            self.vocabulary = {n: i for i, n in enumerate(vocabulary)}
+            shape = (len(self.ids), len(self.vocabulary))
+            parts = (data["data"], data["indices"], data["indptr"])
+            self.counts = csr_matrix(parts, shape=shape)
+        self.commit()
+        return True
+
+    def _top_k(
+        self,
+        rows: NDArray[np.int64],
+        cols: NDArray[np.int64],
+        scores: NDArray[np.float64],
+    ) -> NDArray[np.bool_]:
+        """Select the `top_k` highest scores in each row."""
+        order = np.lexsort((-scores, rows))
+        sorted_rows = rows[order]
+        starts = np.searchsorted(sorted_rows, sorted_rows, side="left")
+        keep = np.zeros(len(rows), dtype=np.bool_)
+        keep[order] = (np.arange(len(rows)) - starts) < self.top_k
+        return keep
+
+    def pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> List[Tuple[Pair, float]]:
+        """Find the `top_k` most similar entities for each entity in the index,
+        with a cosine similarity of at least `min_similarity`. Candidates which
+        share a rare n-gram are found with a sparse matrix product, in chunks of
+        rows, and the best of them are scored with all of their n-grams."""
+        if len(self.ids) == 0:
+            return []
+        names, codes = np.unique(np.array(self.schemata), return_inverse=True)
+        compatible = SchemaFilter(range).matrix(names.tolist())
+        return self._similar_pairs(max_pairs, codes, compatible)
+
+    def _candidates(self) -> Any:
+        """The transposed TF-IDF matrix without the n-grams which occur in more
+        than `max_df` of the entities (and more than `MIN_COMMON`), like `ing`
+        or ` gm`. Multiplying with it only finds entities which share a rare
+        n-gram, instead of comparing nearly every entity with every other one."""
+        freqs = np.bincount(self.counts.indices, minlength=self.counts.shape[1])
+        cutoff = max(self.MIN_COMMON, self.max_df * len(self.ids))
+        matrix = self.matrix.copy()
+        matrix.data[freqs[matrix.indices] > cutoff] = 0.0
+        matrix.eliminate_zeros()
+        return matrix.transpose().tocsr()
+
+    def _similar_pairs(
+        self,
+        max_pairs: int,
+        codes: NDArray[np.int64],
+        compatible: NDArray[np.bool_],
+    ) -> List[Tuple[Pair, float]]:
+        num_entities = len(self.ids)
+        candidates = self._candidates()
+        all_keys: List[NDArray[np.int64]] = []
+        all_scores: List[NDArray[np.float64]] = []
+        for start in range(0, num_entities, CHUNK_SIZE):
+            end = min(num_entities, start + CHUNK_SIZE)
+            log.info("N-gram blocking: %d/%d entities...", start, num_entities)
+            shared = (self.matrix[start:end] @ candidates).tocoo()
+            left = shared.row.astype(np.int64) + start
+            right = shared.col.astype(np.int64)
+            keep = (left != right) & compatible[codes[left], codes[right]]
+            left, right, scores = left[keep], right[keep], shared.data[keep]
+            keep = self._top_k(left, right, scores)
+            left, right = left[keep], right[keep]
+            # The remaining candidates are scored with all of their n-grams:
+            products = self.matrix[left].multiply(self.matrix[right])
+            scores = np.asarray(products.sum(axis=1)).ravel()
+            keep = scores >= self.min_similarity
+            lo = np.minimum(left[keep], right[keep])
+            hi = np.maximum(left[keep], right[keep])
+            all_keys.append(lo * num_entities + hi)
+            all_scores.append(scores[keep])
+        # Pairs found from both of their entities are only counted once:
+        keys, first = np.unique(np.concatenate(all_keys), return_index=True)
+        scores = np.concatenate(all_scores)[first]
+        return top_pairs(keys, scores, self.ids, max_pairs)
+
+    def match(self, entity: CE) -> List[Tuple[Identifier, float]]:
+        """Match an entity against the index, returning a list of
+        (entity_id, score) pairs ranked by the cosine similarity of their
+        names."""
+        counts: Dict[int, float] = {}
+        for ngram in self.ngrams(entity):
+            col = self.vocabulary.get(ngram)
+            if col is not None:
+                counts[col] = counts.get(col, 0.0) + 1.0
+        if not len(counts) or not len(self.ids):
+            return []
+        cols = np.array(list(counts.keys()), dtype=np.int64)
+        weights = np.array(list(counts.values())) * self.idf[cols]
+        weights = weights / np.linalg.norm(weights)
+        query = csr_matrix(
+            (weights, (np.zeros(len(cols), dtype=np.int64), cols)),
+            shape=(1, len(self.vocabulary)),
+        )
+        scores = (self.matrix @ query.transpose()).tocoo()
+        order = np.argsort(-scores.data, kind="stable")
+        return [
+            (Identifier.get(self.ids[e]), s)
+            for e, s in zip(scores.row[order].tolist(), scores.data[order].tolist())
+        ]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __repr__(self) -> str:
+        return "<NGramIndex(%r, %d, %d)>" % (
+            self.view.scope.name,
+            len(self.ids),
+            len(self.vocabulary),
+        )
@@ -0,0 +1,80 @@
+from itertools import combinations, product
+from typing import Dict, Generator, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+from numpy.typing import NDArray
+from followthemoney import model
+from followthemoney.schema import Schema
+
+T = TypeVar("T")
+
+
+class SchemaFilter(object):
+    """Decide which entities can be paired up during blocking, based on their
+    schemata: both must be able to match each other, and if a `range` is given,
+    at least one of them must be within it. Entities with an unknown schema are
+    paired with anything."""
+
+    __slots__ = ("range", "cache")
+
+    def __init__(self, range: Optional[Schema] = None) -> None:
+        # Keep the name only, so that the filter can be sent to other processes:
+        self.range = range.name if range is not None else None
+        self.cache: Dict[Tuple[Optional[str], Optional[str]], bool] = {}
+
+    def check(self, left: Optional[str], right: Optional[str]) -> bool:
+        """Check if entities with the given schemata can form a pair."""
+        key = (left, right)
+        allowed = self.cache.get(key)
+        if allowed is None:
+            allowed = self._check(left, right)
+            self.cache[key] = allowed
+        return allowed
+
+    def _check(self, left: Optional[str], right: Optional[str]) -> bool:
+        left_schema = model.get(left) if left is not None else None
+        right_schema = model.get(right) if right is not None else None
+        if left_schema is None or right_schema is None:
+            return True
+        if not left_schema.can_match(right_schema):
+            return False
+        if self.range is None:
+            return True
+        return left_schema.is_a(self.range) or right_schema.is_a(self.range)
+
+    def matrix(self, schemata: Sequence[Optional[str]]) -> NDArray[np.bool_]:
+        """A square matrix of the `check()` results for a list of schemata, to
+        filter pairs of entities by their schema codes using array indexing."""
+        size = len(schemata)
+        matrix = np.zeros((size, size), dtype=np.bool_)
+        for i, left in enumerate(schemata):
+            for j, right in enumerate(schemata):
+                matrix[i, j] = self.check(left, right)
+        return matrix
+
+    def combinations(
+        self, items: Sequence[T], schemata: Sequence[Optional[str]]
+    ) -> Generator[Tuple[T, T], None, None]:
+        """Generate all pairs of items whose schemata are compatible. Items are
+        grouped by schema first, so incompatible pairs are never enumerated.
+        Within each group, the order of the items is preserved."""
+        groups: Dict[Optional[str], List[T]] = {}
+        for item, schema in zip(items, schemata):
+            groups.setdefault(schema, []).append(item)
+        if len(groups) == 1:
+            for schema, group in groups.items():
+                if self.check(schema, schema):
+                    yield from combinations(group, 2)
+            return
+        names = list(groups.keys())
+        for idx, left in enumerate(names):
+            for right in names[idx:]:
+                if not self.check(left, right):
+                    continue
+                if left == right:
+                    yield from combinations(groups[left], 2)
+                else:
+                    yield from product(groups[left], groups[right])
+
+    def __repr__(self) -> str:
+        return "<SchemaFilter(%r)>" % self.range
@@ -0,0 +1,227 @@
+import logging
+from bisect import bisect_left
+from itertools import islice
+from os.path import commonprefix
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Optional, Set, Tuple
+
+from rigour.ids import StrictFormat
+from followthemoney.types import registry
+from followthemoney.schema import Schema
+
+from nomenklatura.resolver import Pair, Identifier
+from nomenklatura.dataset import DS
+from nomenklatura.entity import CE
+from nomenklatura.store import View
+from nomenklatura.util import fingerprint_name, soundex_token
+from nomenklatura.index.common import BaseIndex
+from nomenklatura.index.accumulator import PairAccumulator
+from nomenklatura.index.schemata import SchemaFilter
+
+log = logging.getLogger(__name__)
+
+KEY_NAME = "name"
+KEY_PHONETIC = "phonetic"
+KEY_IDENTIFIER = "identifier"
+
+
+class SortedIndex(BaseIndex[DS, CE]):
+    """A sorted-neighbourhood blocking index. Entities are sorted by several
+    keys derived from their names and identifiers, and each entity is paired up
+    with those within a sliding `window` of the sort order. Building the index
+    takes `O(n log n)` time, and pairs are scored one entity at a time from its
+    neighbours, keeping only the best `max_pairs` of them. This makes it a fast
+    first pass on large datasets which are dominated by names, before using a
+    heavier index."""
+
+    name = "sorted"
+
+    WINDOW = 10
+    PAIR_BATCH = 10_000
+    BOOSTS = {
+        KEY_NAME: 1.0,
+        KEY_PHONETIC: 0.5,
+        KEY_IDENTIFIER: 2.0,
+    }
+
+    __slots__ = ("view", "data_dir", "window", "ids", "id_map", "schemata", "keys")
+
+    def __init__(
+        self, view: View[DS, CE], data_dir: Path, options: Dict[str, Any] = {}
+    ):
+        self.view = view
+        self.data_dir = data_dir
+        self.window = max(2, int(options.get("window", self.WINDOW)))
+        self.ids: List[str] = []
+        self.id_map: Dict[str, int] = {}
+        self.schemata: List[str] = []
+        # The (sort key, dense entity ID) pairs for each type of key:
+        self.keys: Dict[str, List[Tuple[str, int]]] = {k: [] for k in self.BOOSTS}
+
+    @classmethod
+    def entity_keys(cls, entity: CE) -> Generator[Tuple[str, str], None, None]:
+        """Generate the (type, sort key) pairs for an entity: the name parts of
+        each name in alphabetical order, their phonetic codes in the same way,
+        and the normalised identifiers."""
+        keys: Set[Tuple[str, str]] = set()
+        for name in entity.get_type_values(registry.name, matchable=True):
+            norm = fingerprint_name(name)
+            if norm is None:
+                continue
+            parts = sorted(norm.split())
+            if not len(parts):
+                continue
+            keys.add((KEY_NAME, " ".join(parts)))
+            phonetic = sorted(soundex_token(p) for p in parts)
+            keys.add((KEY_PHONETIC, " ".join(phonetic)))
+        for value in entity.get_type_values(registry.identifier, matchable=True):
+            clean_id = StrictFormat.normalize(value)
+            if clean_id is not None:
+                keys.add((KEY_IDENTIFIER, clean_id))
+        yield from keys
+
+    def index(self, entity: CE) -> None:
+        """Index one entity. This is not idempotent, you need to rebuild the
+        index to update an entity. Call `commit()` to sort the keys."""
+        if not entity.schema.matchable or entity.id is None:
+            return
+        if entity.id in self.id_map:
+            return
+        keys = list(self.entity_keys(entity))
+        if not len(keys):
+            return
+        dense_id = len(self.ids)
+        for type_, key in keys:
+            self.keys[type_].append((key, dense_id))
+        self.id_map[entity.id] = dense_id
+        self.ids.append(entity.id)
+        self.schemata.append(entity.schema.name)
+
+    def build(self) -> None:
+        """Index all entities in the dataset."""
+        log.info("Building index from: %r...", self.view)
+        self.ids = []
+        self.id_map = {}
+        self.schemata = []
+        self.keys = {k: [] for k in self.BOOSTS}
+        for entity in self.view.entities():
+            self.index(entity)
+        self.commit()
+        log.info("Built index: %r", self)
+
+    def commit(self) -> None:
+        for keys in self.keys.values():
+            keys.sort()
+
+    @staticmethod
+    def similarity(left: str, right: str) -> float:
+        """The share of the longer key which is a common prefix of both keys.
+        Neighbours in the sort order share a prefix, so this is cheap to compute
+        and distinguishes near neighbours from distant ones."""
+        if left == right:
+            return 1.0
+        return len(commonprefix((left, right))) / max(len(left), len(right))
+
+    def pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> List[Tuple[Pair, float]]:
+        """Pair up each entity with the entities within the `window` around it
+        in the sort order of each type of key. The score of a pair is the sum
+        over the types of key of the boosted similarity of the keys where the
+        pair first occurs in that order."""
+        pairs = PairAccumulator(max_pairs)
+        for batch in self._batches(pairs, range):
+            for pair, score in batch:
+                pairs.put(pair, score)
+        return pairs.result()
+
+    def iter_pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> Generator[Tuple[Pair, float], None, None]:
+        """Generate the pairs in ranked batches of `PAIR_BATCH` scored pairs,
+        see `BaseIndex.iter_pairs()`."""
+        pairs = PairAccumulator(max_pairs)
+        for batch in self._batches(pairs, range):
+            yield from pairs.admit(batch)
+
+    def _positions(self) -> Dict[str, List[List[int]]]:
+        """The positions of the keys of each entity in each sort order."""
+        positions: Dict[str, List[List[int]]] = {}
+        for type_, keys in self.keys.items():
+            positions[type_] = [[] for _ in self.ids]
+            for idx, (_, dense_id) in enumerate(keys):
+                positions[type_][dense_id].append(idx)
+        return positions
+
+    def _entity_pairs(
+        self, schema_filter: SchemaFilter
+    ) -> Generator[Tuple[int, int, float], None, None]:
+        """Generate the (left, right, score) of each pair of dense entity IDs,
+        with `left < right`. The pairs of one left entity are scored completely
+        before moving on to the next one, so only the neighbours of a single
+        entity are held at a time."""
+        positions = self._positions()
+        window = self.window - 1
+        for left in range(len(self.ids)):
+            scores: Dict[int, float] = {}
+            for type_, keys in self.keys.items():
+                # The first pair of positions in the sort order at which each
+                # right entity is a neighbour of the left one:
+                first: Dict[int, Tuple[int, int]] = {}
+                for pos in positions[type_][left]:
+                    start = max(0, pos - window)
+                    for other in range(start, min(len(keys), pos + window + 1)):
+                        right = keys[other][1]
+                        if right <= left:
+                            continue
+                        occurrence = (min(pos, other), max(pos, other))
+                        current = first.get(right)
+                        if current is None or occurrence < current:
+                            first[right] = occurrence
+                boost = self.BOOSTS[type_]
+                for right, (lo, hi) in first.items():
+                    score = self.similarity(keys[lo][0], keys[hi][0]) * boost
+                    if score > 0.0:
+                        scores[right] = scores.get(right, 0.0) + score
+            for right, score in scores.items():
+                if schema_filter.check(self.schemata[left], self.schemata[right]):
+                    yield left, right, score
+
+    def _batches(
+        self, pairs: PairAccumulator, range: Optional[Schema]
+    ) -> Generator[List[Tuple[Pair, float]], None, None]:
+        """Generate batches of scored pairs which would be admitted to `pairs`
+        at the time they are scored."""
+        log.info("Sorted neighbourhood: %d entities", len(self.ids))
+        scored = self._entity_pairs(SchemaFilter(range))
+        for chunk in iter(lambda: list(islice(scored, self.PAIR_BATCH)), []):
+            yield [
+                (Identifier.pair(self.ids[left], self.ids[right]), score)
+                for left, right, score in chunk
+                if pairs.accepts(score)
+            ]
+
+    def match(self, entity: CE) -> List[Tuple[Identifier, float]]:
+        """Match an entity against the index, returning a list of
+        (entity_id, score) pairs of the entities which are sorted next to it."""
+        scores: Dict[int, float] = {}
+        half = self.window // 2
+        for type_, key in self.entity_keys(entity):
+            keys = self.keys[type_]
+            pos = bisect_left(keys, (key, -1))
+            start = max(0, pos - half)
+            for other, dense_id in keys[start : pos + half]:
+                score = self.similarity(key, other) * self.BOOSTS[type_]
+                scores[dense_id] = scores.get(dense_id, 0.0) + score
+        ranked = sorted(scores.items(), key=lambda s: s[1], reverse=True)
+        return [(Identifier.get(self.ids[d]), s) for d, s in ranked if s > 0.0]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __repr__(self) -> str:
+        return "<SortedIndex(%r, %d, %d)>" % (
+            self.view.scope.name,
+            len(self.ids),
+            self.window,
+        )
@@ -0,0 +1,94 @@
+import logging
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.sparse import csr_matrix  # type: ignore
+
+from nomenklatura.resolver import Pair, Identifier
+
+log = logging.getLogger(__name__)
+
+ENGINE_PYTHON = "python"
+ENGINE_SPARSE = "sparse"
+ENGINES = [ENGINE_PYTHON, ENGINE_SPARSE]
+CHUNK_SIZE = 5_000
+
+
+def top_pairs(
+    keys: NDArray[np.int64],
+    scores: NDArray[np.float64],
+    ids: Sequence[str],
+    max_pairs: int,
+) -> List[Tuple[Pair, float]]:
+    """Pick the best-scoring pairs from an array of pair keys, each of which
+    encodes two dense entity IDs as `left * len(ids) + right`."""
+    num_entities = max(1, len(ids))
+    if len(keys) > max_pairs:
+        top = np.argpartition(scores, -max_pairs)[-max_pairs:]
+        keys, scores = keys[top], scores[top]
+    order = np.argsort(-scores, kind="stable")
+    pairs: List[Tuple[Pair, float]] = []
+    for key, score in zip(keys[order].tolist(), scores[order].tolist()):
+        left = Identifier.get(ids[key // num_entities])
+        right = Identifier.get(ids[key % num_entities])
+        pairs.append(((max(left, right), min(left, right)), score))
+    return pairs
+
+
+def make_matrix(
+    rows: NDArray[np.int64],
+    cols: NDArray[np.int64],
+    weights: NDArray[np.float64],
+    shape: Tuple[int, int],
+) -> csr_matrix:
+    """Build the entity x token matrix of boosted term frequencies used by
+    `sparse_pairs`. Each column must be a token which is mentioned by more than
+    one entity, otherwise it cannot produce a candidate pair."""
+    return csr_matrix((weights, (rows, cols)), shape=shape, dtype=np.float64)
+
+
+def sparse_pairs(
+    matrix: csr_matrix,
+    ids: Sequence[str],
+    max_pairs: int,
+    chunk_size: int = CHUNK_SIZE,
+    codes: Optional[NDArray[np.int32]] = None,
+    compatible: Optional[NDArray[np.bool_]] = None,
+) -> List[Tuple[Pair, float]]:
+    """Compute blocking pairs from an entity x token matrix of boosted term
+    frequencies. The score of a pair is the sum of the weights of both entities
+    for each token they share, i.e. `W @ B.T + B @ W.T`, where `B` is the binary
+    token incidence matrix. The product is computed in chunks of rows, and only
+    the best `max_pairs` candidates are kept between chunks.
+
+    If a schema code is given for each entity, pairs are only kept if the
+    `compatible` matrix is true for the codes of both entities."""
+    num_entities = matrix.shape[0]
+    incidence = matrix.copy()
+    incidence.data = np.ones_like(incidence.data)
+    weights_t = matrix.transpose().tocsr()
+    incidence_t = incidence.transpose().tocsr()
+
+    top_keys: NDArray[np.int64] = np.zeros(0, dtype=np.int64)
+    top_scores: NDArray[np.float64] = np.zeros(0, dtype=np.float64)
+    for start in range(0, num_entities, chunk_size):
+        end = min(num_entities, start + chunk_size)
+        log.info("Sparse blocking: %d/%d entities...", start, num_entities)
+        scores = matrix[start:end] @ incidence_t
+        scores = scores + incidence[start:end] @ weights_t
+        scores = scores.tocoo()
+        left = scores.row.astype(np.int64) + start
+        right = scores.col.astype(np.int64)
+        # Each pair shows up twice in the full product, keep the upper triangle:
+        upper = right > left
+        if codes is not None and compatible is not None:
+            upper &= compatible[codes[left], codes[right]]
+        keys = left[upper] * num_entities + right[upper]
+        top_keys = np.concatenate((top_keys, keys))
+        top_scores = np.concatenate((top_scores, scores.data[upper]))
+        if len(top_keys) > max_pairs:
+            top = np.argpartition(top_scores, -max_pairs)[-max_pairs:]
+            top_keys, top_scores = top_keys[top], top_scores[top]
+
+    return top_pairs(top_keys, top_scores, ids, max_pairs)
@@ -1,12 +1,20 @@
+import json
+import time
 import logging
 from normality import WS
 from pathlib import Path
 from rigour.ids import StrictFormat
+from followthemoney import model
 from followthemoney.types import registry
-from typing import Any, Dict, List, Tuple, Generator, Set
-from tantivy import Query, Occur, Index, SchemaBuilder, Document
+from followthemoney.property import Property
+from followthemoney.schema import Schema
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+from typing import Generator, Iterable, Set
+from tantivy import Query, Occur, Index, SchemaBuilder, Document, Searcher
 import math
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
 
 from nomenklatura.dataset import DS
 from nomenklatura.entity import CE
@@ -14,6 +22,8 @@ from nomenklatura.resolver import Identifier, Pair
 from nomenklatura.store import View
 from nomenklatura.util import fingerprint_name, clean_text_basic
 from nomenklatura.index.common import BaseIndex
+from nomenklatura.index.accumulator import PairAccumulator
+from nomenklatura.index.tokenizer import TokenCache, Tokens
 
 log = logging.getLogger(__name__)
 
@@ -45,10 +55,49 @@ BOOSTS = {
     registry.identifier.name: 5.0,
 }
 
+# An entity as sent to a build worker: (ID, schema name, [(property name, value)])
+EntityValues = Tuple[str, str, List[Tuple[str, str]]]
+
+# The token cache of a build worker process:
+_worker_cache: Optional[TokenCache] = None
+
+
+def _init_worker(cache_size: int) -> None:
+    global _worker_cache
+    _worker_cache = TokenCache(cache_size)
+
+
+def _entity_documents(batch: List[EntityValues]) -> List[Document]:
+    """Convert a batch of entities to index documents in a build worker. The
+    entities are passed as plain values, which are cheaper to send to the worker
+    than the entity objects."""
+    documents: List[Document] = []
+    for entity_id, schema_name, values in batch:
+        schema = model.schemata[schema_name]
+        props = ((schema.properties[prop], value) for prop, value in values)
+        document = TantivyIndex.entity_document(
+            entity_id, schema, props, cache=_worker_cache
+        )
+        documents.append(document)
+    return documents
+
 
 class TantivyIndex(BaseIndex[DS, CE]):
     name = "tantivy"
 
+    FINGERPRINT_FILE = "nk-fingerprint.json"
+    IDS_FILE = "nk-ids.txt"
+    # Number of entities queried between progress messages:
+    LOG_BATCH = 10_000
+    # Number of entity queries handed to a worker thread at a time:
+    QUERY_BATCH = 250
+    # Number of entities converted to documents by a build worker at a time:
+    BUILD_BATCH = 500
+    # Share of deleted positions in `ids` above which the index is re-built:
+    MAX_HOLES = 0.5
+    # Bumped whenever the fields of the index change, to force a re-build:
+    VERSION = 4
+
     def __init__(
         self, view: View[DS, CE], data_dir: Path, options: Dict[str, Any] = {}
     ):
@@ -56,10 +105,19 @@ class TantivyIndex(BaseIndex[DS, CE]):
         self.memory_budget = int(options.get("memory_budget", 500) * 1024 * 1024)
         self.max_candidates = int(options.get("max_candidates", 50))
         self.threshold = float(options.get("threshold", 1.0))
+        self.workers = int(options.get("workers", 1))
+        # Indexing threads of the tantivy writer, 0 lets tantivy decide:
+        self.writer_threads = int(options.get("writer_threads", 0))
+        cache_size = int(options.get("token_cache_size", TokenCache.SIZE))
+        self.token_cache = TokenCache(cache_size)
 
         schema_builder = SchemaBuilder()
         schema_builder.add_text_field("entity_id", tokenizer_name="raw", stored=True)
+        # Position of the entity ID in `ids`, to resolve hits without reading
+        # the stored document:
+        schema_builder.add_unsigned_field("entity_num", fast=True)
         schema_builder.add_text_field("schemata", tokenizer_name="raw")
+        schema_builder.add_text_field("schema", tokenizer_name="raw")
         schema_builder.add_text_field(registry.name.name)
         schema_builder.add_text_field(registry.email.name)
         schema_builder.add_text_field(registry.address.name)
@@ -72,67 +130,129 @@ class TantivyIndex(BaseIndex[DS, CE]):
         self.schema = schema_builder.build()
 
         self.index_dir = data_dir
-        if self.index_dir.exists():
+        self.fingerprint_path = self.index_dir / self.FINGERPRINT_FILE
+        self.ids_path = self.index_dir / self.IDS_FILE
+        if self.index_dir.exists() and Index.exists(self.index_dir.as_posix()):
             self.index = Index.open(self.index_dir.as_posix())
-            self.build_index = False
         else:
-            self.index_dir.mkdir(parents=True)
+            self.index_dir.mkdir(parents=True, exist_ok=True)
             self.index = Index(self.schema, path=self.index_dir.as_posix())
-            self.build_index = True
+        # The entity ID for each `entity_num`, empty where it was deleted, and
+        # the checksum of each indexed entity:
+        self.ids: List[str] = []
+        self.checksums: Dict[str, str] = {}
+        if self.ids_path.exists():
+            with open(self.ids_path, "r") as fh:
+                for line in fh.read().splitlines():
+                    entity_id, _, checksum = line.partition("\t")
+                    self.ids.append(entity_id)
+                    if len(entity_id):
+                        self.checksums[entity_id] = checksum
+
+    def _stored_fingerprint(self) -> Optional[str]:
+        if not self.fingerprint_path.exists():
+            return None
+        with open(self.fingerprint_path, "r") as fh:
+            data: Dict[str, Any] = json.load(fh)
+        if data.get("version") != self.VERSION:
+            return None
+        return data.get("fingerprint")
 
     @classmethod
-    def entity_fields(cls, entity: CE) -> Generator[Tuple[str, Set[str]], None, None]:
-        """
-        A generator of each
+    def value_fields(cls, prop: Property, value: str) -> Tokens:
+        """The index fields and normalised values for a single property value.
+        These only depend on the type of the property and if it is matchable."""
+        type = prop.type
+        if type in INDEX_IGNORE:
+            return ()
+        fields: List[Tuple[str, str]] = []
+        if type in FULL_TEXT:
+            fields.append((registry.text.name, value.lower()))
 
-        - index field name and
-        -  the set of normalised but not tokenised values for that field
+        if type == registry.name:
+            fields.append((type.name, value.lower()))
+            norm = fingerprint_name(value)
+            if norm is not None:
+                fields.append((type.name, norm))
 
-        for the given entity.
-        """
-        fields: Dict[str, Set[str]] = defaultdict(set)
+        elif type == registry.date and prop.matchable:
+            if len(value) > 4:
+                fields.append((type.name, value[:4]))
+            fields.append((type.name, value[:10]))
 
-        for prop, value in entity.itervalues():
-            type = prop.type
-            if type in INDEX_IGNORE:
-                continue
+        elif type == registry.identifier and prop.matchable:
+            clean_id = StrictFormat.normalize(value)
+            if clean_id is not None:
+                fields.append((type.name, clean_id))
 
-            if type in FULL_TEXT:
-                fields[registry.text.name].add(value.lower())
+        elif type == registry.address and prop.matchable:
+            cleaned = clean_text_basic(value)
+            if cleaned is not None:
+                fields.append((type.name, cleaned))
 
-            if type == registry.name:
-                fields[type.name].add(value.lower())
-                norm = fingerprint_name(value)
-                if norm is not None:
-                    fields[type.name].add(norm)
-                continue
+        elif prop.matchable and type in (
+            registry.phone,
+            registry.email,
+            registry.country,
+        ):
+            fields.append((type.name, value))
+        return tuple(fields)
 
-            if type == registry.date and prop.matchable:
-                if len(value) > 4:
-                    fields[type.name].add(value[:4])
-                fields[type.name].add(value[:10])
-                continue
+    @classmethod
+    def entity_fields(
+        cls, entity: CE, cache: Optional[TokenCache] = None
+    ) -> Generator[Tuple[str, Set[str]], None, None]:
+        """
+        A generator of each
 
-            if type == registry.identifier and prop.matchable:
-                clean_id = StrictFormat.normalize(value)
-                if clean_id is not None:
-                    fields[type.name].add(clean_id)
-                continue
+        - index field name and
+        -  the set of normalised but not tokenised values for that field
 
-            if type == registry.address and prop.matchable:
-                cleaned = clean_text_basic(value)
-                if cleaned is not None:
-                    fields[type.name].add(cleaned)
-                continue
+        for the given entity. The normalised values of each property value are
+        memoized in the `cache`, if one is given.
+        """
+        yield from cls.values_fields(entity.itervalues(), cache=cache)
 
-            if prop.matchable and type in (
-                registry.phone,
-                registry.email,
-                registry.country,
-            ):
-                fields[type.name].add(value)
+    @classmethod
+    def values_fields(
+        cls,
+        prop_values: Iterable[Tuple[Property, str]],
+        cache: Optional[TokenCache] = None,
+    ) -> Generator[Tuple[str, Set[str]], None, None]:
+        """Like `entity_fields`, for the (property, value) pairs of an entity."""
+        fields: Dict[str, Set[str]] = defaultdict(set)
+        for prop, value in prop_values:
+            key = (prop.type.name, prop.matchable, value)
+            values = cache.get(key) if cache is not None else None
+            if values is None:
+                values = cls.value_fields(prop, value)
+                if cache is not None:
+                    cache.put(key, values)
+            for field, field_value in values:
+                fields[field].add(field_value)
         yield from fields.items()
 
+    @classmethod
+    def entity_document(
+        cls,
+        entity_id: str,
+        schema: Schema,
+        values: Iterable[Tuple[Property, str]],
+        cache: Optional[TokenCache] = None,
+    ) -> Document:
+        """Make the index document for an entity, given its ID, schema and
+        (property, value) pairs. The `entity_num` is added when it is written."""
+        schemata = [s.name for s in schema.matchable_schemata]
+        document = Document(
+            entity_id=entity_id,
+            schemata=schemata,
+            schema=list(schema.names),
+        )
+        for field, field_values in cls.values_fields(values, cache=cache):
+            for value in field_values:
+                document.add_text(field, value)
+        return document
+
     def field_queries(
         self, field: str, values: Set[str]
     ) -> Generator[Query, None, None]:
@@ -177,94 +297,316 @@ class TantivyIndex(BaseIndex[DS, CE]):
                 BOOSTS.get(field, 1.0),
             )
 
-    def entity_query(self, entity: CE) -> Query:
-        schema_query = Query.term_query(self.schema, "schemata", entity.schema.name)
+    def entity_query(self, entity: CE, range: Optional[Schema] = None) -> Query:
+        """Build the query for candidates matching an entity. If a `range` is
+        given and the entity is not of that schema, candidates must be."""
+        fields = self.entity_fields(entity, cache=self.token_cache)
+        return self._fields_query(entity.schema, fields, range, exclude=entity.id)
+
+    def _fields_query(
+        self,
+        schema: Schema,
+        fields: Iterable[Tuple[str, Set[str]]],
+        range: Optional[Schema] = None,
+        exclude: Optional[str] = None,
+    ) -> Query:
+        """Build the query for candidates matching the index `fields` of an
+        entity of the given `schema`, other than the entity ID to `exclude`."""
+        schema_query = Query.term_query(self.schema, "schemata", schema.name)
         queries: List[Tuple[Occur, Query]] = [(Occur.Must, schema_query)]
-        if entity.id is not None:
-            id_query = Query.term_query(self.schema, "entity_id", entity.id)
+        if range is not None and not schema.is_a(range):
+            range_query = Query.term_query(self.schema, "schema", range.name)
+            queries.append((Occur.Must, range_query))
+        if exclude is not None:
+            id_query = Query.term_query(self.schema, "entity_id", exclude)
             queries.append((Occur.MustNot, id_query))
-        for field, value in self.entity_fields(entity):
+        for field, value in fields:
             for query in self.field_queries(field, value):
                 queries.append((Occur.Should, query))
         return Query.boolean_query(queries)
 
-    def build(self) -> None:
-        if not self.build_index:
+    def prepare(self) -> None:
+        """Re-use the index on disk if it was built from the current data in the
+        view, as recorded in a fingerprint file in the index directory."""
+        fingerprint = self.view.fingerprint()
+        if self._stored_fingerprint() == fingerprint:
             log.info("Using existing index at %s", self.index_dir)
             return
+        self.build()
+        with open(self.fingerprint_path, "w") as fh:
+            json.dump({"fingerprint": fingerprint, "version": self.VERSION}, fh)
 
+    def build(self) -> None:
+        """Index all matchable entities in the view. If the index on disk was
+        completely built before, only the documents of entities whose checksum
+        changed, and of those which were added or removed, are updated."""
         log.info("Building index from: %r...", self.view)
-        writer = self.index.writer(self.memory_budget)
-        writer.delete_all_documents()
-        idx = 0
-        for entity in self.view.entities():
-            if not entity.schema.matchable or entity.id is None:
-                continue
-            if idx > 0 and idx % 50_000 == 0:
-                log.info("Indexing entity: %s..." % idx)
-            idx += 1
-            schemata = [s.name for s in entity.schema.matchable_schemata]
-            document = Document(entity_id=entity.id, schemata=schemata)
-            for field, values in self.entity_fields(entity):
-                for value in values:
-                    document.add_text(field, value)
+        holes = len(self.ids) - len(self.checksums)
+        incremental = (
+            self._stored_fingerprint() is not None
+            and len(self.checksums) > 0
+            and holes <= len(self.ids) * self.MAX_HOLES
+        )
+        # Invalidate the fingerprint until the new index has been committed:
+        self.fingerprint_path.unlink(missing_ok=True)
+        if not incremental:
+            # Re-create the index, in case it was written with different fields:
+            path = self.index_dir.as_posix()
+            self.index = Index(self.schema, path=path, reuse=False)
+            self.ids = []
+            self.checksums = {}
+        writer = self.index.writer(self.memory_budget, self.writer_threads)
+        positions = {e: n for n, e in enumerate(self.ids) if len(e)}
+        checksums: Dict[str, str] = {}
+        changed = 0
+        started = time.monotonic()
+        for entity_id, document in self._documents(checksums):
+            if len(checksums) > 0 and len(checksums) % 50_000 == 0:
+                rate = len(checksums) / max(time.monotonic() - started, 1e-6)
+                log.info("Indexing entity: %s (%.1f/s)..." % (len(checksums), rate))
+            num = positions.get(entity_id)
+            if num is not None:
+                writer.delete_documents_by_term("entity_id", entity_id)
+                self.ids[num] = ""
+                changed += 1
+            document.add_unsigned("entity_num", len(self.ids))
             writer.add_document(document)
+            self.ids.append(entity_id)
+        removed = [e for e in self.checksums if e not in checksums]
+        for entity_id in removed:
+            writer.delete_documents_by_term("entity_id", entity_id)
+            self.ids[positions[entity_id]] = ""
+        prepared = time.monotonic()
         writer.commit()
         self.index.reload()
-        log.info("Index is built (%s matchable entities)." % idx)
+        self.checksums = checksums
+        with open(self.ids_path, "w") as fh:
+            for entity_id in self.ids:
+                fh.write(f"{entity_id}\t{checksums.get(entity_id, '')}\n")
+        finished = time.monotonic()
+        if incremental:
+            added = len(self.ids) - len(positions) - holes - changed
+            log.info(
+                "Updated index: %d added, %d changed, %d removed.",
+                added,
+                changed,
+                len(removed),
+            )
+        log.info(
+            "Index is built (%s matchable entities, %.1f/s), documents: %.2fs, "
+            "commit: %.2fs, %r.",
+            len(checksums),
+            len(checksums) / max(finished - started, 1e-6),
+            prepared - started,
+            finished - prepared,
+            self.token_cache,
+        )
+
+    def _documents(
+        self, checksums: Dict[str, str]
+    ) -> Generator[Tuple[str, Document], None, None]:
+        """Generate the index documents for the matchable entities in the view
+        which are not indexed with their current checksum, in the order of the
+        view. The checksums of all matchable entities are put into `checksums`.
+        With more than one worker, the documents are made by a pool of processes
+        in batches of `BUILD_BATCH` entities, while the entities of the next
+        batches are read from the view."""
+        if self.workers < 2:
+            for entity_id, entity in self._changed_entities(checksums):
+                values = entity.itervalues()
+                document = self.entity_document(
+                    entity_id, entity.schema, values, cache=self.token_cache
+                )
+                yield entity_id, document
+            return
+
+        entities = (
+            (i, e.schema.name, [(p.name, v) for p, v in e.itervalues()])
+            for i, e in self._changed_entities(checksums)
+        )
+        log.info("Preparing documents (%d workers)...", self.workers)
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self.token_cache.size,),
+        ) as executor:
+            # Keep a bounded number of batches in flight, in submission order:
+            pending: Deque[Tuple[List[str], Future[List[Document]]]] = deque()
+            for batch in iter(lambda: list(islice(entities, self.BUILD_BATCH)), []):
+                ids = [e[0] for e in batch]
+                pending.append((ids, executor.submit(_entity_documents, batch)))
+                if len(pending) > self.workers * 2:
+                    ids, future = pending.popleft()
+                    yield from zip(ids, future.result())
+            while len(pending):
+                ids, future = pending.popleft()
+                yield from zip(ids, future.result())
+
+    def _changed_entities(
+        self, checksums: Dict[str, str]
+    ) -> Generator[Tuple[str, CE], None, None]:
+        for entity in self.view.entities():
+            if not entity.schema.matchable or entity.id is None:
+                continue
+            checksum = entity.checksum
+            checksums[entity.id] = checksum
+            if self.checksums.get(entity.id) != checksum:
+                yield entity.id, entity
 
     def match(self, entity: CE) -> List[Tuple[Identifier, float]]:
         query = self.entity_query(entity)
+        searcher = self.index.searcher()
+        hits = self._hits(searcher, query, self.max_candidates, self.threshold)
+        return [(Identifier.get(entity_id), score) for entity_id, score in hits]
+
+    def _hits(
+        self, searcher: Searcher, query: Query, limit: int, threshold: float
+    ) -> List[Tuple[str, float]]:
+        """Run a query and return the entity IDs and scores of the hits which
+        reach the `threshold`. The IDs are looked up in `ids` by the value of
+        the `entity_num` fast field, which saves reading the stored document
+        of each hit."""
+        hits = [(s, a) for s, a in searcher.search(query, limit).hits if s >= threshold]
+        nums = searcher.fast_field_values("entity_num", [a for _, a in hits])
+        results: List[Tuple[str, float]] = []
+        for (score, address), num in zip(hits, nums):
+            if num is not None and num < len(self.ids):
+                entity_id = self.ids[int(num)]
+            else:
+                entity_id = searcher.doc(address)["entity_id"][0]
+            results.append((entity_id, score))
+        return results
 
-        results = []
+    def match_many(
+        self, entities: Sequence[CE], limit: Optional[int] = None
+    ) -> List[List[Tuple[Identifier, float]]]:
+        """Match a batch of entities against the index. All queries share one
+        searcher, and entities with the same schema and index field values, such
+        as repeated records, share one query. As the shared query does not
+        exclude the entity itself, one more hit is fetched to make up for it."""
         searcher = self.index.searcher()
-        for score, address in searcher.search(query, self.max_candidates).hits:
-            if score < self.threshold:
-                break
-            doc = searcher.doc(address)
-            # Value of type "Document" is not indexable
-            results.append((Identifier.get(doc["entity_id"][0]), score))  # type: ignore
+        count = (
+            self.max_candidates if limit is None else min(limit, self.max_candidates)
+        )
+        QueryKey = Tuple[str, Tuple[Tuple[str, Tuple[str, ...]], ...]]
+        keys: List[QueryKey] = []
+        hits: Dict[QueryKey, List[Tuple[str, float]]] = {}
+        for entity in entities:
+            fields = self.entity_fields(entity, cache=self.token_cache)
+            values = tuple(sorted((f, tuple(sorted(v))) for f, v in fields))
+            key = (entity.schema.name, values)
+            keys.append(key)
+            if key not in hits:
+                fields_sets = ((f, set(v)) for f, v in values)
+                query = self._fields_query(entity.schema, fields_sets)
+                hits[key] = self._hits(searcher, query, count + 1, self.threshold)
+        results: List[List[Tuple[Identifier, float]]] = []
+        for entity, key in zip(entities, keys):
+            matches = [(Identifier.get(e), s) for e, s in hits[key] if e != entity.id]
+            results.append(matches[:count])
         return results
 
-    def pairs(self, max_pairs: int = BaseIndex.MAX_PAIRS) -> List[Tuple[Pair, float]]:
+    def _entity_queries(
+        self, range: Optional[Schema]
+    ) -> Generator[Tuple[str, Query], None, None]:
+        for entity in self.view.entities():
+            if not entity.schema.matchable or entity.id is None:
+                continue
+            yield entity.id, self.entity_query(entity, range=range)
+
+    def _entity_hits(
+        self,
+        searcher: Searcher,
+        range: Optional[Schema],
+        threshold: Callable[[], float],
+    ) -> Generator[Tuple[str, List[Tuple[str, float]]], None, None]:
+        """Query the index for each matchable entity in the view, and generate
+        the entity ID together with its hits. With more than one worker, the
+        queries are searched by a pool of threads in batches of `QUERY_BATCH`,
+        while the results of earlier batches are consumed. The queries are
+        still built on the calling thread, as the token cache is not shared
+        safely. The `threshold` is read when each batch is submitted, so that
+        the bound of the consumer tightens the searches as it goes."""
+        queries = self._entity_queries(range)
+        if self.workers < 2:
+            for entity_id, query in queries:
+                hits = self._hits(searcher, query, self.max_candidates, threshold())
+                yield entity_id, hits
+            return
+
+        def search(
+            batch: List[Tuple[str, Query]], threshold: float
+        ) -> List[Tuple[str, List[Tuple[str, float]]]]:
+            limit = self.max_candidates
+            return [(e, self._hits(searcher, q, limit, threshold)) for e, q in batch]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # Keep a bounded number of batches in flight, in submission order:
+            pending: Deque[Future[List[Tuple[str, List[Tuple[str, float]]]]]]
+            pending = deque()
+            for batch in iter(lambda: list(islice(queries, self.QUERY_BATCH)), []):
+                pending.append(executor.submit(search, batch, threshold()))
+                if len(pending) > self.workers * 2:
+                    yield from pending.popleft().result()
+            while len(pending):
+                yield from pending.popleft().result()
+
+    def pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> List[Tuple[Pair, float]]:
         """
         Compare all matchable entities in the index and return pairs in order of
-        similarity.
+        similarity. Candidates are restricted to schemata which can match each
+        entity, and to the `range` schema if one is given.
         """
-        pairs: Dict[Tuple[str, str], float] = {}
-        threshold = float(self.threshold)
+        pairs = PairAccumulator(max_pairs, threshold=self.threshold)
+        for batch in self._batches(pairs, range):
+            for pair, score in batch:
+                pairs.put(pair, score)
+        return pairs.result()
 
+    def iter_pairs(
+        self, max_pairs: int = BaseIndex.MAX_PAIRS, range: Optional[Schema] = None
+    ) -> Generator[Tuple[Pair, float], None, None]:
+        """
+        Generate the pairs in ranked batches, one for each `QUERY_BATCH`
+        entities which have been queried, see `BaseIndex.iter_pairs()`. A pair
+        is found from both of its entities, possibly with different scores. It
+        is generated once, with the score it has when it is first admitted,
+        which can be lower than its score in `pairs()`.
+        """
+        pairs = PairAccumulator(max_pairs, threshold=self.threshold)
+        generated: Set[Pair] = set()
+        for batch in self._batches(pairs, range):
+            for pair, score in pairs.admit(batch):
+                if pair not in generated:
+                    generated.add(pair)
+                    yield pair, score
+
+    def _batches(
+        self, pairs: PairAccumulator, range: Optional[Schema]
+    ) -> Generator[List[Tuple[Pair, float]], None, None]:
+        """Generate the hits of each `QUERY_BATCH` queried entities which would
+        be admitted to `pairs`, as pairs with their scores."""
         idx = 0
         candidates = 0
-        for entity in self.view.entities():
-            if not entity.schema.matchable or entity.id is None:
-                continue
-            if idx > 0 and idx % 10_000 == 0:
+        batch: List[Tuple[Pair, float]] = []
+        searcher = self.index.searcher()
+        for entity_id, hits in self._entity_hits(
+            searcher, range, lambda: pairs.threshold
+        ):
+            if idx > 0 and idx % self.LOG_BATCH == 0:
                 log.info("Blocking pairs: %s (%s candidates)..." % (idx, candidates))
+            if idx > 0 and idx % self.QUERY_BATCH == 0:
+                yield batch
+                batch = []
             idx += 1
-
-            query = self.entity_query(entity)
-            searcher = self.index.searcher()
-            for score, address in searcher.search(query, self.max_candidates).hits:
+            for other_id, score in hits:
                 candidates += 1
-                if score < threshold:
+                if not pairs.accepts(score):
                     break
-                # Value of type "Document" is not indexable
-                doc = searcher.doc(address)
-                other_id: str = doc["entity_id"][0]  # type: ignore
-                if entity.id == other_id:
+                if entity_id == other_id:
                     continue
-                if (other_id, entity.id) in pairs:
-                    score = max(score, pairs.pop((other_id, entity.id)))
-                pairs[(entity.id, other_id)] = score
-
-                if len(pairs) > (max_pairs * 5):
-                    _pairs = sorted(pairs.items(), key=lambda p: p[1], reverse=True)
-                    _pairs = _pairs[:max_pairs]
-                    threshold = _pairs[-1][1]
-                    # print("Threshold:", threshold)
-                    pairs = dict(_pairs)
-        _pairs = sorted(pairs.items(), key=lambda p: p[1], reverse=True)
-        _pairs = _pairs[:max_pairs]
+                batch.append((Identifier.pair(entity_id, other_id), score))
+        yield batch
         log.info("Blocked %s entities, picked from %s candidates." % (idx, candidates))
-        return [(Identifier.pair(e, r), score) for (e, r), score in _pairs]
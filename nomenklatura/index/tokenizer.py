@@ -1,8 +1,10 @@
+from collections import OrderedDict
 from normality import WS
 from rigour.ids import StrictFormat
-from typing import Generic, Generator, Tuple
+from typing import Generic, Generator, Hashable, Optional, Tuple
 from followthemoney.types import registry
 from followthemoney.property import Property
+from followthemoney.types.common import PropertyType
 
 from nomenklatura.dataset import DS
 from nomenklatura.entity import CE
@@ -26,16 +28,79 @@ TEXT_TYPES = (
     registry.identifier,
     registry.name,
 )
+Tokens = Tuple[Tuple[str, str], ...]
+
+
+class TokenCache(object):
+    """A bounded, least-recently-used cache of the (field, token) pairs produced
+    for a property value. Names, countries, dates and address fragments repeat
+    heavily across datasets, so this saves most of the normalisation work when
+    building an index. Keys are chosen by the caller, e.g. (type, value)."""
+
+    SIZE = 100_000
+
+    __slots__ = ("size", "data", "hits", "misses")
+
+    def __init__(self, size: int = SIZE) -> None:
+        self.size = size
+        self.data: "OrderedDict[Hashable, Tokens]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Tokens]:
+        tokens = self.data.get(key)
+        if tokens is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return tokens
+
+    def put(self, key: Hashable, tokens: Tokens) -> None:
+        if self.size <= 0:
+            return
+        self.data[key] = tokens
+        if len(self.data) > self.size:
+            self.data.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(1, self.hits + self.misses)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return "<TokenCache(%d/%d, hits: %d, misses: %d)>" % (
+            len(self.data),
+            self.size,
+            self.hits,
+            self.misses,
+        )
 
 
 class Tokenizer(Generic[DS, CE]):
+    def __init__(self, cache: Optional[TokenCache] = None) -> None:
+        self.cache = cache if cache is not None else TokenCache()
+
     def value(
         self, prop: Property, value: str
     ) -> Generator[Tuple[str, str], None, None]:
         """Perform type-specific token generation for a property value."""
-        type = prop.type
         if not prop.matchable:
             return
+        key = (prop.type.name, value)
+        tokens = self.cache.get(key)
+        if tokens is None:
+            tokens = tuple(self.type_value(prop.type, value))
+            self.cache.put(key, tokens)
+        yield from tokens
+
+    def type_value(
+        self, type: PropertyType, value: str
+    ) -> Generator[Tuple[str, str], None, None]:
+        """Generate the tokens for a value of a matchable property, which only
+        depend on the type of the property."""
         if type in (registry.url, registry.topic, registry.entity):
             return
         if type not in SKIP_FULL:
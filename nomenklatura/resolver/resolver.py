@@ -1,3 +1,4 @@
+import os
 import logging
 import getpass
 from pathlib import Path
@@ -252,9 +253,12 @@ class Resolver(Linker[CE]):
             if self.path is None:
                 raise RuntimeError("Resolver has no path")
             edges = sorted(self.edges.values())
-            with open(self.path, "w") as fh:
+            # Replace the file atomically, so an interrupted save keeps the old one:
+            tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with open(tmp_path, "w") as fh:
                 for edge in edges:
                     fh.write(edge.to_line())
+            os.replace(tmp_path, self.path)
 
     def merge(self, path: PathLike) -> None:
         with open(path, "r") as fh:
@@ -7,6 +7,7 @@ from nomenklatura.dataset import Dataset
 from nomenklatura.entity import CompositeEntity
 from nomenklatura.resolver import Resolver
 from nomenklatura.store.base import Store, View, Writer
+from nomenklatura.store.cached import CachedView
 from nomenklatura.store.memory import MemoryStore
 from nomenklatura.store.sql import SQLStore
 
@@ -16,6 +17,7 @@ __all__ = [
     "Store",
     "Writer",
     "View",
+    "CachedView",
     "MemoryStore",
     "SimpleMemoryStore",
     "SQLStore",
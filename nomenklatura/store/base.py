@@ -1,5 +1,8 @@
+import hashlib
 from types import TracebackType
-from typing import Optional, Generator, List, Tuple, Generic, Type, cast
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Generator, List, Tuple
+from typing import Generic, Type, cast
+from weakref import WeakSet
 from followthemoney.property import Property
 from followthemoney.types import registry
 
@@ -8,6 +11,9 @@ from nomenklatura.resolver import Linker, StrIdent
 from nomenklatura.statement import Statement
 from nomenklatura.entity import CE, CompositeEntity
 
+if TYPE_CHECKING:
+    from nomenklatura.store.cached import CachedView
+
 
 class Store(Generic[DS, CE]):
     """A data storage and retrieval mechanism for statement-based entity data.
@@ -18,6 +24,8 @@ class Store(Generic[DS, CE]):
         self.dataset = dataset
         self.linker = linker
         self.entity_class = cast(Type[CE], CompositeEntity)
+        # The entity caches of views of this store, see `CachedView`:
+        self.caches: "WeakSet[CachedView[DS, CE]]" = WeakSet()
 
     def writer(self) -> "Writer[DS, CE]":
         raise NotImplementedError()
@@ -46,6 +54,13 @@ class Store(Generic[DS, CE]):
                 for stmt in writer.pop(referent):
                     stmt.canonical_id = canonical_id
                     writer.add_statement(stmt)
+        self.invalidate(canonical_id)
+
+    def invalidate(self, id: str) -> None:
+        """Drop an entity from the entity caches of all views of this store.
+        Writers call this for each entity whose statements they change."""
+        for cache in self.caches:
+            cache.invalidate(id)
 
     def close(self) -> None:
         pass
@@ -104,6 +119,17 @@ class View(Generic[DS, CE]):
     def get_entity(self, id: str) -> Optional[CE]:
         raise NotImplementedError()
 
+    def get_entities(self, ids: Iterable[str]) -> Dict[str, CE]:
+        """Get several entities at once, as a mapping of the given IDs to the
+        entities which were found. Stores should override this with a way of
+        loading the entities in bulk, rather than one at a time."""
+        entities: Dict[str, CE] = {}
+        for id in set(ids):
+            entity = self.get_entity(id)
+            if entity is not None:
+                entities[id] = entity
+        return entities
+
     def get_inverted(self, id: str) -> Generator[Tuple[Property, CE], None, None]:
         raise NotImplementedError()
 
@@ -123,5 +149,66 @@ class View(Generic[DS, CE]):
     def entities(self) -> Generator[CE, None, None]:
         raise NotImplementedError()
 
+    def fingerprint(self, canonical: bool = True) -> str:
+        """A checksum of the data in the view: the names and versions of the
+        datasets in scope, and the canonical and statement IDs of all statements.
+        It changes whenever statements are added, removed or merged into another
+        entity, so it can be used to tell if a persisted index is stale. Without
+        `canonical`, the canonical IDs are left out, so that the checksum does
+        not change when the resolver merges entities."""
+        digest = hashlib.sha1()
+        for dataset in sorted(self.scope.leaves):
+            digest.update(f"{dataset.name}:{dataset.version}\n".encode("utf-8"))
+        digest.update(b"external" if self.external else b"internal")
+        # The keys are combined as a multiset, so their order does not matter:
+        total = 0
+        count = 0
+        for key in self._statement_keys():
+            if not canonical:
+                key = key.rsplit(":", 1)[-1]
+            key_digest = hashlib.sha1(key.encode("utf-8")).digest()
+            total = (total + int.from_bytes(key_digest[:16], "big")) % 2**128
+            count += 1
+        digest.update(f":{count}:{total:032x}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _statement_keys(self) -> Generator[str, None, None]:
+        """Generate a `canonical_id:statement_id` key for each statement in the
+        view, in any order. Stores should override this with a cheaper way of
+        listing their statements than assembling every entity."""
+        for entity in self.entities():
+            for stmt in entity.statements:
+                yield f"{entity.id}:{stmt.id}"
+
+    def entity_digests(self) -> Dict[str, int]:
+        """A checksum of the statements of each entity in the view, by canonical
+        ID, combined from the keys of `fingerprint()`. Comparing them with those
+        of an earlier version of the view finds the entities which were added,
+        changed, merged or removed, without assembling any entity."""
+        digests: Dict[str, int] = {}
+        for key in self._statement_keys():
+            entity_id, _, _ = key.rpartition(":")
+            key_digest = hashlib.sha1(key.encode("utf-8")).digest()
+            value = int.from_bytes(key_digest[:8], "big")
+            digests[entity_id] = (digests.get(entity_id, 0) + value) % 2**64
+        return digests
+
+    def changes(
+        self, since: Optional[str] = None
+    ) -> Generator[Tuple[str, Optional[str]], None, None]:
+        """Generate the ID of each entity in the view which changed after `since`,
+        with the time of its latest change: the latest `first_seen` of its
+        statements. Entities without any recorded change are always included,
+        with None, and all entities are if `since` is None. Stores should
+        override this with a query of their statements, rather than assembling
+        every entity."""
+        for entity in self.entities():
+            if entity.id is None:
+                continue
+            seen = (s.first_seen for s in entity.statements if s.first_seen)
+            latest = max(seen, default=None)
+            if since is None or latest is None or latest > since:
+                yield entity.id, latest
+
     def __repr__(self) -> str:
         return f"<{type(self).__name__}({self.scope.name!r})>"
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from typing import Dict, Generator, Iterable, Optional, Set, Tuple
+
+from followthemoney.property import Property
+
+from nomenklatura.dataset import DS
+from nomenklatura.entity import CE
+from nomenklatura.store.base import View
+
+
+class CachedView(View[DS, CE]):
+    """A view which keeps the most recently used assembled entities of another
+    view in memory. Loading an entity from a store means reading all of its
+    statements and canonicalising their values, which adds up when the same
+    entity is requested over and over, e.g. for each of its candidate pairs in
+    xref. Writers and `Store.update()` invalidate the entities they touch.
+
+    Only entities requested by their canonical ID are cached. The cached
+    entities are shared between callers, so they must not be modified."""
+
+    SIZE = 10_000
+
+    def __init__(self, view: View[DS, CE], size: int = SIZE) -> None:
+        super().__init__(view.store, view.scope, external=view.external)
+        self.view = view
+        self.size = size
+        self.cache: "OrderedDict[str, CE]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.store.caches.add(self)
+
+    def _put(self, id: str, entity: CE) -> None:
+        if self.size <= 0 or entity.id != id:
+            return
+        self.cache[id] = entity
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+    def _get(self, id: str) -> Optional[CE]:
+        entity = self.cache.get(id)
+        if entity is None:
+            self.misses += 1
+            return None
+        self.cache.move_to_end(id)
+        self.hits += 1
+        return entity
+
+    def invalidate(self, id: str) -> None:
+        """Drop an entity from the cache, e.g. because its statements changed."""
+        self.cache.pop(id, None)
+
+    def clear(self) -> None:
+        self.cache.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(1, self.hits + self.misses)
+
+    def has_entity(self, id: str) -> bool:
+        if id in self.cache:
+            return True
+        return self.view.has_entity(id)
+
+    def get_entity(self, id: str) -> Optional[CE]:
+        entity = self._get(id)
+        if entity is None:
+            entity = self.view.get_entity(id)
+            if entity is not None:
+                self._put(id, entity)
+        return entity
+
+    def get_entities(self, ids: Iterable[str]) -> Dict[str, CE]:
+        entities: Dict[str, CE] = {}
+        missing: Set[str] = set()
+        for id in set(ids):
+            entity = self._get(id)
+            if entity is None:
+                missing.add(id)
+            else:
+                entities[id] = entity
+        if len(missing):
+            for id, entity in self.view.get_entities(missing).items():
+                self._put(id, entity)
+                entities[id] = entity
+        return entities
+
+    def get_inverted(self, id: str) -> Generator[Tuple[Property, CE], None, None]:
+        yield from self.view.get_inverted(id)
+
+    def entities(self) -> Generator[CE, None, None]:
+        yield from self.view.entities()
+
+    def fingerprint(self, canonical: bool = True) -> str:
+        return self.view.fingerprint(canonical=canonical)
+
+    def entity_digests(self) -> Dict[str, int]:
+        return self.view.entity_digests()
+
+    def changes(
+        self, since: Optional[str] = None
+    ) -> Generator[Tuple[str, Optional[str]], None, None]:
+        yield from self.view.changes(since=since)
+
+    def __repr__(self) -> str:
+        return "<CachedView(%r, %d/%d, hits: %d, misses: %d)>" % (
+            self.view,
+            len(self.cache),
+            self.size,
+            self.hits,
+            self.misses,
+        )
@@ -1,6 +1,6 @@
 import orjson
 from pathlib import Path
-from typing import Any, Generator, List, Optional, Set, Tuple, Dict
+from typing import Any, Generator, Iterable, List, Optional, Set, Tuple, Dict
 
 import plyvel  # type: ignore
 from followthemoney.property import Property
@@ -109,6 +109,7 @@ class LevelDBWriter(Writer[DS, CE]):
             self.batch = self.store.db.write_batch()
         canonical_id = self.store.linker.get_canonical(stmt.entity_id)
         stmt.canonical_id = canonical_id
+        self.store.invalidate(canonical_id)
 
         if stmt.last_seen is not None:
             self.last_seens[stmt.dataset] = stmt.last_seen
@@ -128,6 +129,7 @@ class LevelDBWriter(Writer[DS, CE]):
         self.batch_size += 1
 
     def pop(self, entity_id: str) -> List[Statement]:
+        self.store.invalidate(entity_id)
         if self.batch_size >= self.BATCH_STATEMENTS:
             self.flush()
         if self.batch is None:
@@ -187,6 +189,31 @@ class LevelDBView(View[DS, CE]):
             with self.store.db.iterator(prefix=prefix, include_key=False) as it:
                 for v in it:
                     statements.append(unpack_statement(v, id, True))
+        return self._assemble(statements)
+
+    def get_entities(self, ids: Iterable[str]) -> Dict[str, CE]:
+        # The IDs are visited in key order, so that a single iterator can seek
+        # forward through the statements of all of them:
+        unique = sorted(set(ids))
+        statements: Dict[str, List[Statement]] = {id: [] for id in unique}
+        kinds = [("s", False), ("x", True)] if self.external else [("s", False)]
+        for kind, external in kinds:
+            with self.store.db.iterator(prefix=b(f"{kind}:")) as it:
+                for id in unique:
+                    prefix = b(f"{kind}:{id}:")
+                    it.seek(prefix)
+                    for k, v in it:
+                        if not k.startswith(prefix):
+                            break
+                        statements[id].append(unpack_statement(v, id, external))
+        entities: Dict[str, CE] = {}
+        for id, stmts in statements.items():
+            entity = self._assemble(stmts)
+            if entity is not None:
+                entities[id] = entity
+        return entities
+
+    def _assemble(self, statements: List[Statement]) -> Optional[CE]:
         for stmt in statements:
             if stmt.dataset not in self.last_seens:
                 ls_val = self.store.db.get(b(f"ls:{stmt.dataset}"))
@@ -223,3 +250,13 @@ class LevelDBView(View[DS, CE]):
                     entity = self.get_entity(entity_id)
                     if entity is not None:
                         yield entity
+
+    def _statement_keys(self) -> Generator[str, None, None]:
+        # Statement keys do not include the dataset, so this lists the statements
+        # of all datasets in the store. The fingerprint of the view will change
+        # more often than necessary, but never miss a change.
+        prefixes = [b"s:", b"x:"] if self.external else [b"s:"]
+        for prefix in prefixes:
+            with self.store.db.iterator(prefix=prefix, include_value=False) as it:
+                for k in it:
+                    yield k[len(prefix) :].decode("utf-8")
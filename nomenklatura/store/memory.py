@@ -36,6 +36,7 @@ class MemoryWriter(Writer[DS, CE]):
         if canonical_id not in self.store.stmts:
             self.store.stmts[canonical_id] = set()
         self.store.stmts[canonical_id].add(stmt)
+        self.store.invalidate(canonical_id)
 
         if stmt.dataset not in self.store.entities:
             self.store.entities[stmt.dataset] = set()
@@ -48,6 +49,7 @@ class MemoryWriter(Writer[DS, CE]):
             self.store.inverted[inverted_id].add(canonical_id)
 
     def pop(self, entity_id: str) -> List[Statement]:
+        self.store.invalidate(entity_id)
         statements = self.store.stmts.pop(entity_id, set())
         for stmt in statements:
             if stmt.dataset in self.store.entities:
@@ -102,3 +104,32 @@ class MemoryView(View[DS, CE]):
             entity = self.get_entity(entity_id)
             if entity is not None:
                 yield entity
+
+    def _statement_keys(self) -> Generator[str, None, None]:
+        entity_ids: Set[str] = set()
+        for scope in self.dataset_names:
+            entity_ids.update(self.store.entities.get(scope, []))
+        for entity_id in entity_ids:
+            for stmt in self.store.stmts.get(entity_id, []):
+                if self.external is False and stmt.external:
+                    continue
+                yield f"{entity_id}:{stmt.id}"
+
+    def changes(
+        self, since: Optional[str] = None
+    ) -> Generator[Tuple[str, Optional[str]], None, None]:
+        entity_ids: Set[str] = set()
+        for scope in self.dataset_names:
+            entity_ids.update(self.store.entities.get(scope, []))
+        for entity_id in entity_ids:
+            found = False
+            latest: Optional[str] = None
+            for stmt in self.store.stmts.get(entity_id, []):
+                if self.external is False and stmt.external:
+                    continue
+                found = True
+                if stmt.first_seen is not None:
+                    if latest is None or stmt.first_seen > latest:
+                        latest = stmt.first_seen
+            if found and (since is None or latest is None or latest > since):
+                yield entity_id, latest
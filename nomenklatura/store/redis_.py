@@ -1,5 +1,7 @@
+import orjson
+from itertools import islice
 from redis.client import Redis, Pipeline
-from typing import Generator, List, Optional, Set, Tuple
+from typing import Dict, Generator, Iterable, List, Optional, Set, Tuple
 from followthemoney.property import Property
 from followthemoney.types import registry
 
@@ -57,6 +59,7 @@ class RedisWriter(Writer[DS, CE]):
             self.pipeline = self.store.db.pipeline()
         canonical_id = self.store.linker.get_canonical(stmt.entity_id)
         stmt.canonical_id = canonical_id
+        self.store.invalidate(canonical_id)
 
         self.pipeline.sadd(b(f"ds:{stmt.dataset}"), b(canonical_id))
         key = f"x:{canonical_id}" if stmt.external else f"s:{canonical_id}"
@@ -68,6 +71,7 @@ class RedisWriter(Writer[DS, CE]):
         self.batch_size += 1
 
     def pop(self, entity_id: str) -> List[Statement]:
+        self.store.invalidate(entity_id)
         if self.batch_size >= self.BATCH_STATEMENTS:
             self.flush()
         if self.pipeline is None:
@@ -91,6 +95,9 @@ class RedisWriter(Writer[DS, CE]):
 
 
 class RedisView(View[DS, CE]):
+    # Number of entities whose statements are read in one pipeline:
+    BATCH_ENTITIES = 1_000
+
     def __init__(
         self, store: RedisStore[DS, CE], scope: DS, external: bool = False
     ) -> None:
@@ -112,6 +119,23 @@ class RedisView(View[DS, CE]):
             statements.append(unpack_statement(v, id, False))  # type: ignore
         return self.store.assemble(statements)
 
+    def get_entities(self, ids: Iterable[str]) -> Dict[str, CE]:
+        # Send the SUNION of the statement keys of each entity in one pipeline:
+        pipeline = self.store.db.pipeline(transaction=False)
+        queried = list(set(ids))
+        for id in queried:
+            keys = [b(f"s:{id}")]
+            if self.external:
+                keys.append(b(f"x:{id}"))
+            pipeline.sunion(keys)
+        entities: Dict[str, CE] = {}
+        for id, values in zip(queried, pipeline.execute()):
+            statements = [unpack_statement(v, id, False) for v in values]
+            entity = self.store.assemble(statements)
+            if entity is not None:
+                entities[id] = entity
+        return entities
+
     def get_inverted(self, id: str) -> Generator[Tuple[Property, CE], None, None]:
         for v in self.store.db.smembers(b(f"i:{id}")):
             entity = self.get_entity(v.decode("utf-8"))
@@ -121,13 +145,32 @@ class RedisView(View[DS, CE]):
                 if value == id and prop.reverse is not None:
                     yield prop.reverse, entity
 
-    def entities(self) -> Generator[CE, None, None]:
+    def _scope_ids(self) -> Generator[str, None, None]:
         scope_name = b(f"ds:{self.scope.name}")
         if self.scope.is_collection:
             parts = [b(f"ds:{d}") for d in self.scope.leaf_names]
             self.store.db.sunionstore(scope_name, parts)
 
         for id in self.store.db.sscan_iter(scope_name):
-            entity = self.get_entity(id.decode("utf-8"))
+            yield id.decode("utf-8")
+
+    def entities(self) -> Generator[CE, None, None]:
+        for id in self._scope_ids():
+            entity = self.get_entity(id)
             if entity is not None:
                 yield entity
+
+    def _statement_keys(self) -> Generator[str, None, None]:
+        # Only the statement ID is decoded from each packed statement, in
+        # pipelines of `BATCH_ENTITIES`, rather than assembling the entities:
+        ids = self._scope_ids()
+        for batch in iter(lambda: list(islice(ids, self.BATCH_ENTITIES)), []):
+            pipeline = self.store.db.pipeline(transaction=False)
+            for id in batch:
+                keys = [b(f"s:{id}")]
+                if self.external:
+                    keys.append(b(f"x:{id}"))
+                pipeline.sunion(keys)
+            for id, values in zip(batch, pipeline.execute()):
+                for value in values:
+                    yield f"{id}:{orjson.loads(value)[0]}"
@@ -1,7 +1,7 @@
-from typing import Any, Generator, List, Optional, Set, Tuple
+from typing import Any, Dict, Generator, Iterable, List, Optional, Set, Tuple
 
 from followthemoney.property import Property
-from sqlalchemy import Table, delete, func, select
+from sqlalchemy import Table, delete, func, or_, select
 from sqlalchemy.engine import Engine, Transaction, create_engine
 from sqlalchemy.sql.selectable import Select
 
@@ -13,6 +13,7 @@ from nomenklatura.resolver import Linker, Identifier
 from nomenklatura.statement import Statement
 from nomenklatura.statement.db import make_statement_table
 from nomenklatura.store import Store, View, Writer
+from nomenklatura.util import iso_datetime, datetime_iso
 
 
 class SQLStore(Store[DS, CE]):
@@ -119,10 +120,12 @@ class SQLWriter(Writer[DS, CE]):
         canonical_id = self.store.linker.get_canonical(stmt.entity_id)
         stmt.canonical_id = canonical_id
         self.batch.add(stmt)
+        self.store.invalidate(canonical_id)
         if len(self.batch) >= self.BATCH_STATEMENTS:
             self._upsert_batch()
 
     def pop(self, entity_id: str) -> List[Statement]:
+        self.store.invalidate(entity_id)
         if self.tx is None:
             self.tx = self.conn.begin()
 
@@ -141,6 +144,9 @@ class SQLWriter(Writer[DS, CE]):
 
 
 class SQLView(View[DS, CE]):
+    # Number of IDs in the `IN` clause of each query in `get_entities`:
+    BATCH_IDS = 500
+
     def __init__(
         self, store: SQLStore[DS, CE], scope: DS, external: bool = False
     ) -> None:
@@ -156,6 +162,25 @@ class SQLView(View[DS, CE]):
             return proxy
         return None
 
+    def get_entities(self, ids: Iterable[str]) -> Dict[str, CE]:
+        table = self.store.table
+        unique = sorted(set(ids))
+        statements: Dict[str, List[Statement]] = {}
+        for start in range(0, len(unique), self.BATCH_IDS):
+            batch = unique[start : start + self.BATCH_IDS]
+            q = select(table)
+            q = q.where(table.c.canonical_id.in_(batch))
+            q = q.where(table.c.dataset.in_(self.dataset_names))
+            for stmt in self.store._iterate_stmts(q, stream=False):
+                if stmt.canonical_id is not None:
+                    statements.setdefault(stmt.canonical_id, []).append(stmt)
+        entities: Dict[str, CE] = {}
+        for canonical_id, stmts in statements.items():
+            entity = self.store.assemble(stmts)
+            if entity is not None:
+                entities[canonical_id] = entity
+        return entities
+
     def has_entity(self, id: str) -> bool:
         table = self.store.table
         q = select(func.count(table.c.id))
@@ -195,3 +220,23 @@ class SQLView(View[DS, CE]):
         q = q.where(table.c.dataset.in_(self.dataset_names))
         q = q.order_by(table.c.canonical_id)
         yield from self.store._iterate(q, stream=True)
+
+    def _statement_keys(self) -> Generator[str, None, None]:
+        table: Table = self.store.table
+        q = select(table.c.canonical_id, table.c.id)
+        q = q.where(table.c.dataset.in_(self.dataset_names))
+        for canonical_id, stmt_id in self.store._execute(q, stream=True):
+            yield f"{canonical_id}:{stmt_id}"
+
+    def changes(
+        self, since: Optional[str] = None
+    ) -> Generator[Tuple[str, Optional[str]], None, None]:
+        table: Table = self.store.table
+        latest = func.max(table.c.first_seen)
+        q = select(table.c.canonical_id, latest)
+        q = q.where(table.c.dataset.in_(self.dataset_names))
+        q = q.group_by(table.c.canonical_id)
+        if since is not None:
+            q = q.having(or_(latest.is_(None), latest > iso_datetime(since)))
+        for canonical_id, first_seen in self.store._execute(q, stream=True):
+            yield canonical_id, datetime_iso(first_seen)
@@ -1,7 +1,8 @@
 import orjson
 import logging
+from itertools import islice
 from redis.client import Redis
-from typing import Generator, List, Optional, Set, Tuple, Dict
+from typing import Generator, Iterable, List, Optional, Set, Tuple, Dict
 from followthemoney.property import Property
 from followthemoney.types import registry
 
@@ -100,8 +101,12 @@ class VersionedRedisStore(Store[DS, CE]):
         return VersionedRedisView(self, scope, external=external, versions=versions)
 
     def update(self, id: StrIdent) -> None:
-        # Noop because the VersionedStore is not resolved.
-        return
+        # The VersionedStore is not resolved, but the entities are canonicalised
+        # when they are read, so cached copies are outdated:
+        canonical_id = self.linker.get_canonical(id)
+        for referent in self.linker.get_referents(canonical_id):
+            self.invalidate(referent)
+        self.invalidate(canonical_id)
 
     def get_latest(self, dataset: str) -> Optional[str]:
         """Get the latest version of a dataset in the store."""
@@ -238,6 +243,9 @@ class VersionedRedisWriter(Writer[DS, CE]):
 
 
 class VersionedRedisView(View[DS, CE]):
+    # Number of entities whose statements are read in one pipeline:
+    BATCH_ENTITIES = 1_000
+
     def __init__(
         self,
         store: VersionedRedisStore[DS, CE],
@@ -293,8 +301,28 @@ class VersionedRedisView(View[DS, CE]):
         return timestamps
 
     def get_entity(self, id: str) -> Optional[CE]:
+        return self._assemble(self._get_statements(id))
+
+    def get_entities(self, ids: Iterable[str]) -> Dict[str, CE]:
+        # Send the SUNION of the statement keys of each entity in one pipeline:
+        pipeline = self.store.db.pipeline(transaction=False)
+        queried: List[str] = []
+        for id in set(ids):
+            keys = self._get_stmt_keys(id)
+            if len(keys):
+                pipeline.sunion(keys)
+                queried.append(id)
+        entities: Dict[str, CE] = {}
+        for id, values in zip(queried, pipeline.execute()):
+            stmts = (_unpack_statement(bv(v), id) for v in values)
+            entity = self._assemble(stmts)
+            if entity is not None:
+                entities[id] = entity
+        return entities
+
+    def _assemble(self, stmts: Iterable[Statement]) -> Optional[CE]:
         statements: List[Statement] = []
-        for stmt in self._get_statements(id):
+        for stmt in stmts:
             if not stmt.external or self.external:
                 stmt.canonical_id = self.store.linker.get_canonical(stmt.entity_id)
                 if stmt.prop_type == registry.entity.name:
@@ -342,6 +370,27 @@ class VersionedRedisView(View[DS, CE]):
                         stmt = self.store.linker.apply_statement(stmt)
                     yield stmt
 
+    def _statement_keys(self) -> Generator[str, None, None]:
+        # Only the statement ID and the external flag are decoded from each
+        # packed statement, in pipelines of `BATCH_ENTITIES`, rather than
+        # assembling the entities:
+        for ds, ver in self.vers:
+            ids = (
+                i.decode("utf-8")
+                for i in self.store.db.sscan_iter(b(f"ents:{ds}:{ver}"))
+            )
+            for batch in iter(lambda: list(islice(ids, self.BATCH_ENTITIES)), []):
+                pipeline = self.store.db.pipeline(transaction=False)
+                for entity_id in batch:
+                    pipeline.smembers(b(f"stmt:{ds}:{ver}:{entity_id}"))
+                for entity_id, values in zip(batch, pipeline.execute()):
+                    canonical_id = self.store.linker.get_canonical(entity_id)
+                    for value in values:
+                        data = orjson.loads(value)
+                        if data[10] == 1 and not self.external:
+                            continue
+                        yield f"{canonical_id}:{data[0]}"
+
     def entities(self) -> Generator[CE, None, None]:
         if len(self.vers) == 0:
             return
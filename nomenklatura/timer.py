@@ -0,0 +1,127 @@
+import time
+import random
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Generator, Iterable, List, TypeVar
+
+T = TypeVar("T")
+
+
+class Phase(object):
+    """The accumulated duration of one phase of a process, like blocking or
+    scoring. The durations of individual calls are kept as a bounded random
+    sample, from which percentiles are estimated."""
+
+    SAMPLES = 10_000
+
+    __slots__ = ("count", "total", "samples", "_random")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.samples: List[float] = []
+        self._random = random.Random(self.SAMPLES)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if len(self.samples) < self.SAMPLES:
+            self.samples.append(seconds)
+            return
+        # Reservoir sampling keeps each duration with the same probability:
+        idx = self._random.randrange(self.count)
+        if idx < self.SAMPLES:
+            self.samples[idx] = seconds
+
+    def percentile(self, pct: float) -> float:
+        if not len(self.samples):
+            return 0.0
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, int(len(ordered) * pct / 100.0))
+        return ordered[idx]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "seconds": self.total,
+            "mean": self.total / max(1, self.count),
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class Timer(object):
+    """Timers and counters for the phases of a long-running process, to tell
+    where its time is spent. Phases may be nested, so their durations do not
+    necessarily add up to the total run time."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.phases: Dict[str, Phase] = {}
+        self.counters: Dict[str, int] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        """Record the duration of a call in the phase `name`."""
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase()
+        phase.add(seconds)
+
+    @contextmanager
+    def phase(self, name: str) -> Generator[None, None, None]:
+        """Time the code in the context as a call in the phase `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def iterate(self, name: str, items: Iterable[T]) -> Generator[T, None, None]:
+        """Generate the items, timing the production of each one as a call in
+        the phase `name`. This is used to time lazy producers, like an index
+        which generates pairs while it is queried."""
+        iterator = iter(items)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add(name, time.perf_counter() - started)
+            yield item
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = self.elapsed
+        return {
+            "seconds": elapsed,
+            "phases": {n: p.to_dict() for n, p in self.phases.items()},
+            "counters": dict(self.counters),
+            "rates": {n: c / max(elapsed, 1e-6) for n, c in self.counters.items()},
+        }
+
+    def log_summary(self, log: logging.Logger, title: str) -> None:
+        """Log the total time, the time spent in each phase and the rate of each
+        counter per second."""
+        elapsed = self.elapsed
+        log.info("%s: %.2fs", title, elapsed)
+        for name, phase in sorted(self.phases.items(), key=lambda p: -p[1].total):
+            log.info(
+                "  %s: %.2fs (%.1f%%), %d calls, p50: %.4fs, p99: %.4fs",
+                name,
+                phase.total,
+                phase.total / max(elapsed, 1e-6) * 100.0,
+                phase.count,
+                phase.percentile(50),
+                phase.percentile(99),
+            )
+        for name, value in self.counters.items():
+            log.info("  %s: %d (%.1f/s)", name, value, value / max(elapsed, 1e-6))
@@ -1,19 +1,46 @@
+import json
+import time
 import logging
-from typing import List, Optional, Type
+from collections import deque
+from datetime import datetime
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Deque, Dict, Generator, Iterable, List, Optional, Set
+from typing import Tuple, Type
 from followthemoney.schema import Schema
 from pathlib import Path
 
-from nomenklatura.dataset import DS
+from nomenklatura.dataset import DS, Dataset
 from nomenklatura.entity import CE
-from nomenklatura.store import Store
+from nomenklatura.statement import Statement
+from nomenklatura.store import CachedView, Store, View
 from nomenklatura.judgement import Judgement
-from nomenklatura.resolver import Resolver
-from nomenklatura.index import get_index
+from nomenklatura.resolver import Identifier, Pair, Resolver
+from nomenklatura.index import BaseIndex, get_index
 from nomenklatura.matching import DefaultAlgorithm, ScoringAlgorithm
 from nomenklatura.conflicting_match import ConflictingMatchReporter
+from nomenklatura.checkpoint import XrefCheckpoint, XrefWatermark
+from nomenklatura.timer import Timer
 
 log = logging.getLogger(__name__)
 
+# Number of blocked pairs for which the entities are loaded at a time:
+FETCH_BATCH = 1_000
+# Number of candidate pairs sent to a scoring worker at a time:
+SCORE_BATCH = 50
+# Seconds between saves of the resolver and the checkpoint of a run:
+CHECKPOINT_INTERVAL = 300.0
+# Number of changed entities matched against the index at a time:
+MATCH_BATCH = 100
+# Number of matches from the index considered for each changed entity:
+MATCH_LIMIT = 30
+
+# The position of the pair in the blocking order, the pair, its entities and
+# the blocking score:
+Candidate = Tuple[int, Identifier, Identifier, CE, CE, float]
+# A pair of entities as sent to a scoring worker, as their statements:
+ScoreTask = Tuple[List[Statement], List[Statement]]
+
 
 def _print_stats(pairs: int, suggested: int, scores: List[float]) -> None:
     matches = len(scores)
@@ -27,6 +54,238 @@ def _print_stats(pairs: int, suggested: int, scores: List[float]) -> None:
     )
 
 
+def _scan_changes(
+    view: View[DS, CE], since: Optional[str]
+) -> Tuple[Optional[str], List[str]]:
+    """Find the IDs of the entities which changed after `since`, and the latest
+    of their changes, or `since` if there are none. The changes are queried
+    from the store, see `View.changes()`. Entities without a recorded change
+    are always included."""
+    latest: Optional[str] = since
+    changed: List[str] = []
+    for entity_id, last_change in view.changes(since=since):
+        if last_change is not None and (latest is None or last_change > latest):
+            latest = last_change
+        if since is not None:
+            changed.append(entity_id)
+    return latest, changed
+
+
+def _changed_pairs(
+    index: BaseIndex[DS, CE],
+    view: View[DS, CE],
+    changed: List[str],
+    max_pairs: int,
+    reached: Dict[str, Tuple[int, int]],
+) -> Generator[Tuple[Pair, float], None, None]:
+    """Block pairs for the changed entities only, by matching them against the
+    index. The pairs for each batch of entities are yielded in descending order
+    of score, and each pair is yielded once, up to `max_pairs`. For each changed
+    entity which was matched, `reached` records the number of pairs to decide
+    before its first pair, and before it counts as reached: up to its last
+    pair, or up to the pairs of the earlier batches if it has none of its own."""
+    seen: Set[Pair] = set()
+    for start in range(0, len(changed), MATCH_BATCH):
+        batch_ids = changed[start : start + MATCH_BATCH]
+        entities = view.get_entities(batch_ids)
+        batch = [e for e in entities.values() if e.id is not None]
+        scores: Dict[Pair, float] = {}
+        for entity, matches in zip(batch, index.match_many(batch, MATCH_LIMIT)):
+            assert entity.id is not None
+            for other_id, score in matches:
+                if other_id.id == entity.id:
+                    continue
+                pair = Identifier.pair(entity.id, other_id)
+                if pair not in seen and score > scores.get(pair, 0.0):
+                    scores[pair] = score
+        offset = len(seen)
+        if offset >= max_pairs:
+            return
+        ranked = sorted(scores.items(), key=lambda p: p[1], reverse=True)
+        kept = ranked[: max_pairs - offset]
+        # The positions before the first and after the last pair of each entity
+        # in the blocking order, where the last is -1 if its pairs were cut:
+        members = set(batch_ids)
+        spans: Dict[str, Tuple[int, int]] = {}
+        for position, (pair, _) in enumerate(kept, offset + 1):
+            for ident in pair:
+                if ident.id in members:
+                    first, _ = spans.get(ident.id, (position - 1, position))
+                    spans[ident.id] = (first, position)
+        for pair, _ in ranked[len(kept) :]:
+            for ident in pair:
+                if ident.id in members:
+                    first, _ = spans.get(ident.id, (-1, -1))
+                    spans[ident.id] = (first, -1)
+        for entity_id in batch_ids:
+            reached[entity_id] = spans.get(entity_id, (offset, offset))
+        for pair, score in kept:
+            seen.add(pair)
+            yield pair, score
+        if len(kept) < len(ranked):
+            return
+
+
+def _pending(
+    changed: List[str], reached: Dict[str, Tuple[int, int]], decided: Optional[int]
+) -> List[str]:
+    """The changed entities which were not reached, given the number of blocked
+    pairs which were `decided`, or None if all of them were. So that every run
+    makes progress, the first entity whose pairs were only partly decided is
+    counted as reached as well, and its remaining pairs are dropped like the
+    pairs beyond `max_pairs` in a full run."""
+    pending: List[str] = []
+    partial = False
+    for entity_id in changed:
+        first, last = reached.get(entity_id, (-1, -1))
+        if last >= 0 and (decided is None or last <= decided):
+            continue
+        if not partial and first >= 0 and (decided is None or first < decided):
+            partial = True
+            continue
+        pending.append(entity_id)
+    return pending
+
+
+def _is_open(
+    resolver: Resolver[CE], timer: Timer, left_id: Identifier, right_id: Identifier
+) -> bool:
+    """Check that a pair has not been decided, and that neither of its entities
+    has been merged into another since the pair was blocked."""
+    with timer.phase("resolver"):
+        if not resolver.check_candidate(left_id, right_id):
+            return False
+        if resolver.get_canonical(left_id) != left_id.id:
+            return False
+        return resolver.get_canonical(right_id) == right_id.id
+
+
+def _candidates(
+    resolver: Resolver[CE],
+    timer: Timer,
+    view: View[DS, CE],
+    pairs: Iterable[Tuple[Pair, float]],
+    range: Optional[Schema],
+) -> Generator[Candidate[CE], None, None]:
+    """Load the entities of the blocked pairs which have not been decided yet,
+    and which can be matched within the `range`. The entities are loaded from
+    the view for `FETCH_BATCH` pairs at a time."""
+    blocked = enumerate(pairs)
+    for batch in iter(lambda: list(islice(blocked, FETCH_BATCH)), []):
+        timer.count("pairs", len(batch))
+        open_pairs: List[Tuple[int, Pair, float]] = []
+        ids: Set[str] = set()
+        with timer.phase("resolver"):
+            for idx, ((left_id, right_id), score) in batch:
+                if resolver.check_candidate(left_id, right_id):
+                    open_pairs.append((idx, (left_id, right_id), score))
+                    ids.update((left_id.id, right_id.id))
+        with timer.phase("fetch"):
+            entities = view.get_entities(ids)
+        for idx, (left_id, right_id), score in open_pairs:
+            # Decisions about earlier pairs may have been made since the batch
+            # was loaded:
+            if not _is_open(resolver, timer, left_id, right_id):
+                continue
+
+            left = entities.get(left_id.id)
+            right = entities.get(right_id.id)
+            if left is None or left.id is None or right is None or right.id is None:
+                continue
+
+            if not left.schema.can_match(right.schema):
+                continue
+
+            if range is not None:
+                if not left.schema.is_a(range) and not right.schema.is_a(range):
+                    continue
+            timer.count("candidates")
+            yield idx, left_id, right_id, left, right, score
+
+
+def _score_batch(
+    algorithm: Type[ScoringAlgorithm],
+    entity_class: Type[CE],
+    dataset: str,
+    batch: List[ScoreTask],
+) -> List[Tuple[float, float]]:
+    """Score a batch of entity pairs in a worker process, returning the score of
+    each pair and the time it took to compute. The entities are re-assembled
+    from their statements, which are cheaper to send to the worker than the
+    entity objects."""
+    scope = Dataset.make({"name": dataset, "title": dataset})
+    scores: List[Tuple[float, float]] = []
+    for left_stmts, right_stmts in batch:
+        left = entity_class.from_statements(scope, left_stmts)
+        right = entity_class.from_statements(scope, right_stmts)
+        started = time.perf_counter()
+        score = algorithm.compare(left, right).score
+        scores.append((score, time.perf_counter() - started))
+    return scores
+
+
+def _score_candidates(
+    resolver: Resolver[CE],
+    timer: Timer,
+    candidates: Iterable[Candidate[CE]],
+    algorithm: Type[ScoringAlgorithm],
+    store: Store[DS, CE],
+    workers: int,
+) -> Generator[Tuple[Candidate[CE], float], None, None]:
+    """Score the candidate pairs with the `algorithm`, in the order in which they
+    were blocked. With more than one worker, batches of `SCORE_BATCH` pairs are
+    scored by a pool of processes, ahead of the decisions about earlier pairs.
+    Pairs which were decided while they were being scored, e.g. by an auto-merge,
+    are skipped. The time spent scoring is recorded per algorithm, and for the
+    process pool also the time spent waiting for the workers."""
+    phase = f"score:{algorithm.NAME}"
+    if workers < 2:
+        for candidate in candidates:
+            _, _, _, left, right, _ = candidate
+            with timer.phase(phase):
+                score = algorithm.compare(left, right).score
+            yield candidate, score
+        return
+
+    log.info("Scoring candidates (%d workers)...", workers)
+    items = iter(candidates)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep a bounded number of batches in flight, in submission order:
+        pending: Deque[Tuple[List[Candidate[CE]], Future[List[Tuple[float, float]]]]]
+        pending = deque()
+        try:
+            for batch in iter(lambda: list(islice(items, SCORE_BATCH)), []):
+                tasks = [(list(c[3].statements), list(c[4].statements)) for c in batch]
+                future = executor.submit(
+                    _score_batch,
+                    algorithm,
+                    store.entity_class,
+                    store.dataset.name,
+                    tasks,
+                )
+                pending.append((batch, future))
+                if len(pending) > workers * 2:
+                    batch, future = pending.popleft()
+                    with timer.phase("score_wait"):
+                        results = future.result()
+                    for candidate, (score, seconds) in zip(batch, results):
+                        timer.add(phase, seconds)
+                        if _is_open(resolver, timer, candidate[1], candidate[2]):
+                            yield candidate, score
+            while len(pending):
+                batch, future = pending.popleft()
+                with timer.phase("score_wait"):
+                    results = future.result()
+                for candidate, (score, seconds) in zip(batch, results):
+                    timer.add(phase, seconds)
+                    if _is_open(resolver, timer, candidate[1], candidate[2]):
+                        yield candidate, score
+        finally:
+            # Don't score the pairs of the pending batches if xref stops early:
+            for _, future in pending:
+                future.cancel()
+
+
 def xref(
     resolver: Resolver[CE],
     store: Store[DS, CE],
@@ -41,49 +300,146 @@ def xref(
     focus_dataset: Optional[str] = None,
     algorithm: Type[ScoringAlgorithm] = DefaultAlgorithm,
     index_type: Optional[str] = None,
+    index_options: Dict[str, Any] = {},
+    workers: int = 1,
     user: Optional[str] = None,
+    entity_cache: int = CachedView.SIZE,
+    report: Optional[Path] = None,
+    checkpoint: Optional[Path] = None,
+    resume: bool = False,
+    checkpoint_interval: float = CHECKPOINT_INTERVAL,
+    watermark: Optional[Path] = None,
 ) -> None:
+    """Generate and score candidate pairs of entities in the store, and suggest
+    them in the resolver. `workers` sets the number of processes used for
+    blocking, and for scoring pairs if `scored` is set. The decisions about
+    each pair are made in the order in which the pairs were blocked, regardless
+    of the number of workers. The `entity_cache` most recently used entities are
+    kept in memory, as popular entities are part of many candidate pairs.
+
+    The time spent in each phase of the run is logged at the end, and written
+    to the JSON file at `report`, if given.
+
+    If a `checkpoint` directory is given, the blocked pairs and the number of
+    pairs decided so far are written to it, and the resolver is saved every
+    `checkpoint_interval` seconds and when the run is interrupted. With `resume`,
+    a run continues from the checkpoint of an interrupted run with the same
+    parameters and resolver, if the data in the store is unchanged since the
+    checkpoint was saved. It does not block again if the pairs were all
+    blocked. The checkpoint is removed once the run completes.
+
+    If a `watermark` file is given, the latest change to the entities in the
+    store when the run started, as queried by `View.changes()`, is written to it
+    once the run completes, or the start time of the run if no changes are
+    recorded. If the file already
+    exists, the run is incremental: only the entities which changed since the
+    watermark are matched against the index, so that only pairs with at least
+    one changed entity are scored. If an incremental run stops at the `limit`,
+    or blocking stops at `limit * limit_factor` pairs, the changed entities
+    whose pairs were not all decided are kept in the watermark file, and are
+    matched again by the next run, along with the entities which changed
+    since."""
     log.info("Begin xref: %r, resolver: %s", store, resolver)
-    view = store.default_view(external=external)
-    index = get_index(view, index_dir, index_type)
+    timer = Timer()
+    view = CachedView(store.default_view(external=external), size=entity_cache)
+    started = datetime.now().isoformat(sep="T", timespec="seconds")
+    mark: Optional[XrefWatermark] = None
+    since: Optional[str] = None
+    if watermark is not None:
+        mark = XrefWatermark(watermark)
+        if mark.load():
+            since = mark.since
+            log.info("Incremental xref of entities changed since: %s", since)
+    ckpt: Optional[XrefCheckpoint] = None
+    # The statements in the view, regardless of how they are merged:
+    fingerprint: Optional[str] = None
+    if checkpoint is not None:
+        if resolver.path is None:
+            raise RuntimeError("Xref checkpoints need a resolver with a path")
+        params = {
+            "limit": limit,
+            "limit_factor": limit_factor,
+            "scored": scored,
+            "external": external,
+            "range": range.name if range is not None else None,
+            "algorithm": algorithm.NAME,
+            "index_type": index_type,
+            "since": since,
+            "resolver": resolver.path.as_posix(),
+        }
+        ckpt = XrefCheckpoint(checkpoint, params)
+        if resume:
+            fingerprint = view.fingerprint(canonical=False)
+            ckpt.load(fingerprint=fingerprint)
     conflict_reporter = None
     if conflicting_match_threshold is not None:
         conflict_reporter = ConflictingMatchReporter(
             view, resolver, conflicting_match_threshold
         )
 
+    scores: List[float] = []
+    # Pairs before the cursor have been decided:
+    base = cursor = ckpt.cursor if ckpt is not None else 0
+    saved = time.monotonic()
+    completed = False
+    # The number of blocked pairs which were decided, if the run stopped early:
+    decided: Optional[int] = None
+    max_pairs = limit * limit_factor
     try:
-        scores: List[float] = []
-        suggested = 0
+        suggested = ckpt.suggested if ckpt is not None else 0
         idx = 0
-        pairs = index.pairs(max_pairs=limit * limit_factor)
-        for idx, ((left_id, right_id), score) in enumerate(pairs):
-            if idx % 1000 == 0 and idx > 0:
-                _print_stats(idx, suggested, scores)
-
-            if not resolver.check_candidate(left_id, right_id):
-                continue
+        pairs: Iterable[Tuple[Pair, float]]
+        latest: Optional[str] = None
+        changed: List[str] = []
+        reached: Dict[str, Tuple[int, int]] = {}
+        if ckpt is not None and ckpt.blocked:
+            pairs = islice(ckpt.saved_pairs(), base, None)
+            latest = ckpt.latest
+            changed = ckpt.changed
+            reached = ckpt.reached
+        else:
+            if mark is not None:
+                with timer.phase("changes"):
+                    latest, scanned = _scan_changes(view, since)
+                changed = list(dict.fromkeys(mark.pending + scanned))
+                timer.count("changed", len(changed))
+                if ckpt is not None:
+                    ckpt.latest = latest
+                    ckpt.changed = changed
+                    ckpt.reached = reached
+            options = {"workers": workers, **index_options}
+            with timer.phase("index"):
+                index = get_index(view, index_dir, index_type, options=options)
+            if since is not None:
+                pairs = _changed_pairs(index, view, changed, max_pairs, reached)
+            else:
+                pairs = index.iter_pairs(max_pairs=max_pairs, range=range)
+            pairs = timer.iterate("blocking", pairs)
+            if ckpt is not None:
+                pairs = ckpt.record(pairs)
+        candidates = _candidates(resolver, timer, view, pairs, range)
+        if scored:
+            results = _score_candidates(
+                resolver, timer, candidates, algorithm, store, workers
+            )
+        else:
+            results = ((c, c[5]) for c in candidates)
+        for (idx, left_id, right_id, left, right, _), score in results:
+            cursor = base + idx
+            if ckpt is not None and time.monotonic() - saved > checkpoint_interval:
+                with timer.phase("checkpoint"):
+                    resolver.save()
+                    fingerprint = fingerprint or view.fingerprint(canonical=False)
+                    ckpt.save(cursor, suggested, fingerprint)
+                saved = time.monotonic()
 
-            left = view.get_entity(left_id.id)
-            right = view.get_entity(right_id.id)
-            if left is None or left.id is None or right is None or right.id is None:
-                continue
-
-            if not left.schema.can_match(right.schema):
-                continue
-
-            if range is not None:
-                if not left.schema.is_a(range) and not right.schema.is_a(range):
-                    continue
-
-            if scored:
-                result = algorithm.compare(left, right)
-                score = result.score
+            if len(scores) % 1000 == 0 and len(scores) > 0:
+                _print_stats(idx, suggested, scores)
 
             scores.append(score)
 
             if conflict_reporter is not None:
-                conflict_reporter.check_match(result.score, left_id.id, right_id.id)
+                conflict_reporter.check_match(score, left_id.id, right_id.id)
 
             # Not sure this is globally a good idea.
             if len(left.datasets.intersection(right.datasets)) > 0:
@@ -91,10 +447,13 @@ def xref(
 
             if auto_threshold is not None and score > auto_threshold:
                 log.info("Auto-merge [%.2f]: %s <> %s", score, left, right)
-                canonical_id = resolver.decide(
-                    left_id, right_id, Judgement.POSITIVE, user=user
-                )
-                store.update(canonical_id)
+                with timer.phase("resolver"):
+                    canonical_id = resolver.decide(
+                        left_id, right_id, Judgement.POSITIVE, user=user
+                    )
+                with timer.phase("update"):
+                    store.update(canonical_id)
+                timer.count("merged")
                 continue
 
             if focus_dataset in left.datasets and focus_dataset not in right.datasets:
@@ -102,14 +461,44 @@ def xref(
             if focus_dataset not in left.datasets and focus_dataset in right.datasets:
                 score = (score + 1.0) / 2.0
 
-            resolver.suggest(left.id, right.id, score, user=user)
+            assert left.id is not None and right.id is not None
+            with timer.phase("resolver"):
+                resolver.suggest(left.id, right.id, score, user=user)
             if suggested >= limit:
+                decided = cursor + 1
                 break
             suggested += 1
+            timer.count("suggested")
         _print_stats(idx, suggested, scores)
+        log.info("Entity cache: %r (hit rate: %.2f)", view, view.hit_rate)
 
         if conflict_reporter is not None:
             conflict_reporter.report()
+        if mark is not None:
+            mark.save(latest or started, _pending(changed, reached, decided))
+            log.info("Xref watermark: %r", mark)
+        completed = True
 
     except KeyboardInterrupt:
         log.info("User cancelled, xref will end gracefully.")
+    finally:
+        if ckpt is not None:
+            if completed:
+                ckpt.clear()
+            else:
+                resolver.save()
+                fingerprint = fingerprint or view.fingerprint(canonical=False)
+                ckpt.save(cursor, suggested, fingerprint)
+                ckpt.close()
+                log.info("Saved xref checkpoint: %r", ckpt)
+        timer.count("scored", len(scores))
+        timer.log_summary(log, "Xref timings")
+        if report is not None:
+            data = timer.to_dict()
+            data["entity_cache"] = {
+                "hits": view.hits,
+                "misses": view.misses,
+                "hit_rate": view.hit_rate,
+            }
+            with open(report, "w") as fh:
+                json.dump(data, fh, indent=2)
@@ -30,6 +30,8 @@ setup(
         "textual >= 0.19.0, < 1.0.0",
         "sqlalchemy >= 2.0.0",
         "scikit-learn == 1.5.0",
+        "numpy >= 1.22.0, < 3.0.0",
+        "scipy >= 1.8.0, < 2.0.0",
         "pydantic > 2.0.0, < 3.0.0",
         "click < 9.0.0",
         "lxml > 4.0.0, < 6.0.0",
@@ -58,7 +60,7 @@ setup(
             "fakeredis",
             "plyvel < 2.0.0",
             "redis > 5.0.0, < 6.0.0",
-            "tantivy < 1.0.0",
+            "tantivy >= 0.26.0, < 1.0.0",
         ],
         "leveldb": [
             "plyvel < 2.0.0",
@@ -67,7 +69,7 @@ setup(
             "redis > 5.0.0, < 6.0.0",
         ],
         "tantivy": [
-            "tantivy < 1.0.0",
+            "tantivy >= 0.26.0, < 1.0.0",
         ],
     },
 )
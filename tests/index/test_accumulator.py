@@ -0,0 +1,59 @@
+from nomenklatura.index.accumulator import PairAccumulator
+from nomenklatura.resolver import Identifier
+
+
+def _pair(left: str, right: str):
+    return Identifier.pair(left, right)
+
+
+def test_accumulator_put():
+    acc = PairAccumulator(2)
+    acc.put(_pair("a", "b"), 3.0)
+    acc.put(_pair("b", "a"), 1.0)
+    acc.put(_pair("a", "c"), 2.0)
+    acc.put(_pair("a", "d"), 1.0)
+    assert len(acc) == 3
+    assert acc.result() == [(_pair("a", "b"), 3.0), (_pair("a", "c"), 2.0)]
+
+
+def test_accumulator_bounded():
+    acc = PairAccumulator(10, factor=2)
+    for i in range(1000):
+        acc.put(_pair("a", f"e{i:04d}"), float(i))
+        assert len(acc) <= 20
+    assert acc.threshold > 900.0
+    assert not acc.accepts(10.0)
+    result = acc.result()
+    assert len(result) == 10
+    assert [s for _, s in result] == [float(i) for i in range(999, 989, -1)]
+
+    # New pairs below the threshold are rejected:
+    acc.put(_pair("x", "y"), 1.0)
+    assert _pair("x", "y") not in dict(acc.result())
+    # Dropped pairs return with a better score:
+    acc.put(_pair("a", "e0001"), 2000.0)
+    assert acc.result()[0] == (_pair("a", "e0001"), 2000.0)
+
+
+def test_accumulator_iter_result():
+    acc = PairAccumulator(5)
+    for i in range(20):
+        acc.put(_pair("a", f"e{i:04d}"), float(i % 7))
+    result = list(acc.iter_result())
+    assert len(result) == 5
+    assert [s for _, s in result] == [s for _, s in acc.result()]
+    assert list(PairAccumulator(5).iter_result()) == []
+
+
+def test_accumulator_admit():
+    acc = PairAccumulator(3, factor=2)
+    first = acc.admit((_pair("a", f"e{i}"), float(i)) for i in range(5))
+    assert first == [(_pair("a", f"e{i}"), float(i)) for i in (4, 3, 2)]
+    # Only the pairs of the batch which are among the best so far:
+    second = acc.admit([(_pair("b", "x"), 3.5), (_pair("b", "y"), 0.5)])
+    assert second == [(_pair("b", "x"), 3.5)]
+    assert acc.result() == [
+        (_pair("a", "e4"), 4.0),
+        (_pair("b", "x"), 3.5),
+        (_pair("a", "e3"), 3.0),
+    ]
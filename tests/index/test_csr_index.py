@@ -0,0 +1,189 @@
+import logging
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from followthemoney import model
+from nomenklatura.dataset import Dataset
+from nomenklatura.entity import CompositeEntity
+from nomenklatura.index import CSRIndex, Index
+from nomenklatura.resolver.identifier import Identifier
+from nomenklatura.store import SimpleMemoryStore
+
+VERBAND_ID = "62ad0fe6f56dbbf6fee57ce3da76e88c437024d5"
+VERBAND_BADEN_ID = "69401823a9f0a97cfdc37afa7c3158374e007669"
+VERBAND_BADEN_DATA = {
+    "id": "bla",
+    "schema": "Company",
+    "properties": {
+        "name": ["VERBAND DER METALL UND ELEKTROINDUSTRIE BADEN WURTTEMBERG"]
+    },
+}
+
+
+def _measure(index_class, dstore: SimpleMemoryStore, index_path: Path):
+    """Build an index and compute its blocking pairs, returning the memory it
+    allocated and the time it took. The time is measured in a separate run, as
+    tracing allocations slows down the dict layout more than the arrays."""
+    entities = list(dstore.default_view().entities())
+    results = []
+    for traced in (True, False):
+        index = index_class(dstore.default_view(), index_path)
+        # Warm up the token cache of the measured index, so that tokenization
+        # is not attributed to either layout:
+        for entity in entities:
+            list(index.tokenizer.entity(entity))
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        for entity in entities:
+            index.index(entity)
+        index.commit()
+        index.pairs()
+        results.append(time.perf_counter() - start)
+        if traced:
+            results[-1], _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return results
+
+
+def test_csr_index_build(index_path: Path, dstore: SimpleMemoryStore):
+    index = CSRIndex(dstore.default_view(), index_path)
+    assert len(index) == 0, index.fields
+    index.build()
+    assert len(index) == 184, len(index)
+    field = index.fields["name"]
+    assert field.offsets[-1] == len(field.entities)
+    assert len(field.lengths) == len(index)
+
+
+def test_csr_match_score(dstore: SimpleMemoryStore, index_path: Path):
+    index = CSRIndex(dstore.default_view(), index_path)
+    index.build()
+    dx = Dataset.make({"name": "test", "title": "Test"})
+    entity = CompositeEntity.from_data(dx, VERBAND_BADEN_DATA)
+    matches = index.match(entity)
+    assert len(matches) == 9, matches
+    assert matches[0][0] == Identifier(VERBAND_BADEN_ID), matches
+    assert 1.99 < matches[0][1] < 2, matches
+    assert matches[1][0] == Identifier(VERBAND_ID), matches
+
+
+def test_csr_index_same_as_dict(
+    dstore: SimpleMemoryStore, dindex: Index, index_path: Path
+):
+    index = CSRIndex(dstore.default_view(), index_path)
+    index.build()
+    expected = dict(dindex.pairs(max_pairs=100_000))
+    pairs = dict(index.pairs(max_pairs=100_000))
+    assert expected.keys() == pairs.keys()
+    for pair, score in expected.items():
+        assert pairs[pair] == pytest.approx(score), pair
+
+    for entity in list(dstore.default_view().entities())[:20]:
+        expected_matches = dict(dindex.match(entity))
+        matches = dict(index.match(entity))
+        assert expected_matches.keys() == matches.keys()
+        for ident, score in expected_matches.items():
+            assert matches[ident] == pytest.approx(score), ident
+
+
+def test_csr_index_incremental_commit(dstore: SimpleMemoryStore, index_path: Path):
+    entities = list(dstore.default_view().entities())
+    full = CSRIndex(dstore.default_view(), index_path)
+    full.build()
+
+    index = CSRIndex(dstore.default_view(), index_path)
+    for entity in entities[:100]:
+        index.index(entity)
+    index.commit()
+    for entity in entities[100:]:
+        index.index(entity)
+    index.commit()
+    assert len(index) == len(full)
+    assert dict(index.pairs()).keys() == dict(full.pairs()).keys()
+
+
+def test_csr_memory_comparison(
+    dstore: SimpleMemoryStore, index_path: Path, record_property, caplog
+):
+    """Compare the memory allocated by the dict and the array layouts, and the
+    time they take, for building the index and computing blocking pairs. The
+    array layout has a fixed overhead per commit, so on a fixture of this size
+    only its memory use is asserted, the times are reported."""
+    caplog.set_level(logging.INFO)
+    dict_size, dict_time = _measure(Index, dstore, index_path)
+    csr_size, csr_time = _measure(CSRIndex, dstore, index_path)
+    report = "dict: %d bytes in %.3fs, csr: %d bytes in %.3fs" % (
+        dict_size,
+        dict_time,
+        csr_size,
+        csr_time,
+    )
+    logging.getLogger(__name__).info("Index layouts: %s", report)
+    record_property("dict_bytes", dict_size)
+    record_property("dict_seconds", dict_time)
+    record_property("csr_bytes", csr_size)
+    record_property("csr_seconds", csr_time)
+    assert csr_size < dict_size, report
+
+
+def test_csr_index_prepare(dstore: SimpleMemoryStore, index_path: Path, caplog):
+    view = dstore.default_view()
+    index = CSRIndex(view, index_path)
+    index.prepare()
+    assert (index_path / CSRIndex.FILE_NAME).exists()
+
+    caplog.set_level(logging.INFO)
+    reused = CSRIndex(view, index_path)
+    reused.prepare()
+    assert "Using existing index" in caplog.text
+    assert reused.ids == index.ids
+    assert dict(reused.pairs()) == pytest.approx(dict(index.pairs()))
+    entity = view.get_entity(VERBAND_BADEN_ID)
+    assert dict(reused.match(entity)) == pytest.approx(dict(index.match(entity)))
+
+    # Files written in another version of the format are not read:
+    path = index_path / CSRIndex.FILE_NAME
+    reused.VERSION = CSRIndex.VERSION + 1
+    assert not reused.open(path)
+
+
+def test_csr_match_many(dstore: SimpleMemoryStore, dindex: Index, index_path: Path):
+    index = CSRIndex(dstore.default_view(), index_path)
+    index.build()
+    entities = list(dstore.default_view().entities())[:30]
+    results = index.match_many(entities, limit=5)
+    expected = dindex.match_many(entities, limit=5)
+    for matches, other in zip(results, expected):
+        assert [s for _, s in matches] == pytest.approx([s for _, s in other])
+    for entity, matches in zip(entities, index.match_many(entities)):
+        assert dict(matches) == pytest.approx(dict(dindex.match(entity)))
+    assert index.match_many([]) == []
+
+
+def test_csr_index_bm25(dstore: SimpleMemoryStore, index_path: Path):
+    options = {"scoring": "bm25"}
+    dindex = Index(dstore.default_view(), index_path, options)
+    dindex.build()
+    index = CSRIndex(dstore.default_view(), index_path, options)
+    index.build()
+    expected = dict(dindex.pairs(max_pairs=100_000))
+    pairs = dict(index.pairs(max_pairs=100_000))
+    assert pairs == pytest.approx(expected)
+    entity = dstore.default_view().get_entity(VERBAND_BADEN_ID)
+    assert dict(index.match(entity)) == pytest.approx(dict(dindex.match(entity)))
+
+
+def test_csr_pairs_schemata(dstore: SimpleMemoryStore, dindex: Index, index_path):
+    person = model.get("Person")
+    expected = dict(dindex.pairs(max_pairs=100_000, range=person))
+    assert len(expected) > 0
+    for engine in ("python", "sparse"):
+        index = CSRIndex(dstore.default_view(), index_path, {"engine": engine})
+        index.build()
+        pairs = index.pairs(max_pairs=100_000, range=person)
+        assert dict(pairs) == pytest.approx(expected), engine
+    assert len(index.schemata) == len(index.ids)
@@ -1,9 +1,16 @@
+import logging
+import pickle
+import pytest
 from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 
+from followthemoney import model
 from nomenklatura.dataset import Dataset
 from nomenklatura.entity import CompositeEntity
 from nomenklatura.index import Index
+from nomenklatura.index.mapped import MappedField
+from nomenklatura.judgement import Judgement
+from nomenklatura.resolver import Resolver
 from nomenklatura.resolver.identifier import Identifier
 from nomenklatura.store import SimpleMemoryStore
 
@@ -61,6 +68,59 @@ def test_index_pairs(dstore: SimpleMemoryStore, dindex: Index):
     # assert False
 
 
+def _exact_pairs(index: Index):
+    """Sum up the pair scores of all tokens without any bound."""
+    scores = {}
+    for field_name, field in index.fields.items():
+        boost = index.BOOSTS.get(field_name, 1.0)
+        for entry in field.tokens.values():
+            if not 1 < len(entry.entities) <= index.MAX_TOKEN_ENTITIES:
+                continue
+            weights = list(index.weights(entry, field))
+            for i, (left, lw) in enumerate(weights):
+                for right, rw in weights[i + 1 :]:
+                    left_schema = model.get(index.schemata[left])
+                    right_schema = model.get(index.schemata[right])
+                    if not left_schema.can_match(right_schema):
+                        continue
+                    if lw == 0.0 or rw == 0.0:
+                        continue
+                    pair = (max(left, right), min(left, right))
+                    scores[pair] = scores.get(pair, 0.0) + (lw + rw) * boost
+    return sorted(scores.items(), key=lambda p: p[1], reverse=True)
+
+
+def assert_top_pairs(pairs, expected, max_pairs: int):
+    """Check that `pairs` are the best `max_pairs` of `expected`, allowing for
+    ties at the cut-off."""
+    expected = expected[:max_pairs]
+    assert len(pairs) == len(expected)
+    assert [s for _, s in pairs] == pytest.approx([s for _, s in expected])
+    cutoff = expected[-1][1]
+    scores = dict(pairs)
+    for pair, score in expected:
+        if score > cutoff + 1e-9:
+            assert scores[pair] == pytest.approx(score), pair
+
+
+def assert_streamed(streamed, pairs):
+    """Check that the pairs from `iter_pairs()` include each of `pairs` once,
+    with the same score."""
+    assert len(streamed) == len(set(p for p, _ in streamed))
+    scores = dict(streamed)
+    for pair, score in pairs:
+        assert scores[pair] == pytest.approx(score), pair
+
+
+def test_index_pairs_exact(dstore: SimpleMemoryStore, dindex: Index):
+    exact = _exact_pairs(dindex)
+    assert len(exact) > 100
+    for max_pairs in (5, 20, 100):
+        pairs = dindex.pairs(max_pairs=max_pairs)
+        assert_top_pairs(pairs, exact, max_pairs)
+        assert_streamed(list(dindex.iter_pairs(max_pairs=max_pairs)), pairs)
+
+
 def test_match_score(dstore: SimpleMemoryStore, dindex: Index):
     """Match an entity that isn't itself in the index"""
     dx = Dataset.make({"name": "test", "title": "Test"})
@@ -97,3 +157,389 @@ def test_top_match_matches_strong_pairs(dstore: SimpleMemoryStore, dindex: Index
         # it'll match itself and the other in the pair
         for match, match_score in matches[:2]:
             assert match in pair, (match, pair)
+
+
+def test_index_sharded_pairs(dstore: SimpleMemoryStore, dindex: Index, index_path):
+    expected = dindex.pairs(max_pairs=100_000)
+    index = Index(dstore.default_view(), index_path, {"workers": 3})
+    index.build()
+    pairs = index.pairs(max_pairs=100_000)
+    assert len(pairs) == len(expected)
+    scores = dict(pairs)
+    for pair, score in expected:
+        assert scores[pair] == pytest.approx(score), pair
+    assert [s for _, s in pairs] == pytest.approx([s for _, s in expected])
+
+
+def test_index_sharded_pairs_top(
+    dstore: SimpleMemoryStore, dindex: Index, index_path: Path
+):
+    exact = _exact_pairs(dindex)
+    index = Index(dstore.default_view(), index_path, {"workers": 2})
+    index.build()
+    for max_pairs in (5, 20):
+        serial = dindex.pairs(max_pairs=max_pairs)
+        sharded = index.pairs(max_pairs=max_pairs)
+        assert_top_pairs(serial, exact, max_pairs)
+        assert_top_pairs(sharded, exact, max_pairs)
+        assert [s for _, s in sharded] == pytest.approx([s for _, s in serial])
+
+
+def test_index_remove_update(dstore: SimpleMemoryStore, index_path: Path):
+    view = dstore.default_view()
+    entities = [e for e in view.entities() if e.schema.matchable]
+    removed = [e for e in entities if e.id == VERBAND_BADEN_ID][0]
+    others = [e for e in entities if e.id != VERBAND_BADEN_ID]
+
+    expected = Index(view, index_path)
+    for entity in others:
+        expected.index(entity)
+    expected.commit()
+
+    index = Index(view, index_path)
+    index.build()
+    index.remove(VERBAND_BADEN_ID)
+    index.commit()
+    assert len(index) == len(expected)
+    assert VERBAND_BADEN_ID not in index.entities
+    for name, field in expected.fields.items():
+        assert index.fields[name].len == field.len, name
+        assert index.fields[name].avg_len == pytest.approx(field.avg_len), name
+        assert index.fields[name].tokens.keys() == field.tokens.keys(), name
+        for token, entry in field.tokens.items():
+            idf = index.fields[name].tokens[token].idf(index.fields[name])
+            assert idf == pytest.approx(entry.idf(field))
+
+    matches = [str(i) for i, _ in index.match(removed)]
+    assert VERBAND_BADEN_ID not in matches
+    assert dict(index.pairs()).keys() == dict(expected.pairs()).keys()
+
+    index.update(removed)
+    index.update(removed)
+    index.commit()
+    assert len(index) == len(entities)
+    matches = index.match(removed)
+    assert matches[0][0] == Identifier(VERBAND_BADEN_ID)
+    full = Index(view, index_path)
+    full.build()
+    assert dict(index.pairs()) == pytest.approx(dict(full.pairs()))
+
+
+def test_index_remove_terms(
+    dstore: SimpleMemoryStore, test_dataset: Dataset, index_path: Path
+):
+    view = dstore.default_view()
+    index = Index(view, index_path)
+    index.build()
+    entity = view.get_entity(VERBAND_BADEN_ID)
+    # Removing an entity from a build does not collect the terms of others:
+    index.remove(VERBAND_BADEN_ID)
+    assert index.terms == {}
+
+    changed = CompositeEntity.from_data(
+        test_dataset, dict(VERBAND_BADEN_DATA, id=VERBAND_BADEN_ID)
+    )
+    index.index(changed)
+    assert len(index.terms) == 1
+    index.update(entity)
+    index.commit()
+    full = Index(view, index_path)
+    full.build()
+    assert dict(index.pairs()) == pytest.approx(dict(full.pairs()))
+
+    # Postings left over when the given version differs are still removed:
+    index.terms = {}
+    index.remove(VERBAND_BADEN_ID, entity=changed)
+    index.commit()
+    for field in index.fields.values():
+        assert Identifier(VERBAND_BADEN_ID) not in field.entities
+        for entry in field.tokens.values():
+            assert Identifier(VERBAND_BADEN_ID) not in entry.entities
+
+
+def test_index_remove_updates(
+    dstore: SimpleMemoryStore, test_dataset: Dataset, tmp_path: Path, caplog
+):
+    view = dstore.default_view()
+    entity = view.get_entity(VERBAND_BADEN_ID)
+    tokens = set(Index(view, tmp_path).tokenizer.entity(entity))
+    changed = CompositeEntity.from_data(
+        test_dataset, dict(VERBAND_BADEN_DATA, id=VERBAND_BADEN_ID)
+    )
+    index = Index(view, tmp_path, {"updates": True})
+    index.build()
+    assert index.terms[Identifier(VERBAND_BADEN_ID)] == tokens
+    # The recorded terms are removed, even if a different version is given:
+    index.remove(VERBAND_BADEN_ID, entity=changed)
+    for field in index.fields.values():
+        assert Identifier(VERBAND_BADEN_ID) not in field.entities
+
+    # Tokens of entities in an index file are looked up in its postings:
+    path = tmp_path / "index.bin"
+    dindex = Index(view, tmp_path)
+    dindex.build()
+    dindex.save(path)
+    loaded = Index(view, tmp_path)
+    loaded.open(path)
+    found = set()
+    for name, field in loaded.fields.items():
+        found.update((name, t) for t in field.entity_tokens(Identifier(entity.id)))
+    assert found == tokens
+    loaded.remove(VERBAND_BADEN_ID, entity=changed)
+    loaded.commit()
+    assert "Scanning field" not in caplog.text
+    for field in loaded.fields.values():
+        assert Identifier(VERBAND_BADEN_ID) not in field.entities
+    for name, token in tokens:
+        entry = loaded.fields[name].tokens.get(token)
+        assert entry is None or Identifier(VERBAND_BADEN_ID) not in entry.entities
+
+
+def test_index_mapped(dstore: SimpleMemoryStore, dindex: Index, tmp_path: Path):
+    view = dstore.default_view()
+    path = tmp_path / "index.bin"
+    dindex.save(path, fingerprint=view.fingerprint())
+    loaded = Index.load(view, path, tmp_path)
+    assert isinstance(loaded.fields["name"], MappedField)
+    assert len(loaded) == len(dindex)
+    assert DAIMLER in loaded.entities
+    for name, field in dindex.fields.items():
+        mapped = loaded.fields[name]
+        assert mapped.len == field.len, name
+        assert len(mapped.tokens) == len(field.tokens), name
+        assert dict(mapped.entities) == dict(field.entities), name
+    assert dict(loaded.pairs()) == pytest.approx(dict(dindex.pairs()))
+    for entity in list(view.entities())[:20]:
+        assert dict(loaded.match(entity)) == pytest.approx(dict(dindex.match(entity)))
+
+    # Changes to a mapped index are kept in memory, and written on save:
+    removed = view.get_entity(VERBAND_BADEN_ID)
+    loaded.remove(VERBAND_BADEN_ID)
+    loaded.commit()
+    assert VERBAND_BADEN_ID not in loaded.entities
+    assert VERBAND_BADEN_ID not in [str(i) for i, _ in loaded.match(removed)]
+    loaded.update(removed)
+    loaded.commit()
+    assert dict(loaded.pairs()) == pytest.approx(dict(dindex.pairs()))
+    loaded.save(path, fingerprint=view.fingerprint())
+    reloaded = Index.load(view, path, tmp_path)
+    assert dict(reloaded.match(removed)) == pytest.approx(dict(dindex.match(removed)))
+
+
+def test_index_mapped_postings(dstore: SimpleMemoryStore, tmp_path: Path):
+    view = dstore.default_view()
+    for scoring in ("tf", "bm25"):
+        index = Index(view, tmp_path, {"scoring": scoring})
+        index.build()
+        path = tmp_path / f"{scoring}.bin"
+        index.save(path, fingerprint=view.fingerprint())
+        loaded = Index(view, tmp_path, {"scoring": scoring})
+        loaded.open(path)
+        entity = view.get_entity(VERBAND_BADEN_ID)
+        assert dict(loaded.match(entity)) == pytest.approx(dict(index.match(entity)))
+        # Identifiers are only made for the entities in the results:
+        file = loaded.fields["name"].mapped.file
+        made = [i for i in file._idents if i is not None]
+        assert len(made) == len(index.match(entity)) < len(loaded)
+        assert dict(loaded.pairs()) == pytest.approx(dict(index.pairs()))
+
+
+def test_index_stale(dstore: SimpleMemoryStore, dindex: Index, tmp_path: Path):
+    view = dstore.default_view()
+    # Files without a fingerprint, e.g. pickled by older versions, are replaced:
+    path = tmp_path / "index.pkl"
+    with open(path, "wb") as fh:
+        pickle.dump(dindex.to_dict(), fh)
+    loaded = Index.load(view, path, tmp_path)
+    assert not isinstance(loaded.fields["name"], MappedField)
+    loaded = Index.load(view, path, tmp_path)
+    assert isinstance(loaded.fields["name"], MappedField)
+
+    index = Index(view, tmp_path)
+    index.prepare()
+    assert not isinstance(index.fields["name"], MappedField)
+    index = Index(view, tmp_path)
+    index.prepare()
+    assert isinstance(index.fields["name"], MappedField)
+    assert dict(index.pairs()) == pytest.approx(dict(dindex.pairs()))
+
+    store = SimpleMemoryStore(dstore.dataset, dstore.linker)
+    with store.writer() as writer:
+        for entity in view.entities():
+            if entity.id != VERBAND_BADEN_ID:
+                writer.add_entity(entity)
+    # The entity removed from the data is removed from the index file:
+    index = Index(store.default_view(), tmp_path)
+    index.prepare()
+    assert isinstance(index.fields["name"], MappedField)
+    assert VERBAND_BADEN_ID not in index.entities
+
+
+def test_index_sync_changes(dstore: SimpleMemoryStore, tmp_path: Path, caplog):
+    resolver = Resolver[CompositeEntity]()
+    store = SimpleMemoryStore(dstore.dataset, resolver)
+    with store.writer() as writer:
+        for entity in dstore.default_view().entities():
+            writer.add_entity(entity)
+    view = store.default_view()
+    index = Index(view, tmp_path)
+    index.prepare()
+
+    # Add, remove and merge entities, which are then updated in the index file
+    # rather than re-building it:
+    people = [e.id for e in view.entities() if e.schema.name == "Person"]
+    with store.writer() as writer:
+        writer.pop(VERBAND_BADEN_ID)
+        data = {"id": "new", "schema": "Person", "properties": {"name": ["Quandt"]}}
+        writer.add_entity(CompositeEntity.from_data(store.dataset, data))
+    canonical_id = resolver.decide(people[0], people[1], Judgement.POSITIVE)
+    store.update(canonical_id)
+    caplog.set_level(logging.INFO)
+    updated = Index(view, tmp_path)
+    updated.prepare()
+    assert "(5 changed)" in caplog.text
+    assert isinstance(updated.fields["name"], MappedField)
+    assert "new" in updated.entities
+    assert canonical_id.id in updated.entities
+    assert people[0] not in updated.entities
+    assert VERBAND_BADEN_ID not in updated.entities
+
+    built = Index(view, tmp_path / "built")
+    built.build()
+    assert set(updated.entities) == set(built.entities)
+    assert dict(updated.pairs()) == pytest.approx(dict(built.pairs()))
+    entity = view.get_entity("new")
+    assert dict(updated.match(entity)) == pytest.approx(dict(built.match(entity)))
+
+
+def test_index_match_many(dstore: SimpleMemoryStore, dindex: Index):
+    dx = Dataset.make({"name": "test", "title": "Test"})
+    entities = list(dstore.default_view().entities())[:30]
+    entities.append(CompositeEntity.from_data(dx, VERBAND_BADEN_DATA))
+    results = dindex.match_many(entities, limit=5)
+    assert len(results) == len(entities)
+    for entity, matches in zip(entities, results):
+        expected = dindex.match(entity)
+        assert [s for _, s in matches] == pytest.approx([s for _, s in expected[:5]])
+    results = dindex.match_many(entities)
+    for entity, matches in zip(entities, results):
+        assert dict(matches) == pytest.approx(dict(dindex.match(entity)))
+
+
+def test_index_bm25(dstore: SimpleMemoryStore, index_path: Path):
+    index = Index(dstore.default_view(), index_path, {"scoring": "bm25"})
+    index.build()
+    dx = Dataset.make({"name": "test", "title": "Test"})
+    entity = CompositeEntity.from_data(dx, VERBAND_BADEN_DATA)
+    matches = index.match(entity)
+    assert matches[0][0] == Identifier(VERBAND_BADEN_ID), matches
+    assert matches[1][0] == Identifier(VERBAND_ID), matches
+
+    # Common tokens weigh less than rare ones:
+    field = index.fields["namepart"]
+    entries = sorted(field.tokens.values(), key=lambda e: len(e.entities))
+    rare = max(w for _, w in index.weights(entries[0], field))
+    common = max(w for _, w in index.weights(entries[-1], field))
+    assert common < rare
+
+    pairs = index.pairs()
+    assert len(pairs) > 0
+    assert [s for _, s in pairs] == sorted([s for _, s in pairs], reverse=True)
+
+
+def test_index_bm25_weights(dstore: SimpleMemoryStore, tmp_path: Path):
+    view = dstore.default_view()
+    index = Index(view, tmp_path, {"scoring": "bm25"})
+    index.prepare()
+    field = index.fields["name"]
+    assert all(e.weights is not None for e in field.tokens.values())
+
+    # The weights are stored in the index file and read from it:
+    loaded = Index(view, tmp_path, {"scoring": "bm25"})
+    loaded.prepare()
+    mapped = loaded.fields["name"]
+    assert isinstance(mapped, MappedField)
+    for token, entry in field.tokens.items():
+        stored = mapped.tokens[token]
+        assert stored.stored is not None
+        assert dict(stored.bm25(mapped)) == pytest.approx(dict(entry.bm25(field)))
+    assert dict(loaded.pairs()) == pytest.approx(dict(index.pairs()))
+
+    # Only the weights of the changed tokens are computed again on commit:
+    entity = view.get_entity(VERBAND_BADEN_ID)
+    tokens = set(t for f, t in index.tokenizer.entity(entity) if f == "name")
+    loaded.update(entity)
+    loaded.commit()
+    for token in mapped.mapped.overlay:
+        assert token in tokens
+        assert mapped.tokens[token].weights is not None
+    matches = loaded.match(entity)
+    assert matches[0][0] == Identifier(VERBAND_BADEN_ID)
+    assert dict(matches) == pytest.approx(dict(index.match(entity)))
+
+    # A file with other scoring is not used:
+    other = Index(view, tmp_path)
+    other.prepare()
+    assert not isinstance(other.fields["name"], MappedField)
+
+
+def test_index_pairs_schemata(dstore: SimpleMemoryStore, dindex: Index, tmp_path: Path):
+    view = dstore.default_view()
+    pairs = dindex.pairs(max_pairs=100_000)
+    assert len(pairs) > 0
+    for (left, right), _ in pairs:
+        left_schema = view.get_entity(left.id).schema
+        right_schema = view.get_entity(right.id).schema
+        assert left_schema.can_match(right_schema), (left_schema, right_schema)
+
+    person = model.get("Person")
+    ranged = dindex.pairs(max_pairs=100_000, range=person)
+    assert 0 < len(ranged) < len(pairs)
+    for (left, right), _ in ranged:
+        schemata = (view.get_entity(left.id).schema, view.get_entity(right.id).schema)
+        assert any(s.is_a(person) for s in schemata), schemata
+    expected = dict(ranged)
+
+    for options in ({"engine": "sparse"}, {"workers": 2}):
+        index = Index(view, tmp_path, options)
+        index.build()
+        other = index.pairs(max_pairs=100_000, range=person)
+        assert dict(other) == pytest.approx(expected), options
+
+    # The schemata are kept in the mapped file:
+    path = tmp_path / "index.bin"
+    dindex.save(path, fingerprint=view.fingerprint())
+    loaded = Index.load(view, path, tmp_path)
+    assert dict(loaded.schemata) == dict(dindex.schemata)
+    assert dict(loaded.pairs(max_pairs=100_000, range=person)) == pytest.approx(
+        expected
+    )
+
+
+def test_index_iter_pairs(
+    dstore: SimpleMemoryStore, dindex: Index, tmp_path: Path, monkeypatch
+):
+    pairs = dindex.pairs(max_pairs=500)
+    streamed = list(dindex.iter_pairs(max_pairs=500))
+    assert dict(streamed) == pytest.approx(dict(pairs))
+    scores = [s for _, s in streamed]
+    assert scores == sorted(scores, reverse=True)
+    first = next(dindex.iter_pairs(max_pairs=500))
+    assert first[1] == pytest.approx(pairs[0][1])
+
+    # With smaller batches, the pairs come in several ranked batches:
+    monkeypatch.setattr(Index, "PAIR_BATCH", 50)
+    top = dindex.pairs(max_pairs=20)
+    streamed = list(dindex.iter_pairs(max_pairs=20))
+    assert len(streamed) > len(top)
+    assert_streamed(streamed, top)
+    scores = [s for _, s in streamed]
+    assert scores != sorted(scores, reverse=True)
+
+    sharded = Index(dstore.default_view(), tmp_path, {"workers": 2})
+    sharded.build()
+    assert_streamed(list(sharded.iter_pairs(max_pairs=20)), top)
+
+    index = Index(dstore.default_view(), tmp_path, {"engine": "sparse"})
+    index.build()
+    assert dict(index.iter_pairs(max_pairs=500)) == pytest.approx(dict(pairs))
@@ -0,0 +1,86 @@
+import logging
+from pathlib import Path
+
+import pytest
+
+from followthemoney import model
+from nomenklatura.dataset import Dataset
+from nomenklatura.entity import CompositeEntity
+from nomenklatura.index import LSHIndex, get_index
+from nomenklatura.resolver.identifier import Identifier
+from nomenklatura.store import SimpleMemoryStore
+
+VERBAND_ID = "62ad0fe6f56dbbf6fee57ce3da76e88c437024d5"
+VERBAND_BADEN_ID = "69401823a9f0a97cfdc37afa7c3158374e007669"
+VERBAND_BADEN_DATA = {
+    "id": "bla",
+    "schema": "Company",
+    "properties": {
+        "name": ["VERBAND DER METALL UND ELEKTROINDUSTRIE BADEN WURTTEMBERG"]
+    },
+}
+
+
+def test_lsh_index_build(dstore: SimpleMemoryStore, index_path: Path):
+    index = LSHIndex(dstore.default_view(), index_path)
+    assert len(index) == 0
+    index.build()
+    assert 0 < len(index) <= 184, len(index)
+    assert index.signatures.shape == (len(index), LSHIndex.NUM_PERM)
+
+    with pytest.raises(ValueError):
+        LSHIndex(dstore.default_view(), index_path, {"num_perm": 100, "bands": 32})
+
+
+def test_lsh_index_pairs(dstore: SimpleMemoryStore, index_path: Path):
+    view = dstore.default_view()
+    index = LSHIndex(view, index_path)
+    index.build()
+    pairs = index.pairs()
+    assert len(pairs) > 0
+    scores = [s for _, s in pairs]
+    assert scores == sorted(scores, reverse=True)
+    assert 0.0 < scores[-1] <= scores[0] <= 1.0
+    for (left, right), _ in pairs:
+        left_schema = view.get_entity(left.id).schema
+        right_schema = view.get_entity(right.id).schema
+        assert left_schema.can_match(right_schema), (left_schema, right_schema)
+
+    person = model.get("Person")
+    ranged = index.pairs(range=person)
+    assert len(ranged) < len(pairs)
+    assert set(ranged).issubset(set(pairs))
+
+    # Fewer rows per band find more candidates:
+    loose = LSHIndex(view, index_path, {"bands": 64})
+    loose.build()
+    assert len(loose.pairs(max_pairs=100_000)) > len(pairs)
+
+
+def test_lsh_index_match(dstore: SimpleMemoryStore, index_path: Path):
+    index = LSHIndex(dstore.default_view(), index_path)
+    index.build()
+    dx = Dataset.make({"name": "test", "title": "Test"})
+    entity = CompositeEntity.from_data(dx, VERBAND_BADEN_DATA)
+    matches = index.match(entity)
+    assert matches[0][0] == Identifier(VERBAND_BADEN_ID), matches
+    assert Identifier(VERBAND_ID) in dict(matches)
+    assert matches[0][1] == 1.0
+
+
+def test_lsh_index_prepare(dstore: SimpleMemoryStore, index_path: Path, caplog):
+    view = dstore.default_view()
+    index = get_index(view, index_path, LSHIndex.name)
+    assert isinstance(index, LSHIndex)
+    assert (index_path / LSHIndex.FILE_NAME).exists()
+
+    caplog.set_level(logging.INFO)
+    reused = LSHIndex(view, index_path)
+    reused.prepare()
+    assert "Using existing index" in caplog.text
+    assert reused.ids == index.ids
+    assert reused.pairs() == index.pairs()
+
+    # Different hashing parameters require a re-build:
+    other = LSHIndex(view, index_path, {"seed": 7})
+    assert not other.open(index_path / LSHIndex.FILE_NAME)
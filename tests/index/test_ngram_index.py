@@ -0,0 +1,116 @@
+import logging
+from pathlib import Path
+
+import pytest
+
+from followthemoney import model
+from nomenklatura.dataset import Dataset
+from nomenklatura.entity import CompositeEntity
+from nomenklatura.index import NGramIndex, get_index
+from nomenklatura.resolver.identifier import Identifier
+from nomenklatura.store import SimpleMemoryStore
+
+VERBAND_BADEN_ID = "69401823a9f0a97cfdc37afa7c3158374e007669"
+VERBAND_BADEN_DATA = {
+    "id": "bla",
+    "schema": "Company",
+    "properties": {"name": ["Verbnd der Metal und Elektroindustri Baden-Wurtemberg"]},
+}
+
+
+def test_ngram_index_build(dstore: SimpleMemoryStore, index_path: Path):
+    index = NGramIndex(dstore.default_view(), index_path)
+    assert len(index) == 0
+    index.build()
+    assert 0 < len(index) <= 184, len(index)
+    assert index.matrix.shape == (len(index), len(index.vocabulary))
+    norms = index.matrix.multiply(index.matrix).sum(axis=1)
+    assert norms.min() == pytest.approx(1.0)
+
+
+def test_ngram_index_match(dstore: SimpleMemoryStore, index_path: Path):
+    index = NGramIndex(dstore.default_view(), index_path)
+    index.build()
+    dx = Dataset.make({"name": "test", "title": "Test"})
+    entity = CompositeEntity.from_data(dx, VERBAND_BADEN_DATA)
+    matches = index.match(entity)
+    assert matches[0][0] == Identifier(VERBAND_BADEN_ID), matches
+    assert 0.5 < matches[0][1] < 1.0
+
+    store = SimpleMemoryStore(dstore.dataset, dstore.linker)
+    with store.writer() as writer:
+        for idx, name in enumerate(["Mohammed Ali", "Vladimir Putin"]):
+            data = {"id": f"p{idx}", "schema": "Person", "properties": {"name": [name]}}
+            writer.add_entity(CompositeEntity.from_data(dstore.dataset, data))
+    index = NGramIndex(store.default_view(), index_path)
+    index.build()
+    data = {"id": "q", "schema": "Person", "properties": {"name": ["Muhamad Ali"]}}
+    matches = index.match(CompositeEntity.from_data(dx, data))
+    assert [i.id for i, _ in matches] == ["p0"], matches
+
+
+def test_ngram_index_pairs(dstore: SimpleMemoryStore, index_path: Path):
+    view = dstore.default_view()
+    index = NGramIndex(view, index_path)
+    index.build()
+    pairs = index.pairs()
+    assert len(pairs) > 0
+    scores = [s for _, s in pairs]
+    assert scores == sorted(scores, reverse=True)
+    assert scores[-1] >= index.min_similarity
+    for (left, right), score in pairs:
+        left_schema = view.get_entity(left.id).schema
+        right_schema = view.get_entity(right.id).schema
+        assert left_schema.can_match(right_schema), (left_schema, right_schema)
+
+    ranged = index.pairs(range=model.get("Person"))
+    assert len(ranged) < len(pairs)
+    assert set(ranged).issubset(set(pairs))
+
+    strict = NGramIndex(view, index_path, {"top_k": 1, "min_similarity": 0.8})
+    strict.build()
+    assert 0 < len(strict.pairs()) < len(pairs)
+
+
+def test_ngram_index_prepare(dstore: SimpleMemoryStore, index_path: Path, caplog):
+    view = dstore.default_view()
+    index = get_index(view, index_path, NGramIndex.name)
+    assert isinstance(index, NGramIndex)
+    assert (index_path / NGramIndex.FILE_NAME).exists()
+
+    caplog.set_level(logging.INFO)
+    reused = NGramIndex(view, index_path)
+    reused.prepare()
+    assert "Using existing index" in caplog.text
+    assert reused.ids == index.ids
+    assert dict(reused.pairs()) == pytest.approx(dict(index.pairs()))
+
+    other = NGramIndex(view, index_path, {"ngram_size": 4})
+    assert not other.open(index_path / NGramIndex.FILE_NAME)
+
+
+def test_ngram_index_common_ngrams(dstore: SimpleMemoryStore, index_path: Path):
+    words = ["Acme Trading", "Acme Tradng", "Zebra", "Volvo", "Quince", "Jupiter"]
+    words += ["Kiwi", "Mango", "Papaya", "Walnut", "Fjord", "Glacier", "Tundra"]
+    words += ["Oxbow", "Yucca", "Bismuth", "Cobalt", "Nickel", "Radium", "Xenon"]
+    words += ["Helium", "Argon", "Krypton", "Sulfur", "Iodine", "Lithium"]
+    store = SimpleMemoryStore(dstore.dataset, dstore.linker)
+    with store.writer() as writer:
+        for idx, word in enumerate(words):
+            name = f"{word} Holding International Limited"
+            data = {"id": f"c{idx}", "schema": "Company", "properties": {"name": [name]}}
+            writer.add_entity(CompositeEntity.from_data(dstore.dataset, data))
+    options = {"top_k": 5, "min_similarity": 0.05}
+    index = NGramIndex(store.default_view(), index_path, options)
+    index.build()
+    pairs = dict(index.pairs())
+    full = NGramIndex(store.default_view(), index_path, {**options, "max_df": 1.0})
+    full.build()
+    unfiltered = dict(full.pairs())
+    # Pairs which only share the common n-grams are not compared:
+    assert set(pairs).issubset(set(unfiltered))
+    assert ("c0", "c1") in [tuple(sorted(i.id for i in p)) for p in pairs]
+    assert len(pairs) < len(unfiltered)
+    # ...but the candidates are scored with all of their n-grams:
+    for pair, score in pairs.items():
+        assert score == pytest.approx(unfiltered[pair])
@@ -0,0 +1,83 @@
+from pathlib import Path
+
+from followthemoney import model
+from nomenklatura.dataset import Dataset
+from nomenklatura.entity import CompositeEntity
+from nomenklatura.index import SortedIndex, get_index
+from nomenklatura.resolver.identifier import Identifier
+from nomenklatura.store import SimpleMemoryStore
+
+VERBAND_BADEN_ID = "69401823a9f0a97cfdc37afa7c3158374e007669"
+VERBAND_BADEN_DATA = {
+    "id": "bla",
+    "schema": "Company",
+    "properties": {
+        "name": ["VERBAND DER METALL UND ELEKTROINDUSTRIE BADEN WURTTEMBERG"],
+        "registrationNumber": ["HRB 123456"],
+    },
+}
+
+
+def test_sorted_index_keys(test_dataset: Dataset):
+    entity = CompositeEntity.from_data(test_dataset, VERBAND_BADEN_DATA)
+    keys = dict(SortedIndex.entity_keys(entity))
+    assert keys["name"].startswith("baden der elektroindustrie"), keys
+    assert keys["phonetic"].split(" ")[0] == "B350", keys
+    assert keys["identifier"] == "HRB123456", keys
+    assert SortedIndex.similarity("abc", "abc") == 1.0
+    assert SortedIndex.similarity("abcd", "abxy") == 0.5
+    assert SortedIndex.similarity("abc", "xyz") == 0.0
+
+
+def test_sorted_index_pairs(dstore: SimpleMemoryStore, index_path: Path):
+    view = dstore.default_view()
+    index = get_index(view, index_path, SortedIndex.name)
+    assert isinstance(index, SortedIndex)
+    assert 0 < len(index) < 184
+    pairs = index.pairs()
+    assert len(pairs) > 0
+    (left, right), score = pairs[0]
+    assert view.get_entity(left.id).caption.endswith("Johanna Quandt")
+    assert view.get_entity(right.id).caption.endswith("Johanna Quandt")
+    assert score == 1.5
+    for (left, right), _ in pairs:
+        assert left > right
+        left_schema = view.get_entity(left.id).schema
+        right_schema = view.get_entity(right.id).schema
+        assert left_schema.can_match(right_schema), (left_schema, right_schema)
+
+    ranged = index.pairs(max_pairs=100_000, range=model.get("Person"))
+    assert 0 < len(ranged) < len(pairs)
+
+    # A wider window produces more candidates:
+    wide = SortedIndex(view, index_path, {"window": 30})
+    wide.build()
+    assert len(wide.pairs(max_pairs=100_000)) > len(index.pairs(max_pairs=100_000))
+
+
+def test_sorted_index_top_pairs(dstore: SimpleMemoryStore, index_path: Path):
+    index = get_index(dstore.default_view(), index_path, SortedIndex.name)
+    full = index.pairs(max_pairs=100_000)
+    assert len(full) > 100
+    for max_pairs in (5, 20, 100):
+        pairs = index.pairs(max_pairs=max_pairs)
+        assert [s for _, s in pairs] == [s for _, s in full[:max_pairs]]
+        cutoff = full[max_pairs - 1][1]
+        top = set(p for p, s in full[:max_pairs] if s > cutoff)
+        assert top.issubset(set(p for p, _ in pairs))
+
+    index.PAIR_BATCH = 50
+    pairs = index.pairs(max_pairs=20)
+    streamed = dict(index.iter_pairs(max_pairs=20))
+    assert len(streamed) > len(pairs)
+    for pair, score in pairs:
+        assert streamed[pair] == score
+
+
+def test_sorted_index_match(dstore: SimpleMemoryStore, index_path: Path):
+    index = SortedIndex(dstore.default_view(), index_path)
+    index.build()
+    dx = Dataset.make({"name": "test", "title": "Test"})
+    entity = CompositeEntity.from_data(dx, VERBAND_BADEN_DATA)
+    matches = index.match(entity)
+    assert matches[0][0] == Identifier(VERBAND_BADEN_ID), matches
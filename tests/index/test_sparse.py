@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from nomenklatura.index import CSRIndex, Index
+from nomenklatura.index.sparse import ENGINE_SPARSE, make_matrix, sparse_pairs
+from nomenklatura.store import SimpleMemoryStore
+
+
+def test_sparse_pairs_matrix():
+    # Three entities, two tokens: a and b share token 0, all share token 1.
+    matrix = make_matrix(
+        np.array([0, 1, 0, 1, 2], dtype=np.int64),
+        np.array([0, 0, 1, 1, 1], dtype=np.int64),
+        np.array([1.0, 2.0, 0.5, 0.5, 0.5]),
+        (3, 2),
+    )
+    pairs = dict(sparse_pairs(matrix, ["a", "b", "c"], 10, chunk_size=1))
+    assert len(pairs) == 3, pairs
+    assert pairs[("b", "a")] == pytest.approx(4.0)
+    assert pairs[("c", "a")] == pytest.approx(1.0)
+    assert pairs[("c", "b")] == pytest.approx(1.0)
+
+    top = sparse_pairs(matrix, ["a", "b", "c"], 1)
+    assert len(top) == 1
+    assert top[0][0] == ("b", "a")
+
+
+def test_sparse_engine_same_as_python(
+    dstore: SimpleMemoryStore, dindex: Index, index_path: Path
+):
+    expected = dict(dindex.pairs(max_pairs=100_000))
+    sparse = Index(dstore.default_view(), index_path, {"engine": ENGINE_SPARSE})
+    sparse.build()
+    pairs = dict(sparse.pairs(max_pairs=100_000))
+    assert expected.keys() == pairs.keys()
+    for pair, score in expected.items():
+        assert pairs[pair] == pytest.approx(score), pair
+
+    csr = CSRIndex(dstore.default_view(), index_path, {"engine": ENGINE_SPARSE})
+    csr.build()
+    csr_pairs = dict(csr.pairs(max_pairs=100_000))
+    assert expected.keys() == csr_pairs.keys()
+    for pair, score in expected.items():
+        assert csr_pairs[pair] == pytest.approx(score), pair
+
+
+def test_sparse_engine_top_pairs(dstore: SimpleMemoryStore, dindex: Index):
+    expected = dindex.pairs(max_pairs=100_000)[:20]
+    pairs = dindex.sparse_pairs(max_pairs=20)
+    assert len(pairs) == 20
+    for (_, score), (_, expected_score) in zip(pairs, expected):
+        assert score == pytest.approx(expected_score)
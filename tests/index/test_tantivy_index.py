@@ -1,3 +1,8 @@
+import logging
+from pathlib import Path
+import pytest
+
+from followthemoney import model
 from nomenklatura.dataset import Dataset
 from nomenklatura.entity import CompositeEntity
 from nomenklatura.index.tantivy_index import TantivyIndex
@@ -144,3 +149,160 @@ def test_name_variations(dstore: SimpleMemoryStore, tantivy_index: TantivyIndex)
 
     assert len(matches) > 1, matches
     assert matches == matches_more, (matches, matches_more)
+
+
+def test_tantivy_prepare(dstore: SimpleMemoryStore, index_path: Path, caplog):
+    view = dstore.default_view()
+    index = TantivyIndex(view, index_path)
+    index.prepare()
+    assert index.fingerprint_path.exists()
+    matches = index.match(view.get_entity(VERBAND_BADEN_ID))
+
+    caplog.set_level(logging.INFO)
+    reused = TantivyIndex(view, index_path)
+    reused.prepare()
+    assert "Using existing index" in caplog.text
+    assert reused.ids == index.ids
+    assert reused.match(view.get_entity(VERBAND_BADEN_ID)) == matches
+
+    caplog.clear()
+    store = SimpleMemoryStore(dstore.dataset, dstore.linker)
+    with store.writer() as writer:
+        for entity in view.entities():
+            if entity.id != VERBAND_ID:
+                writer.add_entity(entity)
+    changed = TantivyIndex(store.default_view(), index_path)
+    changed.prepare()
+    assert "Using existing index" not in caplog.text
+    ids = [i.id for i, _ in changed.match(view.get_entity(VERBAND_BADEN_ID))]
+    assert VERBAND_ID not in ids
+
+
+def test_tantivy_match_many(dstore: SimpleMemoryStore, tantivy_index: TantivyIndex):
+    entities = list(dstore.default_view().entities())[:30]
+    results = tantivy_index.match_many(entities, limit=3)
+    for entity, matches in zip(entities, results):
+        expected = tantivy_index.match(entity)[:3]
+        assert [i for i, _ in matches] == [i for i, _ in expected]
+        assert [s for _, s in matches] == pytest.approx([s for _, s in expected])
+    # Repeated entities share a query, but never match themselves:
+    repeated = tantivy_index.match_many([entities[0], entities[0], entities[1]])
+    assert repeated[0] == repeated[1]
+    assert entities[0].id not in [i.id for i, _ in repeated[0]]
+    assert entities[1].id not in [i.id for i, _ in repeated[2]]
+
+
+def test_tantivy_pairs_range(dstore: SimpleMemoryStore, tantivy_index: TantivyIndex):
+    view = dstore.default_view()
+    person = model.get("Person")
+    pairs = tantivy_index.pairs(range=person)
+    assert len(pairs) > 0
+    for (left, right), _ in pairs:
+        left_schema = view.get_entity(left.id).schema
+        right_schema = view.get_entity(right.id).schema
+        assert left_schema.can_match(right_schema), (left_schema, right_schema)
+        assert left_schema.is_a(person) or right_schema.is_a(person)
+
+
+def test_tantivy_iter_pairs(tantivy_index: TantivyIndex, caplog):
+    caplog.set_level(logging.INFO)
+    tantivy_index.LOG_BATCH = 50
+    assert len(list(tantivy_index.view.entities())) > tantivy_index.LOG_BATCH
+    tantivy_index.QUERY_BATCH = 20
+    for max_pairs in (10, 50, 100_000):
+        pairs = tantivy_index.pairs(max_pairs=max_pairs)
+        streamed = list(tantivy_index.iter_pairs(max_pairs=max_pairs))
+        assert len(streamed) == len(set(p for p, _ in streamed))
+        assert set(p for p, _ in pairs).issubset(p for p, _ in streamed)
+    assert "Blocking pairs: 50" in caplog.text
+
+
+def test_tantivy_hit_ids(dstore: SimpleMemoryStore, tantivy_index: TantivyIndex):
+    view = dstore.default_view()
+    assert len(tantivy_index.ids) == len(set(tantivy_index.ids)) > 0
+    assert tantivy_index.ids_path.exists()
+    searcher = tantivy_index.index.searcher()
+    query = tantivy_index.entity_query(view.get_entity(VERBAND_BADEN_ID))
+    hits = tantivy_index._hits(searcher, query, 20, 0.0)
+    assert len(hits) > 0
+    # The fast field resolves the same IDs as the stored documents:
+    for (entity_id, score), (other, address) in zip(
+        hits, searcher.search(query, 20).hits
+    ):
+        assert entity_id == searcher.doc(address)["entity_id"][0]
+        assert score == other
+
+    # Without the list of IDs, the stored documents are read instead:
+    tantivy_index.ids = []
+    assert tantivy_index._hits(searcher, query, 20, 0.0) == hits
+
+
+def test_tantivy_parallel_pairs(dstore: SimpleMemoryStore, index_path: Path):
+    view = dstore.default_view()
+    index = TantivyIndex(view, index_path)
+    index.build()
+    pairs = index.pairs()
+
+    parallel = TantivyIndex(view, index_path, {"workers": 3})
+    parallel.QUERY_BATCH = 20
+    assert parallel.pairs() == pairs
+    assert dict(parallel.iter_pairs()).keys() == dict(pairs).keys()
+    streamed = dict(parallel.iter_pairs(max_pairs=10))
+    assert streamed.keys() >= dict(parallel.pairs(max_pairs=10)).keys()
+
+
+def test_tantivy_parallel_build(dstore: SimpleMemoryStore, tmp_path: Path, caplog):
+    view = dstore.default_view()
+    index = TantivyIndex(view, tmp_path / "serial")
+    index.build()
+
+    caplog.set_level(logging.INFO)
+    options = {"workers": 2, "writer_threads": 1}
+    parallel = TantivyIndex(view, tmp_path / "parallel", options)
+    parallel.BUILD_BATCH = 40
+    parallel.build()
+    assert "Preparing documents (2 workers)" in caplog.text
+    assert "/s)" in caplog.text
+    assert parallel.ids == index.ids
+    entity = view.get_entity(VERBAND_BADEN_ID)
+    assert parallel.match(entity) == index.match(entity)
+
+
+def test_tantivy_incremental(dstore: SimpleMemoryStore, index_path: Path, caplog):
+    view = dstore.default_view()
+    index = TantivyIndex(view, index_path)
+    index.prepare()
+    assert len(index.checksums) == len(index.ids)
+    verband_baden = view.get_entity(VERBAND_BADEN_ID)
+
+    store = SimpleMemoryStore(dstore.dataset, dstore.linker)
+    with store.writer() as writer:
+        for entity in view.entities():
+            if entity.id == VERBAND_ID:
+                continue
+            if entity.id == DAIMLER:
+                entity.add("name", "Mercedes-Benz Group")
+            writer.add_entity(entity)
+        data = dict(VERBAND_BADEN_DATA, id="new-verband")
+        writer.add_entity(CompositeEntity.from_data(dstore.dataset, data))
+
+    caplog.set_level(logging.INFO)
+    updated = TantivyIndex(store.default_view(), index_path)
+    assert updated.checksums == index.checksums
+    updated.prepare()
+    assert "Updated index: 1 added, 1 changed, 1 removed." in caplog.text
+    assert VERBAND_ID not in updated.checksums
+    assert len(updated.ids) == len(index.ids) + 2
+    ids = [i.id for i, _ in updated.match(verband_baden)]
+    assert "new-verband" in ids
+    assert VERBAND_ID not in ids
+    query = CompositeEntity.from_data(dstore.dataset, VERBAND_BADEN_DATA)
+    query.set("name", "Mercedes-Benz Group")
+    assert updated.match(query)[0][0].id == DAIMLER
+
+    # The same data, read from disk, is not changed again:
+    caplog.clear()
+    reused = TantivyIndex(store.default_view(), index_path)
+    assert reused.ids == updated.ids
+    reused.build()
+    assert "Updated index: 0 added, 0 changed, 0 removed." in caplog.text
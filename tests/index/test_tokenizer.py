@@ -0,0 +1,46 @@
+from nomenklatura.index.tokenizer import Tokenizer, TokenCache
+from nomenklatura.index.tantivy_index import TantivyIndex
+from nomenklatura.store import SimpleMemoryStore
+
+
+def test_token_cache():
+    cache = TokenCache(size=2)
+    assert cache.get(("name", "a")) is None
+    cache.put(("name", "a"), (("name", "a"),))
+    cache.put(("name", "b"), ())
+    assert cache.get(("name", "a")) == (("name", "a"),)
+    assert cache.get(("name", "b")) == ()
+    assert cache.get(("name", "a")) is not None
+    # The least recently used key is dropped:
+    cache.put(("name", "c"), ())
+    assert len(cache) == 2
+    assert cache.get(("name", "b")) is None
+    assert cache.hits == 3
+    assert cache.misses == 2
+    assert 0.5 < cache.hit_rate < 0.7
+    assert "hits: 3" in repr(cache)
+
+    disabled = TokenCache(size=0)
+    disabled.put(("name", "a"), ())
+    assert len(disabled) == 0
+
+
+def test_tokenizer_cache(dstore: SimpleMemoryStore):
+    entities = list(dstore.default_view().entities())
+    tokenizer = Tokenizer(TokenCache())
+    uncached = Tokenizer(TokenCache(size=0))
+    for entity in entities:
+        assert list(tokenizer.entity(entity)) == list(uncached.entity(entity))
+    assert tokenizer.cache.hits > 0
+    assert uncached.cache.hits == 0
+    hits, misses = tokenizer.cache.hits, tokenizer.cache.misses
+    for entity in entities:
+        list(tokenizer.entity(entity))
+    assert tokenizer.cache.misses == misses
+    assert tokenizer.cache.hits == hits + uncached.cache.misses
+
+    cache = TokenCache()
+    for entity in entities:
+        expected = dict(TantivyIndex.entity_fields(entity))
+        assert dict(TantivyIndex.entity_fields(entity, cache=cache)) == expected
+    assert cache.hits > 0
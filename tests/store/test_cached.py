@@ -0,0 +1,71 @@
+from nomenklatura.resolver import Resolver
+from nomenklatura.judgement import Judgement
+from nomenklatura.store import CachedView, MemoryStore, SimpleMemoryStore
+from nomenklatura.dataset import Dataset
+from nomenklatura.entity import CompositeEntity
+
+DAIMLER = "66ce9f62af8c7d329506da41cb7c36ba058b3d28"
+
+PERSON = {
+    "id": "john-doe",
+    "schema": "Person",
+    "properties": {"name": ["John Doe"], "birthDate": ["1976"]},
+}
+
+PERSON_EXT = {
+    "id": "john-doe-2",
+    "schema": "Person",
+    "properties": {"birthPlace": ["North Texas"]},
+}
+
+
+def test_cached_view(dstore: SimpleMemoryStore):
+    view = CachedView(dstore.default_view(), size=3)
+    entity = view.get_entity(DAIMLER)
+    assert entity is not None
+    assert view.get_entity(DAIMLER) is entity
+    assert view.hits == 1 and view.misses == 1
+    assert view.get_entity("banana") is None
+    assert view.fingerprint() == dstore.default_view().fingerprint()
+
+    ids = [e.id for e in dstore.default_view().entities() if e.id != DAIMLER][:3]
+    entities = view.get_entities(ids + [DAIMLER, "banana"])
+    assert len(entities) == 4
+    assert entities[DAIMLER] is entity
+    # The least recently used entity is dropped:
+    assert len(view.cache) == 3
+    assert DAIMLER not in view.cache
+    assert 0.0 < view.hit_rate < 1.0
+
+
+def test_cached_view_invalidate(test_dataset: Dataset):
+    resolver = Resolver[CompositeEntity]()
+    store = MemoryStore(test_dataset, resolver)
+    with store.writer() as writer:
+        writer.add_entity(CompositeEntity.from_data(test_dataset, PERSON))
+        writer.add_entity(CompositeEntity.from_data(test_dataset, PERSON_EXT))
+    view = CachedView(store.default_view())
+    entity = view.get_entity("john-doe")
+    assert entity is not None
+    assert entity.get("birthPlace") == []
+
+    with store.writer() as writer:
+        data = dict(PERSON, properties={"birthPlace": ["Dallas"]})
+        writer.add_entity(CompositeEntity.from_data(test_dataset, data))
+    entity = view.get_entity("john-doe")
+    assert entity is not None
+    assert entity.get("birthPlace") == ["Dallas"]
+
+    assert view.get_entity("john-doe-2") is not None
+    merged_id = resolver.decide(
+        "john-doe",
+        "john-doe-2",
+        judgement=Judgement.POSITIVE,
+        user="test",
+    )
+    store.update(merged_id)
+    assert len(view.cache) == 0
+    assert view.get_entity("john-doe") is None
+    merged = view.get_entity(merged_id.id)
+    assert merged is not None
+    assert set(merged.get("birthPlace")) == {"Dallas", "North Texas"}
@@ -1,3 +1,4 @@
+from typing import Set
 import orjson
 import fakeredis
 from pathlib import Path
@@ -7,6 +8,8 @@ from nomenklatura.resolver import Resolver
 from nomenklatura.judgement import Judgement
 from nomenklatura.store.redis_ import RedisStore
 from nomenklatura.dataset import Dataset
+from nomenklatura.store import View
+from nomenklatura.statement import Statement
 from nomenklatura.entity import CompositeEntity
 
 DAIMLER = "66ce9f62af8c7d329506da41cb7c36ba058b3d28"
@@ -23,6 +26,15 @@ PERSON_EXT = {
 }
 
 
+def _entity_keys(view: View[Dataset, CompositeEntity]) -> Set[str]:
+    keys: Set[str] = set()
+    for entity in view.entities():
+        for stmt in entity.statements:
+            if stmt.prop != Statement.BASE:
+                keys.add(f"{entity.id}:{stmt.id}")
+    return keys
+
+
 def test_redis_store_basics(test_dataset: Dataset):
     redis = fakeredis.FakeStrictRedis(version=6, decode_responses=False)
     resolver = Resolver[CompositeEntity]()
@@ -46,6 +58,9 @@ def test_redis_store_basics(test_dataset: Dataset):
     )
     store.update(merged_id)
     assert len(list(store.view(test_dataset).entities())) == 1
+    entities = store.view(test_dataset).get_entities([merged_id.id, "banana"])
+    assert list(entities.keys()) == [merged_id.id]
+    assert entities[merged_id.id].get("birthPlace") == ["North Texas"]
 
 
 def test_leveldb_graph_query(donations_path: Path, test_dataset: Dataset):
@@ -96,3 +111,39 @@ def test_leveldb_graph_query(donations_path: Path, test_dataset: Dataset):
     assert entity is not None, entity
     assert ext_view.has_entity("john-doe")
     assert len(list(entity.statements)) == len(list(ext_entity.statements))
+
+
+def test_redis_fingerprint(donations_path: Path, test_dataset: Dataset):
+    redis = fakeredis.FakeStrictRedis(version=6, decode_responses=False)
+    resolver = Resolver[CompositeEntity]()
+    store = RedisStore(test_dataset, resolver, db=redis)
+    with store.writer() as writer:
+        with open(donations_path, "rb") as fh:
+            while line := fh.readline():
+                proxy = CompositeEntity.from_data(test_dataset, orjson.loads(line))
+                writer.add_entity(proxy)
+    ext_entity = CompositeEntity.from_data(test_dataset, PERSON)
+    with store.writer() as writer:
+        for stmt in ext_entity.statements:
+            stmt.external = True
+            writer.add_statement(stmt)
+        writer.add_entity(CompositeEntity.from_data(test_dataset, PERSON_EXT))
+
+    # The statement keys are read without assembling the entities, and cover
+    # the statements of the entities (other than their generated checksums):
+    for external in (False, True):
+        view = store.view(test_dataset, external=external)
+        assert _entity_keys(view) <= set(view._statement_keys())
+
+    view = store.view(test_dataset, external=True)
+    fingerprint = view.fingerprint()
+    statements = view.fingerprint(canonical=False)
+    assert fingerprint != store.view(test_dataset, external=False).fingerprint()
+    merged_id = resolver.decide(
+        "john-doe", "john-doe-2", judgement=Judgement.POSITIVE, user="test"
+    )
+    store.update(merged_id)
+    view = store.view(test_dataset, external=True)
+    assert _entity_keys(view) <= set(view._statement_keys())
+    assert view.fingerprint() != fingerprint
+    assert view.fingerprint(canonical=False) == statements
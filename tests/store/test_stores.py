@@ -7,6 +7,7 @@ from typing import Any, Dict, List
 
 from nomenklatura.dataset import Dataset
 from nomenklatura.entity import CompositeEntity
+from nomenklatura.judgement import Judgement
 from nomenklatura.resolver import Resolver
 from nomenklatura.store import SimpleMemoryStore, SQLStore, Store
 from nomenklatura.store.level import LevelDBStore
@@ -29,6 +30,8 @@ def _run_store_test(
     view = store.default_view()
     proxies = [e for e in view.entities()]
     assert len(proxies) == len(donations_json)
+    fingerprint = view.fingerprint()
+    assert fingerprint == store.default_view().fingerprint()
 
     entity = view.get_entity(entity_id)
     assert entity is not None
@@ -48,11 +51,19 @@ def _run_store_test(
     adjacent = list(view.get_adjacent(entity))
     assert len(adjacent) == 2
 
+    ids = [p.id for p in proxies[:50]] + ["banana"]
+    entities = view.get_entities(ids)
+    assert len(entities) == 50
+    assert "banana" not in entities
+    for id in ids[:50]:
+        assert entities[id] == view.get_entity(id)
+
     writer = store.writer()
     stmts = writer.pop(entity.id)
     writer.flush()
     assert len(stmts) == len(list(entity.statements))
     assert view.get_entity(entity.id) is None
+    assert view.fingerprint() != fingerprint
 
     # upsert
     with store.writer() as bulk:
@@ -65,6 +76,33 @@ def _run_store_test(
     entity = view.get_entity(entity.id)
     assert entity is not None
     assert entity.caption == "Tchibo Holding AG"
+    assert view.fingerprint() == fingerprint
+
+    # Entities without a recorded change are always listed as changed:
+    entity_ids = set(e.id for e in view.entities())
+    assert set(e for e, _ in view.changes()) == entity_ids
+    digests = view.entity_digests()
+    assert set(digests.keys()) == entity_ids
+    data = {"id": "later", "schema": "Person", "properties": {"name": ["Later"]}}
+    with store.writer() as bulk:
+        for stmt in CompositeEntity.from_data(dataset, data).statements:
+            stmt.first_seen = "2024-06-01T00:00:00"
+            bulk.add_statement(stmt)
+    changes = dict(view.changes(since="2024-03-01T00:00:00"))
+    assert changes["later"] == "2024-06-01T00:00:00"
+    assert set(changes.keys()) == entity_ids | {"later"}
+    assert "later" not in dict(view.changes(since="2024-06-01T00:00:00"))
+    updated = view.entity_digests()
+    assert [e for e, d in updated.items() if digests.get(e) != d] == ["later"]
+
+    # Merging entities changes their canonical IDs, but not their statements:
+    statements = view.fingerprint(canonical=False)
+    other_id = next(p.id for p in proxies if p.id != entity.id)
+    assert isinstance(store.linker, Resolver)
+    canonical_id = store.linker.decide(entity.id, other_id, Judgement.POSITIVE)
+    store.update(canonical_id)
+    assert view.fingerprint() != fingerprint
+    assert view.fingerprint(canonical=False) == statements
     return True
 
 
@@ -1,3 +1,4 @@
+from typing import Set
 import orjson
 import fakeredis
 from pathlib import Path
@@ -9,6 +10,8 @@ from nomenklatura.resolver import Resolver
 from nomenklatura.judgement import Judgement
 from nomenklatura.store.versioned import VersionedRedisStore
 from nomenklatura.dataset import Dataset
+from nomenklatura.store import View
+from nomenklatura.statement import Statement
 from nomenklatura.entity import CompositeEntity
 from nomenklatura.util import datetime_iso
 
@@ -26,6 +29,15 @@ PERSON_EXT = {
 }
 
 
+def _entity_keys(view: View[Dataset, CompositeEntity]) -> Set[str]:
+    keys: Set[str] = set()
+    for entity in view.entities():
+        for stmt in entity.statements:
+            if stmt.prop != Statement.BASE:
+                keys.add(f"{entity.id}:{stmt.id}")
+    return keys
+
+
 def test_store_basics(test_dataset: Dataset):
     redis = fakeredis.FakeStrictRedis(version=6, decode_responses=False)
     resolver = Resolver[CompositeEntity]()
@@ -60,6 +72,11 @@ def test_store_basics(test_dataset: Dataset):
     store.update(merged_id)
     assert len(list(store.view(test_dataset).entities())) == 1
     assert len(list(store.view(test_dataset).statements())) == 5
+    view = store.view(test_dataset)
+    entities = view.get_entities(["john-doe", merged_id.id, "banana"])
+    assert set(entities.keys()) == {"john-doe", merged_id.id}
+    assert entities[merged_id.id] == view.get_entity(merged_id.id)
+    assert entities["john-doe"].id == merged_id.id
 
 
 def test_graph_query(donations_path: Path, test_dataset: Dataset):
@@ -145,3 +162,41 @@ def test_versioning(test_dataset: Dataset):
     store.drop_version(test_dataset.name, version_b)
     assert store.get_latest(test_dataset.name) == version_a
     assert len(store.get_history(test_dataset.name)) == 1
+
+
+def test_versioned_fingerprint(donations_path: Path, test_dataset: Dataset):
+    redis = fakeredis.FakeStrictRedis(version=6, decode_responses=False)
+    resolver = Resolver[CompositeEntity]()
+    store = VersionedRedisStore(test_dataset, resolver, db=redis)
+    with store.writer() as writer:
+        with open(donations_path, "rb") as fh:
+            while line := fh.readline():
+                proxy = CompositeEntity.from_data(test_dataset, orjson.loads(line))
+                writer.add_entity(proxy)
+        writer.release()
+    ext_entity = CompositeEntity.from_data(test_dataset, PERSON)
+    with store.writer() as writer:
+        for stmt in ext_entity.statements:
+            stmt.external = True
+            writer.add_statement(stmt)
+        writer.add_entity(CompositeEntity.from_data(test_dataset, PERSON_EXT))
+        writer.release()
+
+    # The statement keys are read without assembling the entities, and cover
+    # the statements of the entities (other than their generated checksums):
+    for external in (False, True):
+        view = store.view(test_dataset, external=external)
+        assert _entity_keys(view) <= set(view._statement_keys())
+
+    view = store.view(test_dataset, external=True)
+    fingerprint = view.fingerprint()
+    statements = view.fingerprint(canonical=False)
+    assert fingerprint != store.view(test_dataset, external=False).fingerprint()
+    merged_id = resolver.decide(
+        "john-doe", "john-doe-2", judgement=Judgement.POSITIVE, user="test"
+    )
+    store.update(merged_id)
+    view = store.view(test_dataset, external=True)
+    assert _entity_keys(view) <= set(view._statement_keys())
+    assert view.fingerprint() != fingerprint
+    assert view.fingerprint(canonical=False) == statements
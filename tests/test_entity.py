@@ -49,12 +49,14 @@ def test_example_entity():
     assert len(sp) == 3
     idstmt = list(sp.statements)[-1]
     assert idstmt.value == "836baf194d59a68c4092e208df30134800c732cc"
+    assert sp.checksum == idstmt.value
     assert sp.caption == "John Doe"
     assert "John Doe", sp.get_type_values(registry.name)
     sp.add("country", "us")
     assert len(sp) == 4
     idstmt = list(sp.statements)[-1]
     assert idstmt.value == "c3aec8e1fcd86bc55171917db7c993d6f3ad5fe0"
+    assert sp.checksum == idstmt.value
     sp.add("country", {"gb"})
     assert len(sp) == 5
     sp.add("country", ("gb", "us"))
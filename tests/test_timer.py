@@ -0,0 +1,46 @@
+import logging
+
+from nomenklatura.timer import Phase, Timer
+
+
+def test_phase_percentiles():
+    phase = Phase()
+    assert phase.percentile(50) == 0.0
+    for value in range(1, 101):
+        phase.add(float(value))
+    assert phase.count == 100
+    assert phase.total == 5050.0
+    assert phase.percentile(50) == 51.0
+    assert phase.percentile(99) == 100.0
+    data = phase.to_dict()
+    assert data["mean"] == 50.5
+    assert data["p90"] == 91.0
+
+
+def test_phase_sample_bound():
+    phase = Phase()
+    for value in range(Phase.SAMPLES * 2):
+        phase.add(float(value))
+    assert phase.count == Phase.SAMPLES * 2
+    assert len(phase.samples) == Phase.SAMPLES
+    assert phase.percentile(99) > Phase.SAMPLES
+
+
+def test_timer(caplog):
+    timer = Timer()
+    with timer.phase("outer"):
+        items = list(timer.iterate("produce", range(5)))
+    assert items == list(range(5))
+    assert timer.phases["outer"].count == 1
+    # The final call to the generator, which ends it, is also timed:
+    assert timer.phases["produce"].count == 6
+    timer.count("items", len(items))
+    timer.count("items")
+    data = timer.to_dict()
+    assert data["counters"]["items"] == 6
+    assert data["phases"]["outer"]["seconds"] >= data["phases"]["produce"]["seconds"]
+
+    with caplog.at_level(logging.INFO):
+        timer.log_summary(logging.getLogger("test"), "Test timings")
+    assert "Test timings" in caplog.text
+    assert "items: 6" in caplog.text
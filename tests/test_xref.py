@@ -1,10 +1,15 @@
+import json
+import logging
 import re
 from normality import collapse_spaces
 from pathlib import Path
+from typing import Optional, Set, Tuple
 
+from nomenklatura.checkpoint import XrefCheckpoint, XrefWatermark
 from nomenklatura.dataset.dataset import Dataset
 from nomenklatura.entity import CompositeEntity
 from nomenklatura.judgement import Judgement
+from nomenklatura.matching import DefaultAlgorithm
 from nomenklatura.matching.regression_v1.model import RegressionV1
 from nomenklatura.resolver import Resolver
 from nomenklatura.store import SimpleMemoryStore
@@ -94,3 +99,229 @@ def test_xref_potential_conflicts(
     assert a.get("name")[0] in flat, stdout
     assert b.get("name")[0] in flat, stdout
     assert c.get("name")[0] in flat, stdout
+
+
+def test_xref_workers(index_path: Path, dstore: SimpleMemoryStore):
+    resolver = Resolver[CompositeEntity]()
+    xref(resolver, dstore, index_path, workers=2)
+    candidates = list(resolver.get_candidates(limit=20))
+    assert len(candidates) == 20
+
+    # Scoring in worker processes suggests the same pairs with the same scores:
+    serial = Resolver[CompositeEntity]()
+    xref(serial, dstore, index_path)
+    assert sorted(serial.get_candidates()) == sorted(resolver.get_candidates())
+
+
+def test_xref_report(index_path: Path, dstore: SimpleMemoryStore, tmp_path: Path):
+    resolver = Resolver[CompositeEntity]()
+    report = tmp_path / "report.json"
+    xref(resolver, dstore, index_path, report=report)
+    with open(report, "r") as fh:
+        data = json.load(fh)
+    assert data["seconds"] > 0
+    for phase in ("index", "blocking", "fetch", "resolver", "score:regression-v2"):
+        assert data["phases"][phase]["count"] > 0, phase
+    assert data["counters"]["pairs"] >= data["counters"]["candidates"]
+    assert data["counters"]["scored"] == data["counters"]["candidates"]
+    assert data["rates"]["pairs"] > 0
+    assert 0.0 <= data["entity_cache"]["hit_rate"] <= 1.0
+
+
+class CountingAlgorithm(DefaultAlgorithm):
+    calls = 0
+    interrupt_after: Optional[int] = None
+
+    @classmethod
+    def compare(cls, query, result, override_weights=None):
+        if cls.interrupt_after is not None and cls.calls >= cls.interrupt_after:
+            raise KeyboardInterrupt()
+        cls.calls += 1
+        return super().compare(query, result, override_weights=override_weights)
+
+
+def test_xref_resume(index_path: Path, dstore: SimpleMemoryStore, tmp_path: Path):
+    checkpoint = tmp_path / "checkpoint"
+    resolver_path = tmp_path / "resolver.ijson"
+    resolver = Resolver[CompositeEntity].load(resolver_path)
+    CountingAlgorithm.interrupt_after = 30
+    xref(
+        resolver, dstore, index_path, algorithm=CountingAlgorithm, checkpoint=checkpoint
+    )
+    with open(checkpoint / XrefCheckpoint.STATE, "r") as fh:
+        state = json.load(fh)
+    assert state["blocked"] is True
+    assert 0 < state["cursor"] < state["pairs"]
+    view = dstore.default_view(external=True)
+    assert state["fingerprint"] == view.fingerprint(canonical=False)
+    assert resolver_path.exists()
+
+    CountingAlgorithm.calls = 0
+    CountingAlgorithm.interrupt_after = None
+    resumed = Resolver[CompositeEntity].load(resolver_path)
+    xref(
+        resumed,
+        dstore,
+        index_path,
+        algorithm=CountingAlgorithm,
+        checkpoint=checkpoint,
+        resume=True,
+    )
+    assert not checkpoint.exists()
+    resumed_calls = CountingAlgorithm.calls
+
+    CountingAlgorithm.calls = 0
+    serial = Resolver[CompositeEntity]()
+    xref(serial, dstore, index_path, algorithm=CountingAlgorithm)
+    assert resumed_calls < CountingAlgorithm.calls
+    assert sorted(serial.get_candidates()) == sorted(resumed.get_candidates())
+
+
+def test_xref_resume_changed(index_path: Path, donations_json, tmp_path: Path, caplog):
+    dataset = Dataset.make({"name": "donations", "title": "Donations"})
+    store = SimpleMemoryStore(dataset, Resolver[CompositeEntity]())
+    with store.writer() as writer:
+        for data in donations_json:
+            writer.add_entity(CompositeEntity.from_data(dataset, data))
+    checkpoint = tmp_path / "checkpoint"
+    resolver_path = tmp_path / "resolver.ijson"
+    resolver = Resolver[CompositeEntity].load(resolver_path)
+    CountingAlgorithm.calls = 0
+    CountingAlgorithm.interrupt_after = 30
+    xref(
+        resolver, store, index_path, algorithm=CountingAlgorithm, checkpoint=checkpoint
+    )
+    with open(checkpoint / XrefCheckpoint.STATE, "r") as fh:
+        params = json.load(fh)["params"]
+    view = store.default_view(external=True)
+    fingerprint = view.fingerprint(canonical=False)
+    assert XrefCheckpoint(checkpoint, params).load(fingerprint=fingerprint)
+
+    # The checkpoint does not apply to the data once it has changed:
+    data = {"id": "new", "schema": "Person", "properties": {"name": ["Quandt"]}}
+    with store.writer() as writer:
+        writer.add_entity(CompositeEntity.from_data(dataset, data))
+    ckpt = XrefCheckpoint(checkpoint, params)
+    assert not ckpt.load(fingerprint=view.fingerprint(canonical=False))
+
+    caplog.set_level(logging.WARNING)
+    CountingAlgorithm.calls = 0
+    CountingAlgorithm.interrupt_after = None
+    resumed = Resolver[CompositeEntity].load(resolver_path)
+    xref(
+        resumed,
+        store,
+        index_path,
+        algorithm=CountingAlgorithm,
+        checkpoint=checkpoint,
+        resume=True,
+    )
+    assert "Xref checkpoint is for different data" in caplog.text
+    assert not checkpoint.exists()
+
+
+def _changed_store(
+    donations_json, resolver: Resolver[CompositeEntity]
+) -> Tuple[SimpleMemoryStore, Set[str]]:
+    dataset = Dataset.make({"name": "donations", "title": "Donations"})
+    store = SimpleMemoryStore(dataset, resolver)
+    changed = set()
+    with store.writer() as writer:
+        for data in donations_json:
+            entity = CompositeEntity.from_data(dataset, data)
+            entity.last_change = "2024-01-01T00:00:00"
+            if "Quandt" in entity.caption:
+                entity.last_change = "2024-06-01T00:00:00"
+                changed.add(entity.id)
+            writer.add_entity(entity)
+    assert len(changed) > 1
+    return store, changed
+
+
+def test_xref_incremental(index_path: Path, donations_json, tmp_path: Path):
+    resolver = Resolver[CompositeEntity]()
+    store, changed = _changed_store(donations_json, resolver)
+
+    watermark = tmp_path / "watermark"
+    full = Resolver[CompositeEntity]()
+    xref(full, store, index_path, watermark=watermark)
+    assert watermark.read_text() == "2024-06-01T00:00:00"
+
+    watermark.write_text("2024-03-01T00:00:00")
+    xref(resolver, store, index_path, watermark=watermark)
+    assert watermark.read_text() == "2024-06-01T00:00:00"
+    candidates = list(resolver.get_candidates())
+    assert 0 < len(candidates) < len(list(full.get_candidates()))
+    for left_id, right_id, _ in candidates:
+        assert left_id in changed or right_id in changed
+
+
+def test_xref_incremental_limit(index_path: Path, donations_json, tmp_path: Path):
+    resolver = Resolver[CompositeEntity]()
+    store, changed = _changed_store(donations_json, resolver)
+    dataset = store.dataset
+    later = CompositeEntity.from_data(dataset, {"id": "later", "schema": "Person"})
+    later.add("name", "Somebody Else")
+    later.last_change = "2024-07-01T00:00:00"
+    with store.writer() as writer:
+        writer.add_entity(later)
+    watermark = tmp_path / "watermark"
+    watermark.write_text("2024-03-01T00:00:00")
+    xref(resolver, store, index_path, watermark=watermark, limit=1)
+    first = list(resolver.get_candidates())
+
+    # The watermark advances, and keeps the entities which were not reached:
+    mark = XrefWatermark(watermark)
+    assert mark.load()
+    assert mark.since == "2024-07-01T00:00:00"
+    assert 0 < len(mark.pending) and set(mark.pending) <= changed | {"later"}
+
+    # The next run still matches them, though they did not change since:
+    xref(resolver, store, index_path, watermark=watermark)
+    assert watermark.read_text() == "2024-07-01T00:00:00"
+    candidates = set((left, right) for left, right, _ in resolver.get_candidates())
+    assert len(first) < len(candidates)
+
+    assert mark.load() and mark.pending == []
+
+    # Only the remaining pairs of the first entity which was partly decided are
+    # dropped, like the pairs beyond the limits of a full run:
+    once = Resolver[CompositeEntity]()
+    watermark.write_text("2024-03-01T00:00:00")
+    xref(once, store, index_path, watermark=watermark)
+    expected = set((left, right) for left, right, _ in once.get_candidates())
+    assert candidates <= expected
+    partial = set(i for pair in expected - candidates for i in pair)
+    assert len(partial.intersection(changed)) <= 1
+
+
+def test_xref_incremental_max_pairs(index_path: Path, donations_json, tmp_path: Path):
+    resolver = Resolver[CompositeEntity]()
+    store, changed = _changed_store(donations_json, resolver)
+    watermark = tmp_path / "watermark"
+    watermark.write_text("2024-03-01T00:00:00")
+    # Blocking stops at `limit * limit_factor` pairs before the limit is hit:
+    xref(resolver, store, index_path, watermark=watermark, limit=3, limit_factor=1)
+    assert 0 < len(list(resolver.get_candidates())) <= 3
+    mark = XrefWatermark(watermark)
+    assert mark.load()
+    assert mark.since == "2024-06-01T00:00:00"
+    assert 0 < len(mark.pending) and set(mark.pending) <= changed
+    for _ in range(len(changed)):
+        xref(resolver, store, index_path, watermark=watermark, limit=3, limit_factor=1)
+    assert mark.load() and mark.pending == []
+
+
+def test_xref_watermark_full(
+    index_path: Path, dstore: SimpleMemoryStore, tmp_path: Path
+):
+    # A full run which fills `max_pairs` still starts the incremental runs, also
+    # if the store records no changes:
+    watermark = tmp_path / "watermark"
+    resolver = Resolver[CompositeEntity]()
+    xref(resolver, dstore, index_path, watermark=watermark, limit=5, limit_factor=1)
+    mark = XrefWatermark(watermark)
+    assert mark.load()
+    assert mark.since is not None and mark.pending == []
+    xref(resolver, dstore, index_path, watermark=watermark, limit=5, limit_factor=1)
+    assert mark.load() and mark.pending != []